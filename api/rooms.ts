@@ -1,3 +1,5 @@
+import { authHeaders } from "@/lib/utils"
+
 export type OperatingRoom = {
     id: number
     name: string
@@ -9,8 +11,7 @@ export type OperatingRoom = {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
-        // Add authorization header if needed
-        // 'Authorization': `Bearer ${sessionStorage.getItem('authToken')}`
+        ...authHeaders(),
       },
     })
   
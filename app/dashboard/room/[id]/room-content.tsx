@@ -13,6 +13,7 @@ import { ArrowLeft, Download, Pencil } from "lucide-react"
 import EventTable from "@/components/ui/EventTable"
 import { TableProvider } from "@/components/TableContext"
 import { ConversationProvider, useConversation } from "@/components/ConversationContext"
+import { authHeaders } from "@/lib/utils"
 
 interface OperationDetails {
   patient_first_name: string
@@ -38,7 +39,7 @@ const TranscriptionContent = ({ operationId, operationDetails }: OperationIdProp
     try {
       const response = await fetch("http://localhost:5000/api/downloadReport", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify({
           conversationId,
           operationId,
@@ -115,7 +116,7 @@ export function RoomContent({ params }: RoomContentProps) {
     try {
       const userResponse = await fetch("http://localhost:5000/api/userId", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify({
           userEmail,
         }),
@@ -131,7 +132,7 @@ export function RoomContent({ params }: RoomContentProps) {
 
       const operationResponse = await fetch("http://localhost:5000/api/createOperation", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify({
           roomId: roomId,
           userId: user_id,
@@ -1,25 +1,65 @@
-import datetime
 from datetime import datetime, timedelta
 from collections import namedtuple
 from pathlib import Path
-from services.eleven_labs import *
-from utils.report_generator import *
+from services.eleven_labs import get_conversation_service
+from services.event_archive import event_archiver
+from services.replica import replica_refresher
+from services.bulk_export import ExportBusy, ExportError, Selection, stream_export
+from services.event_bus import event_bus, TooManySubscribers
+from services.event_writer import event_writer, ACK_COMMITTED, ACK_QUEUED, ACK_MODES
+from services.narcotics import NarcoticsError, summary as narcotics_summary
+from services.password_hasher import password_hasher, HasherBusy, TooManyAttempts
+from services.report_cache import report_cache
+from services.report_jobs import report_jobs, QueueFull, JOB_DONE
+from services.report_state import report_states
+from services.room_cache import room_cache
+from services.search import SearchError, search
+from services.sequences import operation_ids
+import auth
 import database
 import jwt
+import logging
+import observability
 import os
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, g, jsonify, make_response, request, send_file
+from observability import REPORT_PHASE_SECONDS, timed
 from flask_cors import CORS, cross_origin
-from werkzeug.security import check_password_hash, generate_password_hash
 from sqlite3 import IntegrityError
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
 
 
+observability.configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-app.config['SECRET_KEY'] = 'your_secret_key'
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['ETag'])
+# Every worker process must share the same key to accept each other's tokens
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your_secret_key')
+app.teardown_appcontext(database.close_db_connection)
+# Registered before auth so rejected requests are timed too
+observability.init_app(app)
+auth.init_app(app)
+
+# New events make any cached report of their operation stale
+event_writer.add_listener(lambda rows: report_cache.invalidate({row[0] for row in rows}))
+# Committed events are pushed to the operation's live streams
+event_writer.add_listener(event_bus.publish_committed)
+# and laid out as report rows while the surgery is still going on
+event_writer.add_listener(report_states.update)
+# Reports rendered by the job queue are cached like synchronous ones
+report_jobs.add_listener(lambda job: report_cache.put(job.operation_id, job.cache_key, BytesIO(job.report)))
+
+
+@app.errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    busy = jsonify({'message': 'Too many logins in progress, retry later', 'error': str(e)})
+    busy.headers['Retry-After'] = '1'
+    return busy, 503
+
+
+@app.errorhandler(TooManyAttempts)
+def too_many_password_attempts(e):
+    return jsonify({'message': 'Too many login attempts in progress', 'error': str(e)}), 429
 
 
 def generate_token(user):
@@ -50,16 +90,16 @@ def register():
     if not all([first_name, last_name, email, password, role]):
         return jsonify({'message': 'Missing required fields'}), 400
 
-    hashed_password = generate_password_hash(password)
     conn = database.get_db_connection()
     cursor = conn.cursor()
 
     # Pre-check: see if the email already exists
     existing_user = cursor.execute('SELECT id FROM Users WHERE email = ?', (email,)).fetchone()
     if existing_user:
-        conn.close()
         return jsonify({'message': 'User with this email already exists'}), 400
 
+    hashed_password = password_hasher.hash(password, clients=(request.remote_addr, email))
+
     try:
         # Attempt to insert new user
         cursor.execute(
@@ -71,12 +111,10 @@ def register():
     except Exception as e:
         # Roll back any changes on error and return a server error message
         conn.rollback()
-        conn.close()
         return jsonify({'message': 'Failed to register user', 'error': str(e)}), 500
 
     # Fetch the newly inserted user
     user = cursor.execute('SELECT * FROM Users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
 
     token = generate_token(user)
     return jsonify({
@@ -103,11 +141,19 @@ def login():
 
     conn = database.get_db_connection()
     user = conn.execute('SELECT * FROM Users WHERE email = ?', (email,)).fetchone()
-    conn.close()
 
-    if user is None or not check_password_hash(user['password'], password):
+    if user is None:
+        return jsonify({'message': 'Invalid credentials'}), 401
+
+    matches, new_hash = password_hasher.verify(user['password'], password, clients=(request.remote_addr, email))
+    if not matches:
         return jsonify({'message': 'Invalid credentials'}), 401
 
+    if new_hash is not None:
+        # Hashing parameters changed since this password was stored
+        conn.execute('UPDATE Users SET password = ? WHERE id = ?', (new_hash, user['id']))
+        conn.commit()
+
     token = generate_token(user)
     return jsonify({
         'token': token,
@@ -124,10 +170,14 @@ def login():
 @app.route('/api/userId', methods=['POST'])
 @cross_origin()
 def get_user_id():
+    # The id is already in the caller's token, so asking about yourself needs no query
+    claims = g.claims
+    if claims is not None and claims.get('email') == request.json.get('userEmail', claims.get('email')):
+        return jsonify({"status": "success", "user_id": claims['id']}), 200
+
     conn = database.get_db_connection()
     cursor = conn.cursor()
     user_id = cursor.execute("SELECT id FROM Users WHERE email = ?", (request.json['userEmail'],)).fetchone()
-    conn.close()
 
     if user_id is None:
         return jsonify({"status": "error", "message": "User not found"}), 404
@@ -138,19 +188,39 @@ def get_user_id():
 @app.route('/api/rooms', methods=['GET'])
 @cross_origin()
 def get_rooms():
-    conn = database.get_db_connection()
-    rooms = conn.execute("SELECT room_id, name, is_available FROM OperatingRoom").fetchall()
-    conn.close()
-
-    room_list = [
-        {
-            "id": room["room_id"],
-            "name": room["name"],
-            "status": "Available" if room["is_available"] else "In Use"
-        }
-        for room in rooms
-    ]
-    return jsonify(room_list)
+    # Served from the in-process room cache; its version is the ETag
+    version, room_list = room_cache.snapshot()
+    etag = str(version)
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+
+    response = jsonify(room_list)
+    response.set_etag(etag)
+    # Browsers revalidate with If-None-Match instead of refetching the list
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/rooms/changes', methods=['GET'])
+@cross_origin()
+def get_room_changes():
+    # Rooms changed since the given version; everything when it is too old
+    since = request.args.get('since', type=int)
+    version, rooms, full = room_cache.changes_since(since)
+    return jsonify({"version": version, "full": full, "rooms": rooms}), 200
+
+
+@app.route('/api/rooms/<int:room_id>', methods=['PATCH'])
+@cross_origin()
+def update_room(room_id):
+    is_available = request.json.get('isAvailable')
+    if not isinstance(is_available, bool):
+        return jsonify({"status": "error", "message": "isAvailable must be true or false"}), 400
+
+    room = room_cache.set_available(room_id, is_available)
+    if room is None:
+        return jsonify({"status": "error", "message": "Room not found"}), 404
+    return jsonify(room), 200
 
 
 @app.route('/api/createOperation', methods=['POST'])
@@ -158,9 +228,22 @@ def get_rooms():
 def operation():
     op_details = request.json
 
-    Operation = namedtuple('Operation', ['room_id', 'user_id', 'patient_first_name', 'patient_last_name', 'patient_id', 'operation_type'])
+    # Ids come from the operation counter; a theatre may pass one it reserved
+    # earlier for the same room
+    if op_details.get('operationId') is not None:
+        operation_id = int(op_details['operationId'])
+        reserved_room = operation_ids.reserved_room(operation_id)
+        if reserved_room is None:
+            return jsonify({"status": "error", "message": "Operation id was not reserved"}), 400
+        if reserved_room != int(op_details['roomId']):
+            return jsonify({"status": "error", "message": "Operation id was reserved for another room"}), 403
+    else:
+        operation_id = operation_ids.next_id()
+
+    Operation = namedtuple('Operation', ['operation_id', 'room_id', 'user_id', 'patient_first_name', 'patient_last_name', 'patient_id', 'operation_type'])
 
     new_operation = Operation(
+        operation_id,
         op_details['roomId'], 
         op_details['userId'], 
         op_details['patientFirstName'], 
@@ -170,64 +253,306 @@ def operation():
     )
 
     # Insert note into database
-    operation_id = database.insert_into("Operation", new_operation._fields, new_operation)
+    try:
+        database.insert_into("Operation", new_operation._fields, new_operation)
+    except IntegrityError:
+        return jsonify({"status": "error", "message": "Operation id already in use"}), 409
     
     # Return a confirmation response
     return jsonify({"status": "success", "received": op_details, "operationId": operation_id}), 200
 
 
+@app.route('/api/operationIds', methods=['POST'])
+@cross_origin()
+def reserve_operation_ids():
+    # Reserves a contiguous range of ids for one room, to pass to
+    # createOperation later
+    payload = request.get_json(silent=True) or {}
+    count = payload.get('count', 1)
+    room_id = payload.get('roomId')
+    if not isinstance(count, int) or not 1 <= count <= 100:
+        return jsonify({"status": "error", "message": "count must be between 1 and 100"}), 400
+    if not isinstance(room_id, int):
+        return jsonify({"status": "error", "message": "roomId is required"}), 400
+    user_id = g.claims['id'] if g.claims is not None else payload.get('userId')
+    return jsonify({"status": "success", "operationIds": operation_ids.reserve(count, room_id, user_id)}), 200
+
+
+Events = namedtuple('Events', ['operation_id', 'event_type', 'event_value'])
+
+
+def parse_event(chat_note):
+    return Events(int(chat_note['operationId']), chat_note['eventType'], chat_note['eventValue'])
+
+
+def submit_events(rows, ack):
+    # None once the events are queued or committed, else the error response.
+    # retrySafe tells the client whether sending them again can store them twice.
+    try:
+        event_writer.submit(rows, ack)
+    except TimeoutError as e:
+        # Still queued, so they may be committed after all
+        busy = jsonify({'message': 'Events were not committed in time and may still be saved',
+                        'error': str(e), 'retrySafe': False})
+        busy.headers['Retry-After'] = '1'
+        return busy, 503
+    except Exception as e:
+        # Their transaction was rolled back; nothing was saved
+        return jsonify({'message': 'Saving events failed', 'error': str(e), 'retrySafe': True}), 500
+    return None
+
+
 @app.route('/api/sendNotes', methods=['POST'])
 @cross_origin()
 def notes():
     chat_note = request.json
+    ack = chat_note.get('ack', ACK_COMMITTED)
+    if ack not in ACK_MODES:
+        return jsonify({'message': f'ack must be one of {", ".join(ACK_MODES)}'}), 400
 
-    Events = namedtuple('Events', ['operation_id', 'event_type', 'event_value'])
+    new_events = parse_event(chat_note)
 
-    new_events = Events(int(chat_note['operationId']), chat_note['eventType'], chat_note['eventValue'])
+    # Insert note into database through the write-behind writer
+    failed = submit_events([new_events], ack)
+    if failed is not None:
+        return failed
 
-    # Insert note into database
-    database.insert_into("Events", new_events._fields, new_events)
-    
     # Return a confirmation response
+    if ack == ACK_QUEUED:
+        return jsonify({"status": "queued", "received": chat_note}), 202
     return jsonify({"status": "success", "received": chat_note}), 200
 
 
+@app.route('/api/sendNotesBatch', methods=['POST'])
+@cross_origin()
+def notes_batch():
+    payload = request.json
+    ack = payload.get('ack', ACK_COMMITTED)
+    if ack not in ACK_MODES:
+        return jsonify({'message': f'ack must be one of {", ".join(ACK_MODES)}'}), 400
+
+    try:
+        new_events = [parse_event(chat_note) for chat_note in payload['events']]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'message': 'Invalid events payload'}), 400
+
+    failed = submit_events(new_events, ack)
+    if failed is not None:
+        return failed
+
+    if ack == ACK_QUEUED:
+        return jsonify({"status": "queued", "count": len(new_events)}), 202
+    return jsonify({"status": "success", "count": len(new_events)}), 200
+
+
 @app.route('/api/downloadReport', methods=['POST'])
 def report():
+    # reportlab is loaded with the first report, not with the app
+    from utils.report_generator import create_report, report_filename
+
     chat_note = request.json
-    print(chat_note)
+    logger.debug("Report requested", extra={
+        'operation_id': chat_note['operationId'], 'conversation_id': chat_note['conversationId']
+    })
 
-    elevenLabsService = ElevenLabsService(os.getenv('ELEVENLABS_API_KEY'))
-    response = elevenLabsService.get_conversation(chat_note['conversationId'])
-    
-    response = json.loads(response)
+    operation_id = chat_note['operationId']
+    output_filename = report_filename(chat_note['surgeryDetails'])
+    cache_key = report_cache.make_key(
+        chat_note['conversationId'],
+        operation_id,
+        chat_note['surgeryDetails'],
+        database.get_event_fingerprint(operation_id)
+    )
+
+    # The cache key doubles as the ETag, so a client holding the current
+    # report gets a 304 without the conversation being fetched or rendered
+    if cache_key in request.if_none_match:
+        not_modified = make_response('', 304)
+        not_modified.set_etag(cache_key)
+        return not_modified
+
+    # Kept so bulk exports can fetch the conversation again later
+    database.save_operation_conversation(operation_id, chat_note['conversationId'])
+
+    report_buffer = report_cache.get(operation_id, cache_key)
+    if report_buffer is None and chat_note.get('async'):
+        # Rendering happens in the worker pool; the client polls the job
+        try:
+            job = report_jobs.submit(chat_note['conversationId'], chat_note['surgeryDetails'], operation_id, cache_key)
+        except QueueFull as e:
+            busy = jsonify({'message': 'Report queue is full, retry later', 'error': str(e)})
+            busy.headers['Retry-After'] = '5'
+            return busy, 503
+        return jsonify(job.to_dict()), 202
+
+    if report_buffer is None:
+        # Long-lived client with keep-alive and a TTL cache; returns the parsed conversation
+        with timed(REPORT_PHASE_SECONDS, phase='fetch'):
+            response = get_conversation_service().get_conversation(chat_note['conversationId'])
+
+        report_buffer, output_filename = create_report(
+            response, chat_note['surgeryDetails'], operation_id, report_states.rows(operation_id)
+        )
+        report_cache.put(operation_id, cache_key, report_buffer)
+
+    logger.info("Report sent", extra={'operation_id': operation_id, 'bytes': report_buffer.seek(0, os.SEEK_END)})
+    report_buffer.seek(0)
+
+    return send_file(report_buffer, mimetype='application/pdf', as_attachment=False, download_name=output_filename, etag=cache_key)
+
+
+@app.route('/api/reportExports', methods=['POST'])
+@cross_origin()
+def export_reports():
+    # {"from": "2025-03-01", "to": "2025-04-01"} or {"operationIds": [...]}, optionally
+    # "conversations": {operationId: conversationId} and "afterOperationId" to resume
+    payload = request.json
+    try:
+        selection = Selection(
+            payload.get('from'), payload.get('to'), payload.get('operationIds'), payload.get('conversations')
+        )
+        stream = stream_export(selection, int(payload.get('afterOperationId', 0)))
+    except (ExportError, TypeError, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+    except ExportBusy as e:
+        busy = jsonify({'message': 'An export is already running, retry later', 'error': str(e)})
+        busy.headers['Retry-After'] = '30'
+        return busy, 503
+
+    return Response(stream, mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename="surgery_reports.zip"'
+    })
+
+
+@app.route('/api/reportJobs/<job_id>', methods=['GET'])
+@cross_origin()
+def report_job_status(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/reportJobs/<job_id>/report', methods=['GET'])
+@cross_origin()
+def report_job_result(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    if job.status != JOB_DONE:
+        return jsonify(job.to_dict()), 409
+
+    # Jobs rendered by another worker process are served from the report cache
+    report = BytesIO(job.report) if job.report is not None else report_cache.get(job.operation_id, job.cache_key)
+    if report is None:
+        return jsonify({"status": "error", "message": "Report is no longer cached, download it again"}), 410
+
+    return send_file(report, mimetype='application/pdf', as_attachment=False, download_name=job.filename, etag=job.cache_key)
+
+
+@app.route('/api/reportCache', methods=['GET'])
+@cross_origin()
+def report_cache_stats():
+    return jsonify({**report_cache.stats(), 'reportRows': report_states.stats()}), 200
 
-    report_buffer, output_filename = create_report(response, chat_note['surgeryDetails'], chat_note['operationId'])
-    # Print buffer size
-    print("Buffer size:")
-    print(report_buffer.getbuffer().nbytes)
-    print("=====")
 
-    return send_file(report_buffer, mimetype='application/pdf', as_attachment=False, download_name=output_filename)
+@app.route('/api/search', methods=['GET'])
+@cross_origin()
+def search_notes():
+    # /api/search?q=fentanyl&scope=operations&from=2025-03-01&to=2025-04-01&roomId=2
+    args = request.args
+    try:
+        page = search(
+            args.get('q'),
+            scope=args.get('scope', 'events'),
+            cursor=args.get('cursor', type=int),
+            limit=args.get('limit', 50, type=int),
+            since=args.get('from'),
+            until=args.get('to'),
+            room_id=args.get('roomId', type=int),
+            event_type=args.get('eventType')
+        )
+    except SearchError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(page), 200
+
+
+@app.route('/api/narcotics/summary', methods=['GET'])
+@cross_origin()
+def narcotics_usage_summary():
+    # /api/narcotics/summary?from=2025-03-01&to=2025-04-01&groupBy=room&drug=fentanyl
+    args = request.args
+    try:
+        usage = narcotics_summary(
+            group_by=args.get('groupBy', 'drug'),
+            since=args.get('from'),
+            until=args.get('to'),
+            drug=args.get('drug'),
+            room_id=args.get('roomId', type=int),
+            user_id=args.get('userId', type=int)
+        )
+    except NarcoticsError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(usage), 200
+
+
+@app.route('/api/operations/<int:operation_id>/events', methods=['GET'])
+@cross_origin()
+def stream_operation_events(operation_id):
+    # Server-sent events: the operation's stored events, then new ones as
+    # they are committed. EventSource resends the last id it saw on reconnect.
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId', 0))
+    except ValueError:
+        return jsonify({'message': 'Invalid Last-Event-ID'}), 400
+
+    try:
+        subscriber = event_bus.subscribe(operation_id)
+    except TooManySubscribers as e:
+        busy = jsonify({'message': 'Too many event streams open, retry later', 'error': str(e)})
+        busy.headers['Retry-After'] = '5'
+        return busy, 503
+
+    response = Response(event_bus.stream(subscriber, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Unsubscribes even when the client is gone before the stream starts
+    response.call_on_close(lambda: event_bus.unsubscribe(subscriber))
+    return response
+
+
+@app.route('/api/eventStreams', methods=['GET'])
+@cross_origin()
+def event_stream_stats():
+    return jsonify(event_bus.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format: request, query, report phase and ElevenLabs latencies
+    return observability.metrics_response()
 
 
 @app.route('/api/lastOperationId', methods=['GET'])
 @cross_origin()
 def last_operation_id():
-    recent_op_id = database.get_last_operation_id()
-    # Ensure a numeric value is returned even if the table is empty
-    max_id = recent_op_id[0] if recent_op_id[0] is not None else 0
-    return jsonify({"max_operation_id": max_id}), 200
+    # The most recently created operation, not the highest reserved id
+    return jsonify({"max_operation_id": database.get_last_operation_id()}), 200
 
 
 def main():
-    sqlite_file = Path("hospital.db")
-    
-    if not sqlite_file.exists():
-        database.create_database()
+    sqlite_file = Path(database.DB_PATH)
+    is_new_database = not sqlite_file.exists()
+
+    # Brings existing databases up to the latest schema version as well
+    database.migrate_database(progress=logger.info)
+
+    if is_new_database:
         database.insert_sample_data()
 
 
 if __name__ == '__main__':
     main()
+    event_archiver.start()
+    replica_refresher.start()
     app.run(port='5000')
\ No newline at end of file
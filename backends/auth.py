@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from flask import g, jsonify, request
+
+
+# With API_AUTH_REQUIRED=1 every /api route needs a valid bearer token;
+# otherwise tokens are verified when sent and their claims used when valid
+AUTH_REQUIRED = os.getenv('API_AUTH_REQUIRED', '0') == '1'
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '1024'))
+
+
+class TokenVerifier:
+    def __init__(self, secret, cache_size=TOKEN_CACHE_SIZE):
+        self.secret = secret
+        self.cache_size = cache_size
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        # A token's signature is only checked the first time it is seen; after
+        # that its claims come from the cache until the token expires
+        signature = token.rpartition('.')[2]
+        with self._lock:
+            entry = self._verified.get(signature)
+            if entry is not None:
+                cached_token, claims = entry
+                if cached_token == token and claims.get('exp', 0) > time.time():
+                    self._verified.move_to_end(signature)
+                    return claims
+                del self._verified[signature]
+
+        # Raises jwt.InvalidTokenError (including ExpiredSignatureError)
+        claims = jwt.decode(token, self.secret, algorithms=['HS256'])
+
+        with self._lock:
+            self._verified[signature] = (token, claims)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return claims
+
+
+def bearer_token():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        # EventSource cannot set headers, so event streams pass the token in the URL
+        return request.args.get('access_token')
+    return token.strip()
+
+
+def init_app(app, required=AUTH_REQUIRED):
+    verifier = TokenVerifier(app.config['SECRET_KEY'])
+    app.extensions['token_verifier'] = verifier
+
+    @app.before_request
+    def authenticate_request():
+        # Decoded claims are exposed as g.claims for the rest of the request
+        g.claims = None
+        if request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+            return None
+
+        token = bearer_token()
+        if token is None:
+            if required:
+                return jsonify({'message': 'Missing token'}), 401
+            return None
+
+        try:
+            g.claims = verifier.verify(token)
+        except jwt.InvalidTokenError as e:
+            if required:
+                return jsonify({'message': 'Invalid token', 'error': str(e)}), 401
+        return None
+
+    return verifier
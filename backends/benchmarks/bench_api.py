@@ -0,0 +1,65 @@
+import argparse
+import os
+import tempfile
+import time
+
+import api
+import database
+
+
+# Run from the backends folder: python -m benchmarks.bench_api
+# Compares the pooled connection manager against one connection per call
+# (pool size 0 closes every connection on release, like the old helpers).
+
+def setup_database(path):
+    database.init_pool(path)
+    database.create_database()
+    database.insert_sample_data()
+
+
+def bench(client, method, url, payload, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.open(url, method=method, json=payload)
+        assert response.status_code < 400, response.status_code
+    elapsed = time.perf_counter() - start
+    return requests / elapsed
+
+
+def run(pool_size, requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "hospital.db")
+        setup_database(path)
+        pool = database.init_pool(path, pool_size)
+
+        client = api.app.test_client()
+        credentials = {'email': 'bench@example.com', 'password': 'bench'}
+        client.post('/auth/register', json={
+            **credentials, 'firstName': 'Bench', 'lastName': 'User', 'role': 'Doctor'
+        })
+
+        note = {'operationId': 1, 'eventType': 'medicine', 'eventValue': 'Fentanyl 50mcg'}
+        results = {
+            '/api/sendNotes': bench(client, 'POST', '/api/sendNotes', note, requests),
+            '/auth/login': bench(client, 'POST', '/auth/login', credentials, max(requests // 20, 1)),
+        }
+        pool.close_all()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pool-size', type=int, default=database.POOL_SIZE)
+    args = parser.parse_args()
+
+    before = run(0, args.requests)
+    after = run(args.pool_size, args.requests)
+
+    print(f"{'endpoint':<20}{'per-call req/s':>16}{'pooled req/s':>16}")
+    for endpoint in before:
+        print(f"{endpoint:<20}{before[endpoint]:>16.1f}{after[endpoint]:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+import time
+
+import jwt
+
+import api
+import auth
+import database
+
+
+# Run from the backends folder: python -m benchmarks.bench_auth
+# /api/userId answered from the Users table against the same call answered
+# from the verified token's claims, and token verification with and without
+# the verified-token cache.
+
+def bench(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+        database.create_database()
+
+        client = api.app.test_client()
+        credentials = {'email': 'bench@example.com', 'password': 'bench'}
+        token = client.post('/auth/register', json={
+            **credentials, 'firstName': 'Bench', 'lastName': 'User', 'role': 'Doctor'
+        }).json['token']
+        payload = {'userEmail': credentials['email']}
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def user_id(**kwargs):
+            response = client.post('/api/userId', json=payload, **kwargs)
+            assert response.status_code == 200, response.status_code
+
+        lookup = bench(user_id, args.requests)
+        claims = bench(lambda: user_id(headers=headers), args.requests)
+
+        secret = api.app.config['SECRET_KEY']
+        decode = bench(lambda: jwt.decode(token, secret, algorithms=['HS256']), args.requests * 10)
+        verifier = auth.TokenVerifier(secret)
+        cached = bench(lambda: verifier.verify(token), args.requests * 10)
+
+        pool.close_all()
+
+    print(f"/api/userId, Users lookup:  {lookup:10.1f} req/s")
+    print(f"/api/userId, token claims:  {claims:10.1f} req/s")
+    print(f"jwt.decode every call:      {decode:10.1f} /s")
+    print(f"verified-token cache:       {cached:10.1f} /s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+# Must be set before services.eleven_labs builds its client
+FIXTURES_DIR = tempfile.mkdtemp(prefix='bench-export-')
+os.environ['ELEVENLABS_FIXTURES_DIR'] = FIXTURES_DIR
+
+import database
+from benchmarks.synthetic import generate_database, write_fixture
+from services import bulk_export
+from services.eleven_labs import get_conversation_service
+from utils.report_generator import create_report
+
+
+# Run from the backends folder: python -m benchmarks.bench_bulk_export --operations 100
+# Reports for a range of operations, one after another as repeated
+# /api/downloadReport calls would render them, against a streamed bulk export.
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operations', type=int, default=100)
+    parser.add_argument('--events', type=int, default=200, help="Events per operation")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 2])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'hospital.db')
+        generate_database(path, 10, 5, args.operations, args.operations * args.events, 'unused')
+        conversation_id = write_fixture(FIXTURES_DIR, args.events)
+        pool = database.init_pool(path)
+        for operation_id in range(1, args.operations + 1):
+            database.save_operation_conversation(operation_id, conversation_id)
+        selection = bulk_export.Selection(operation_ids=range(1, args.operations + 1))
+        items = selection.page()[0]
+
+        start = time.perf_counter()
+        size = 0
+        for item in items:
+            conversation = get_conversation_service().get_conversation(item.conversation_id)
+            report_buffer, _ = create_report(conversation, item.surgery_details, item.operation_id)
+            with report_buffer:
+                size += len(report_buffer.read())
+        sequential = time.perf_counter() - start
+        print(f"sequential: {sequential:.1f} s, {len(items) / sequential:.1f} reports/s, {size / 2**20:.1f} MB")
+
+        for workers in args.workers:
+            bulk_export.bulk_exporter.shutdown()
+            bulk_export.bulk_exporter = bulk_export.BulkExporter(8, workers, 1)
+            start = time.perf_counter()
+            first_report = None
+            size = 0
+            for chunk in bulk_export.stream_export(selection):
+                if first_report is None and len(chunk) > 0:
+                    first_report = time.perf_counter() - start
+                size += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"bulk, {workers} render workers: {elapsed:.1f} s, {len(items) / elapsed:.1f} reports/s, "
+                  f"first bytes after {first_report:.2f} s, {size / 2**20:.1f} MB")
+        bulk_export.bulk_exporter.shutdown()
+        pool.close_all()
+    shutil.rmtree(FIXTURES_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import database
+from benchmarks.synthetic import make_event_rows
+from services.sequences import SequenceAllocator
+
+
+# Run from the backends folder: python -m benchmarks.bench_counters
+# The old MAX(operation_id) FROM Events lookup against the operation counter,
+# and operation id allocation from many threads in several processes at
+# once; fails if any id is handed out twice.
+
+def allocate(path, block_size, threads, ids_per_thread):
+    database.init_pool(path)
+    allocator = SequenceAllocator('operation', block_size)
+    allocated = []
+
+    def worker():
+        ids = [allocator.next_id() for _ in range(ids_per_thread)]
+        allocated.extend(ids)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return allocated
+
+
+def time_lookup(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ids', type=int, default=100, help='ids allocated per thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "hospital.db")
+        pool = database.init_pool(path)
+        database.create_database()
+        for operation_id in range(1, 101):
+            database.insert_many("Events", ("operation_id", "event_type", "event_value"),
+                                 make_event_rows(operation_id, args.events // 100))
+
+        def legacy_lookup():
+            with database.connection() as conn:
+                return conn.execute("SELECT MAX(operation_id) FROM Events").fetchone()
+
+        def unindexed_lookup():
+            with database.connection() as conn:
+                return conn.execute("SELECT MAX(+operation_id) FROM Events").fetchone()
+
+        print(f"last operation id over {args.events} events:")
+        print(f"  MAX(operation_id) FROM Events, full scan {time_lookup(unindexed_lookup, 20):10.1f} us")
+        print(f"  MAX(operation_id) FROM Events, indexed   {time_lookup(legacy_lookup, 2000):10.1f} us")
+        print(f"  MAX(operation_id) FROM Operation         {time_lookup(database.get_last_operation_id, 2000):10.1f} us")
+        print(f"  operation counter                        "
+              f"{time_lookup(lambda: database.get_counter('operation'), 2000):10.1f} us")
+        pool.close_all()
+
+        context = multiprocessing.get_context('spawn')
+        expected = args.processes * args.threads * args.ids
+        for block_size in (1, 16):
+            start = time.perf_counter()
+            with context.Pool(args.processes) as workers:
+                results = workers.starmap(allocate, [(path, block_size, args.threads, args.ids)] * args.processes)
+            elapsed = time.perf_counter() - start
+
+            allocated = [allocated_id for ids in results for allocated_id in ids]
+            assert len(allocated) == expected, len(allocated)
+            assert len(set(allocated)) == expected, "an operation id was allocated twice"
+            print(f"block size {block_size:>2}: {expected} unique ids from {args.processes} processes x "
+                  f"{args.threads} threads in {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
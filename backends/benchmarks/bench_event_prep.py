@@ -0,0 +1,104 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph, TableStyle
+
+from benchmarks.synthetic import event_value, make_transcript
+from utils import report_generator
+
+
+# Run from the backends folder: python -m benchmarks.bench_event_prep
+# Event preparation, cell layout and table striping for 1k/10k/100k-event
+# operations: the per-row code create_report used to run against the batched
+# stage. Prep is the transcript walk and timestamp conversion on both sides
+# (batched rows are built beforehand); layout is wrapping the cell texts to
+# the column widths, per row in paragraphs before, once per event value now.
+
+def legacy_prepare_events(transcript, event_timestamps_by_value):
+    events = []
+    for element in transcript:
+        if not element['tool_calls']:
+            continue
+        for tool_call in element['tool_calls']:
+            if tool_call.get('tool_name') != 'displayEvent':
+                continue
+            params_dict = json.loads(tool_call.get('params_as_json', '{}'))
+            event_timestamp = event_timestamps_by_value.get(params_dict['eventValue'])
+            if event_timestamp:
+                utc_time = pytz.utc.localize(datetime.strptime(event_timestamp, "%Y-%m-%d %H:%M:%S"))
+                warsaw_time = utc_time.astimezone(pytz.timezone("Europe/Warsaw"))
+                event_timestamps = warsaw_time.strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                event_timestamps = " "
+            events.append([event_timestamps, params_dict['eventValue']])
+    return events
+
+
+def legacy_layout(events):
+    # What the table did with every paragraph cell when laying itself out
+    style = ParagraphStyle('CellStyle')
+    for row in events:
+        for text, width in zip(row, report_generator.EVENT_COLUMN_WIDTHS):
+            Paragraph(text, style).wrap(width - 2 * report_generator.EVENT_CELL_PADDING, 10000)
+
+
+def legacy_striping(rows):
+    style = TableStyle([])
+    for i in range(1, rows + 1):
+        if i % 2 == 0:
+            style.add('BACKGROUND', (0, i), (-1, i), colors.Color(0.95, 0.95, 0.95))
+        else:
+            style.add('BACKGROUND', (0, i), (-1, i), colors.Color(1, 1, 1))
+    return style
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    template = report_generator.get_report_template()
+    start = datetime(2025, 3, 30)
+
+    print(f"{'events':>8}{'per-row prep ms':>18}{'batched prep ms':>18}{'per-row layout ms':>19}"
+          f"{'batched layout ms':>19}{'per-row style ms':>18}{'one style ms':>14}")
+    for events in args.events:
+        transcript = make_transcript(events)['transcript']
+        timestamps = {
+            event_value(i): (start + timedelta(seconds=3 * i)).strftime("%Y-%m-%d %H:%M:%S")
+            for i in range(events)
+        }
+
+        legacy, legacy_ms = timed(lambda: legacy_prepare_events(transcript, timestamps))
+        rows = report_generator.build_event_rows(timestamps, template)
+        batched, batched_ms = timed(lambda: (
+            report_generator.convert_timestamps(timestamps.values(), template.timezone),
+            report_generator.prepare_events(transcript, rows, template),
+        )[1])
+        assert [row[0] for row in legacy] == [row.cells[0] for row in batched]
+
+        _, legacy_layout_ms = timed(lambda: legacy_layout(legacy))
+        local_times = report_generator.convert_timestamps(timestamps.values(), template.timezone)
+        _, layout_ms = timed(lambda: [
+            template.event_row(local_times.get(timestamp, " "), value) for value, timestamp in timestamps.items()
+        ])
+
+        _, legacy_style_ms = timed(lambda: legacy_striping(events))
+        _, style_ms = timed(lambda: template.make_events_table([]))
+
+        print(f"{events:>8}{legacy_ms:>18.1f}{batched_ms:>18.1f}{legacy_layout_ms:>19.1f}"
+              f"{layout_ms:>19.1f}{legacy_style_ms:>18.1f}{style_ms:>14.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import httpx
+from werkzeug.serving import make_server
+
+import api
+import database
+from services.event_bus import event_bus
+
+
+# Run from the backends folder: python -m benchmarks.bench_event_stream
+# Hundreds of dashboards subscribed to /api/operations/<id>/events on a
+# threaded server while notes are posted; measures commit-to-delivery latency.
+
+def subscribe(base_url, operation_id, expected, sent_at, latencies, errors):
+    received = 0
+    try:
+        with httpx.Client(timeout=60) as client:
+            with client.stream('GET', f'{base_url}/api/operations/{operation_id}/events?lastEventId=0') as response:
+                for line in response.iter_lines():
+                    if not line.startswith('data: '):
+                        continue
+                    event = json.loads(line[len('data: '):])
+                    latencies.append((time.perf_counter() - sent_at[event['eventValue']]) * 1000)
+                    received += 1
+                    if received == expected:
+                        return
+    except Exception as e:
+        errors.append(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=300)
+    parser.add_argument('--operations', type=int, default=10)
+    parser.add_argument('--events', type=int, default=50, help='events posted per operation')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+        database.create_database()
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, api.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        sent_at = {}
+        latencies = []
+        errors = []
+        subscribers = [
+            threading.Thread(target=subscribe, args=(
+                base_url, 1 + i % args.operations, args.events, sent_at, latencies, errors
+            ))
+            for i in range(args.subscribers)
+        ]
+        for thread in subscribers:
+            thread.start()
+        while event_bus.stats()['subscribers'] < args.subscribers and not errors:
+            time.sleep(0.05)
+
+        start = time.perf_counter()
+        with httpx.Client(base_url=base_url) as client:
+            for i in range(args.events):
+                for operation_id in range(1, args.operations + 1):
+                    value = f'Fentanyl {i}mcg (operation {operation_id})'
+                    sent_at[value] = time.perf_counter()
+                    client.post('/api/sendNotes', json={
+                        'operationId': operation_id, 'eventType': 'medicine', 'eventValue': value
+                    })
+        for thread in subscribers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        server.shutdown()
+        pool.close_all()
+
+    expected = args.subscribers * args.events
+    latencies.sort()
+    print(f"subscribers {args.subscribers}, operations {args.operations}, events posted {args.events * args.operations}")
+    print(f"delivered {len(latencies)}/{expected} in {elapsed:.1f} s, errors {len(errors)}")
+    if latencies:
+        print(f"delivery latency p50 {statistics.median(latencies):.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.1f} ms, max {latencies[-1]:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import api
+import database
+
+
+# Run from the backends folder: python -m benchmarks.bench_instrumentation
+# Cost of the metrics layer: a hot primary-key query on a plain sqlite3
+# connection against the instrumented one, and /api/lastOperationId with and
+# without the request timing hooks.
+
+def per_call_us(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "hospital.db")
+        pool = database.init_pool(path)
+        database.create_database()
+
+        query = "SELECT value FROM Counters WHERE name = ?"
+        plain = sqlite3.connect(path, cached_statements=256)
+        instrumented = sqlite3.connect(path, cached_statements=256, factory=database.InstrumentedConnection)
+        plain_us = per_call_us(lambda: plain.execute(query, ('operation', )).fetchone(), args.queries)
+        instrumented_us = per_call_us(lambda: instrumented.execute(query, ('operation', )).fetchone(), args.queries)
+        plain.close()
+        instrumented.close()
+
+        client = api.app.test_client()
+        hooked_us = per_call_us(lambda: client.get('/api/lastOperationId'), args.requests)
+        before, after = api.app.before_request_funcs[None], api.app.after_request_funcs[None]
+        api.app.before_request_funcs[None] = [f for f in before if f.__name__ != 'start_timer']
+        api.app.after_request_funcs[None] = [f for f in after if f.__name__ != 'record_request']
+        unhooked_us = per_call_us(lambda: client.get('/api/lastOperationId'), args.requests)
+        api.app.before_request_funcs[None], api.app.after_request_funcs[None] = before, after
+        pool.close_all()
+
+    print(f"PK query, plain connection:        {plain_us:8.2f} us")
+    print(f"PK query, instrumented connection: {instrumented_us:8.2f} us")
+    print(f"/api/lastOperationId, no hooks:    {unhooked_us:8.2f} us")
+    print(f"/api/lastOperationId, timed:       {hooked_us:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import api
+import database
+from services.password_hasher import PASSWORD_HASH_METHOD, PasswordHasher
+
+
+# Run from the backends folder: python -m benchmarks.bench_login
+# sendNotes latency while a login storm is running, with every login hashing
+# on its own request thread (as before) and with hashing bounded to the
+# password hasher's pool.
+
+def login_storm(client, credentials, stop, outcomes):
+    while not stop.is_set():
+        status = client.post('/auth/login', json=credentials).status_code
+        outcomes[status] = outcomes.get(status, 0) + 1
+        if status in (429, 503):
+            # Back off like a client honouring Retry-After
+            stop.wait(0.1)
+
+
+def run(hasher, login_threads, notes):
+    api.password_hasher = hasher
+    client = api.app.test_client()
+    credentials = {'email': 'bench@example.com', 'password': 'bench'}
+
+    stop = threading.Event()
+    outcomes = {}
+    storm = [
+        threading.Thread(target=login_storm, args=(api.app.test_client(), credentials, stop, outcomes))
+        for _ in range(login_threads)
+    ]
+    for thread in storm:
+        thread.start()
+    time.sleep(0.5)
+
+    latencies = []
+    note = {'operationId': 1, 'eventType': 'medicine', 'eventValue': 'Fentanyl 50mcg', 'ack': 'committed'}
+    for _ in range(notes):
+        start = time.perf_counter()
+        assert client.post('/api/sendNotes', json=note).status_code == 200
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    stop.set()
+    for thread in storm:
+        thread.join()
+    hasher.shutdown()
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)], outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--notes', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+        database.create_database()
+        database.insert_sample_data()
+        api.app.test_client().post('/auth/register', json={
+            'email': 'bench@example.com', 'password': 'bench', 'firstName': 'Bench', 'lastName': 'User', 'role': 'Doctor'
+        })
+
+        unbounded = PasswordHasher(PASSWORD_HASH_METHOD, args.login_threads, 1000, 1000, 30)
+        bounded = PasswordHasher(PASSWORD_HASH_METHOD, args.workers, 4, 1000, 30)
+        results = {
+            'hash per request': run(unbounded, args.login_threads, args.notes),
+            f'{args.workers} hash worker(s)': run(bounded, args.login_threads, args.notes),
+        }
+        pool.close_all()
+
+    print(f"{'logins':<20}{'sendNotes p50 ms':>18}{'p95 ms':>10}  login status counts")
+    for name, (p50, p95, outcomes) in results.items():
+        print(f"{name:<20}{p50:>18.1f}{p95:>10.1f}  {dict(sorted(outcomes.items()))}")
+
+
+if __name__ == '__main__':
+    main()
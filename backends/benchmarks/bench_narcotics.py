@@ -0,0 +1,100 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+import database
+from benchmarks.synthetic import generate_database, make_event_rows
+from services.event_writer import EVENT_COLUMNS
+from services.narcotics import summary
+from utils.narcotics import NARCOTIC_EVENT_TYPES, parse_administrations
+
+
+# Run from the backends folder: python -m benchmarks.bench_narcotics --events 2000000
+# Builds a database without the usage aggregates, times migration 0008
+# summing them, then compares /api/narcotics/summary queries against
+# re-parsing the events they cover, and what the aggregates add to ingestion.
+
+QUERIES = [
+    ('month by drug', dict(group_by='drug', since='{last_month}')),
+    ('year by room', dict(group_by='room', since='{year}')),
+    ('year by user', dict(group_by='user', since='{year}', drug='fentanyl')),
+    ('year by day', dict(group_by='day', since='{year}')),
+    ('month by operation', dict(group_by='operation', since='{last_month}')),
+    ('all time by drug', dict(group_by='drug')),
+]
+
+
+def rescan(since):
+    # What a usage report costs without the aggregates
+    usage = Counter()
+    with database.connection() as conn:
+        events = conn.execute(
+            f"SELECT event_value FROM Events WHERE timestamp >= ? AND event_type IN "
+            f"({', '.join('?' * len(NARCOTIC_EVENT_TYPES))})",
+            (since or '', *NARCOTIC_EVENT_TYPES)
+        )
+        for event_value, in events:
+            for drug, dose_mg in parse_administrations(event_value):
+                usage[drug] += 1
+    return usage
+
+
+def timed(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def insert_rate(insert, rows):
+    start = time.perf_counter()
+    for i in range(0, len(rows), 500):
+        insert(EVENT_COLUMNS, rows[i:i + 500])
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000000)
+    parser.add_argument('--operations', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'hospital.db')
+        print(f"Generating {args.events} events")
+        generate_database(path, 100, 20, args.operations, args.events, 'unused', schema_version=7)
+
+        pool = database.init_pool(path)
+        start = time.perf_counter()
+        database.migrate_database(progress=lambda message: None)
+        print(f"Summing existing events (migration 0008): {time.perf_counter() - start:.1f} s")
+
+        with database.connection() as conn:
+            end = conn.execute("SELECT MAX(timestamp) FROM Events").fetchone()[0][:10]
+        dates = {'last_month': end[:8] + '01', 'year': end[:4] + '-01-01'}
+
+        print(f"{'query':<22}{'summary ms':>12}{'rows':>7}{'rescan ms':>12}")
+        for name, params in QUERIES:
+            params = {key: value.format(**dates) for key, value in params.items()}
+            result, summary_ms = timed(lambda: summary(**params), args.repeats)
+            _, rescan_ms = timed(lambda: rescan(params.get('since')), 1)
+            print(f"{name:<22}{summary_ms:>12.2f}{len(result['results']):>7}{rescan_ms:>12.0f}")
+
+        rows = make_event_rows(args.operations + 1, 20000)
+        aggregated = insert_rate(database.insert_events, rows)
+        with database.connection() as conn:
+            conn.execute("DELETE FROM Counters WHERE name = 'narcotic_usage'")
+            conn.commit()
+        plain = insert_rate(database.insert_events, rows)
+        print(f"Ingestion: {aggregated:.0f} events/s with the aggregates, {plain:.0f} without")
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
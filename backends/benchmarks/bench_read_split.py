@@ -0,0 +1,115 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+import database
+from benchmarks.synthetic import generate_database, make_event_rows
+from services.event_writer import EVENT_COLUMNS
+
+
+# Run from the backends folder: python -m benchmarks.bench_read_split --events 1000000
+# Inserts event batches as ingestion does during surgery while other threads
+# run long report and analytics reads, with the reads going through the
+# read-write pool (as before), read_connection() snapshots, or the replica.
+# Reports commit latency, throughput and how large the WAL grew.
+
+READERS = {
+    'none': None,
+    'read-write pool': database.connection,
+    'read-only snapshot': database.snapshot,
+    'replica': database.replica_connection,
+}
+
+# One operation's timeline, as a report reads it, then a scan like an analytics query
+REPORT_QUERY = "SELECT event_value, timestamp FROM Events WHERE operation_id = ? ORDER BY timestamp, event_id"
+ANALYTICS_QUERY = "SELECT operation_id, COUNT(*), MAX(timestamp) FROM Events GROUP BY operation_id"
+
+
+def read_loop(open_connection, operations, stop, counts):
+    while not stop.is_set():
+        with open_connection() as conn:
+            conn.execute(REPORT_QUERY, (random.randint(1, operations), )).fetchall()
+            conn.execute(ANALYTICS_QUERY).fetchall()
+        counts.append(1)
+
+
+def wal_size(path):
+    try:
+        return os.path.getsize(path + '-wal')
+    except FileNotFoundError:
+        return 0
+
+
+def run(path, open_connection, readers, rows, batch, seconds, operations):
+    # Starts from a checkpointed, empty WAL so the runs compare
+    with database.connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    stop = threading.Event()
+    reads = []
+    threads = [
+        threading.Thread(target=read_loop, args=(open_connection, operations, stop, reads))
+        for _ in range(readers if open_connection else 0)
+    ]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    largest_wal = 0
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < seconds:
+        chunk = rows[i % len(rows):i % len(rows) + batch]
+        i += batch
+        began = time.perf_counter()
+        database.insert_events(EVENT_COLUMNS, chunk)
+        latencies.append((time.perf_counter() - began) * 1000)
+        largest_wal = max(largest_wal, wal_size(path))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'events_per_s': len(latencies) * batch / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[int(len(latencies) * 0.99)],
+        'max_ms': latencies[-1],
+        'reads': len(reads),
+        'wal_mb': largest_wal / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--operations', type=int, default=500)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--batch', type=int, default=20, help="Events per insert, like an event_writer flush")
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'hospital.db')
+        print(f"Generating {args.events} events")
+        generate_database(path, 20, 10, args.operations, args.events, 'unused')
+        pool = database.init_pool(path, replica_path=os.path.join(tmp, 'replica.db'))
+        start = time.perf_counter()
+        pages = database.refresh_replica()
+        print(f"Replica refresh: {pages} pages in {time.perf_counter() - start:.1f} s")
+        rows = make_event_rows(args.operations, 20000)
+
+        print(f"{'reads through':<20}{'events/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'reads':>7}{'WAL MB':>8}")
+        for name, open_connection in READERS.items():
+            result = run(path, open_connection, args.readers, rows, args.batch, args.seconds, args.operations)
+            print(f"{name:<20}{result['events_per_s']:>10.0f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                  f"{result['max_ms']:>9.1f}{result['reads']:>7}{result['wal_mb']:>8.1f}")
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
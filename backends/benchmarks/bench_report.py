@@ -0,0 +1,66 @@
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+import database
+from benchmarks.synthetic import SURGERY_DETAILS, make_event_rows, make_transcript
+from services.event_writer import EVENT_COLUMNS
+from utils import report_generator
+
+
+# Run from the backends folder: python -m benchmarks.bench_report --events 1000 10000
+# Renders synthetic surgeries of each size and reports render time, peak
+# Python heap and whether the PDF stayed in memory or spilled to disk.
+
+def create_report(response):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        buffer, _ = report_generator.create_report(response, SURGERY_DETAILS, 1)
+    return buffer
+
+
+def render(response):
+    start = time.perf_counter()
+    buffer = create_report(response)
+    elapsed = time.perf_counter() - start
+    size = buffer.seek(0, os.SEEK_END)
+    on_disk = getattr(buffer, '_rolled', False)
+    buffer.close()
+
+    # Heap is measured on a second run, tracemalloc would skew the timing
+    tracemalloc.start()
+    create_report(response).close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak, size, on_disk
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--chunk-rows', type=int, default=report_generator.REPORT_TABLE_CHUNK_ROWS)
+    parser.add_argument('--spool-max-bytes', type=int, default=report_generator.REPORT_SPOOL_MAX_BYTES)
+    args = parser.parse_args()
+
+    report_generator.REPORT_TABLE_CHUNK_ROWS = args.chunk_rows
+    report_generator.REPORT_SPOOL_MAX_BYTES = args.spool_max_bytes
+
+    print(f"{'events':>8}{'seconds':>10}{'peak MB':>10}{'pdf MB':>10}{'spooled':>10}")
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+            database.migrate_database(progress=lambda message: None)
+            database.insert_many("Events", EVENT_COLUMNS, make_event_rows(1, events))
+
+            elapsed, peak, size, on_disk = render(make_transcript(events))
+            print(f"{events:>8}{elapsed:>10.2f}{peak / 2**20:>10.1f}{size / 2**20:>10.2f}"
+                  f"{'disk' if on_disk else 'memory':>10}")
+
+            pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import tempfile
+import time
+
+import database
+from benchmarks.synthetic import SURGERY_DETAILS, make_event_rows, make_transcript
+from services.event_writer import EventWriter
+from services.report_state import ReportStates
+from utils import report_generator
+
+
+# Run from the backends folder: python -m benchmarks.bench_report_assembly
+# Replays a surgery's notes through the event writer with report rows laid
+# out as they commit, then compares the download: rows already prepared
+# against preparing them all from the database at download time.
+
+def render(operation_id, response, rows=None):
+    start = time.perf_counter()
+    buffer, _ = report_generator.create_report(response, SURGERY_DETAILS, operation_id, rows)
+    buffer.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--notes-per-batch', type=int, default=20)
+    args = parser.parse_args()
+
+    template = report_generator.get_report_template()
+    print(f"{'events':>8}{'ingest s':>10}{'rows ms':>10}{'incremental s':>15}{'from scratch s':>16}")
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+            database.migrate_database(progress=lambda message: None)
+
+            states = ReportStates(8)
+            writer = EventWriter()
+            writer.add_listener(states.update)
+            rows = make_event_rows(1, events)
+            start = time.perf_counter()
+            for i in range(0, events, args.notes_per_batch):
+                writer.submit(rows[i:i + args.notes_per_batch])
+            writer.close()
+            states.close()
+            ingest = time.perf_counter() - start
+
+            # What the download does: pick up whatever the listener has not
+            # laid out yet, then render
+            start = time.perf_counter()
+            prepared = states.rows(1)
+            rows_ms = (time.perf_counter() - start) * 1000
+
+            response = make_transcript(events)
+            incremental = render(1, response, prepared)
+            scratch = render(1, response)
+            assert len(prepared) == len(report_generator.build_event_rows(
+                database.get_event_timestamps_for_operation_id(1), template
+            ))
+            print(f"{events:>8}{ingest:>10.2f}{rows_ms:>10.1f}{incremental:>15.2f}{scratch:>16.2f}")
+
+            pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
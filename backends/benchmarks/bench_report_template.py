@@ -0,0 +1,46 @@
+import argparse
+import contextlib
+import os
+import time
+
+from benchmarks.synthetic import SURGERY_DETAILS, event_value, make_transcript
+from utils import report_generator
+
+
+# Run from the backends folder: python -m benchmarks.bench_report_template
+# Per-report cost of a short report with a template built for every report
+# (what create_report used to do) and with the shared template.
+
+def time_reports(response, rows, reports, make_template):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(reports):
+            buffer, _ = report_generator.create_report(response, SURGERY_DETAILS, 1, rows, make_template())
+            buffer.close()
+    return (time.perf_counter() - start) / reports * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reports', type=int, default=50)
+    parser.add_argument('--events', type=int, default=20)
+    args = parser.parse_args()
+
+    response = make_transcript(args.events)
+    timestamps = {event_value(i): "2025-03-14 10:00:00" for i in range(args.events)}
+
+    start = time.perf_counter()
+    shared = report_generator.ReportTemplate()
+    setup_ms = (time.perf_counter() - start) * 1000
+    rows = report_generator.build_event_rows(timestamps, shared)
+
+    fresh_ms = time_reports(response, rows, args.reports, report_generator.ReportTemplate)
+    shared_ms = time_reports(response, rows, args.reports, lambda: shared)
+
+    print(f"template setup:            {setup_ms:8.2f} ms")
+    print(f"report, template per call: {fresh_ms:8.2f} ms")
+    print(f"report, shared template:   {shared_ms:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import time
+
+from flask import jsonify
+
+import api
+import database
+
+
+# Run from the backends folder: python -m benchmarks.bench_rooms
+# /api/rooms querying OperatingRoom on every call (as before) against the
+# room cache, its 304 revalidation and an empty "changes since" poll.
+
+def legacy_get_rooms():
+    conn = database.get_db_connection()
+    rooms = conn.execute("SELECT room_id, name, is_available FROM OperatingRoom").fetchall()
+    return jsonify([
+        {"id": room["room_id"], "name": room["name"], "status": "Available" if room["is_available"] else "In Use"}
+        for room in rooms
+    ])
+
+
+def bench(client, url, requests, headers=None, status=200):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(url, headers=headers)
+        assert response.status_code == status, response.status_code
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--rooms', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = database.init_pool(os.path.join(tmp, "hospital.db"))
+        database.create_database()
+        database.insert_many("OperatingRoom", ("name", "is_available"), [
+            (f"Operating Room {i + 1}", i % 3 != 0) for i in range(args.rooms)
+        ])
+        api.app.add_url_rule('/bench/legacyRooms', 'legacy_get_rooms', legacy_get_rooms)
+
+        client = api.app.test_client()
+        etag = client.get('/api/rooms').headers['ETag']
+        version = etag.strip('"')
+        results = {
+            'query per call': bench(client, '/bench/legacyRooms', args.requests),
+            'room cache': bench(client, '/api/rooms', args.requests),
+            'If-None-Match 304': bench(client, '/api/rooms', args.requests, {'If-None-Match': etag}, 304),
+            'changes since': bench(client, f'/api/rooms/changes?since={version}', args.requests),
+        }
+        pool.close_all()
+
+    print(f"{'/api/rooms, ' + str(args.rooms) + ' rooms':<24}{'req/s':>10}")
+    for name, rate in results.items():
+        print(f"{name:<24}{rate:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
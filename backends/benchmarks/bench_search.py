@@ -0,0 +1,90 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import database
+from benchmarks.synthetic import generate_database, make_event_rows
+from services.event_writer import EVENT_COLUMNS
+from services.search import search
+
+
+# Run from the backends folder: python -m benchmarks.bench_search --events 2000000
+# Builds a database without the search index, times migration 0007 indexing
+# it, then times each query shape (first page and a page deep into the
+# results) and what indexing adds to event ingestion.
+
+QUERIES = [
+    ('common term', dict(text='fentanyl')),
+    ('two prefixes', dict(text='fent 50')),
+    ('rare term', dict(text='propofol 1999')),
+    ('room filter', dict(text='propofol', room_id=3)),
+    ('month, newest', dict(text='fentanyl', since='{last_month}', until='{end}')),
+    ('month, oldest', dict(text='fentanyl', since='2024-01-01', until='2024-02-01')),
+    ('operations', dict(text='fentanyl', scope='operations')),
+    ('operations, month', dict(text='fentanyl', scope='operations', since='{last_month}', until='{end}')),
+    ('patient field', dict(text='Patient12', scope='operations')),
+]
+
+
+def time_query(params, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        page = search(**params)
+        timings.append((time.perf_counter() - start) * 1000)
+    return page, statistics.median(timings), max(timings)
+
+
+def insert_rate(insert, rows):
+    start = time.perf_counter()
+    for i in range(0, len(rows), 500):
+        insert(EVENT_COLUMNS, rows[i:i + 500])
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000000)
+    parser.add_argument('--operations', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20, help="Page reached by following cursors")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'hospital.db')
+        print(f"Generating {args.events} events")
+        generate_database(path, 100, 20, args.operations, args.events, 'unused', schema_version=6)
+
+        pool = database.init_pool(path)
+        start = time.perf_counter()
+        database.migrate_database(progress=lambda message: None)
+        print(f"Indexing existing events (migration 0007): {time.perf_counter() - start:.1f} s, "
+              f"database {os.path.getsize(path) / 2**20:.0f} MB")
+
+        with database.connection() as conn:
+            end = conn.execute("SELECT MAX(timestamp) FROM Events").fetchone()[0][:10]
+        last_month = end[:8] + '01'
+
+        print(f"{'query':<20}{'page 1 ms':>11}{'max':>8}{f'page {args.pages} ms':>13}{'results':>9}")
+        for name, params in QUERIES:
+            params = {key: value.format(last_month=last_month, end=end) if isinstance(value, str) else value
+                      for key, value in params.items()}
+            page, first_ms, first_max = time_query(params, args.repeats)
+            cursor, reached = page['nextCursor'], 1
+            while cursor is not None and reached < args.pages - 1:
+                cursor = search(**params, cursor=cursor)['nextCursor']
+                reached += 1
+            deep_ms = time_query({**params, 'cursor': cursor}, args.repeats)[1] if cursor is not None else float('nan')
+            print(f"{name:<20}{first_ms:>11.1f}{first_max:>8.1f}{deep_ms:>13.1f}{len(page['results']):>9}")
+
+        rows = make_event_rows(args.operations + 1, 20000)
+        indexed = insert_rate(database.insert_events, rows)
+        unindexed = insert_rate(lambda columns, batch: database.insert_many("Events", columns, batch), rows)
+        print(f"Ingestion: {indexed:.0f} events/s indexed, {unindexed:.0f} without the index")
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
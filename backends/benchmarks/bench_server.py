@@ -0,0 +1,91 @@
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.server import start_server, stop_server
+
+
+# Run from the backends folder: python -m benchmarks.bench_server
+# Starts gunicorn (gunicorn.conf.py) with each worker count in turn, drives
+# it with concurrent clients for a fixed time and reports throughput and
+# p50/p99 latency per endpoint.
+
+REQUESTS = [
+    ('GET /api/rooms', 'GET', '/api/rooms', None),
+    ('GET /api/rooms/changes', 'GET', '/api/rooms/changes?since=0', None),
+    ('GET /api/lastOperationId', 'GET', '/api/lastOperationId', None),
+    ('POST /api/userId', 'POST', '/api/userId', {'userEmail': 'bench@example.com'}),
+    ('POST /api/sendNotes', 'POST', '/api/sendNotes', {'operationId': 1, 'eventType': 'medicine', 'eventValue': 'Fentanyl 50mcg'}),
+]
+
+
+def client(base_url, token, deadline, latencies, errors):
+    headers = {'Authorization': f'Bearer {token}'}
+    with httpx.Client(base_url=base_url, headers=headers, timeout=30) as http:
+        i = 0
+        while time.perf_counter() < deadline:
+            name, method, url, body = REQUESTS[i % len(REQUESTS)]
+            i += 1
+            start = time.perf_counter()
+            response = http.request(method, url, json=body)
+            latencies[name].append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+
+def run(workers, args, tmp):
+    server, base_url = start_server({
+        'HOSPITAL_DB_PATH': os.path.join(tmp, f'hospital-{workers}.db'),
+        'REPORT_CACHE_DIR': os.path.join(tmp, 'report_cache'),
+    }, args.port, workers, args.threads)
+    try:
+        token = httpx.post(base_url + '/auth/register', json={
+            'email': 'bench@example.com', 'password': 'bench', 'firstName': 'Bench', 'lastName': 'User', 'role': 'Doctor'
+        }).json()['token']
+
+        latencies = defaultdict(list)
+        errors = []
+        deadline = time.perf_counter() + args.seconds
+        clients = [
+            threading.Thread(target=client, args=(base_url, token, deadline, latencies, errors))
+            for _ in range(args.clients)
+        ]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return latencies, errors
+    finally:
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients, {args.seconds:.0f} s per run, {args.threads} threads per worker")
+    print(f"{'workers':>7}  {'endpoint':<26}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            latencies, errors = run(workers, args, tmp)
+            for name, _, _, _ in REQUESTS:
+                samples = sorted(latencies[name])
+                print(f"{workers:>7}  {name:<26}{len(samples) / args.seconds:>9.1f}"
+                      f"{statistics.median(samples):>9.1f}{samples[int(len(samples) * 0.99)]:>9.1f}")
+            total = sum(len(samples) for samples in latencies.values())
+            print(f"{workers:>7}  {'all':<26}{total / args.seconds:>9.1f}   errors {len(errors)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import database
+
+
+# Run from the backends folder: python -m benchmarks.bench_startup [--profile importtime.txt]
+# Starts fresh interpreters that import the API and answer one request, the
+# way a new worker or a serverless instance does, and reports the slowest
+# imports from -X importtime. Exits with 1 when the median cold start is over
+# --budget-ms or a module that should load on first use was imported already.
+
+# Loaded with the first report or conversation fetch, never at startup
+LAZY_MODULES = ('reportlab', 'PIL', 'pytz', 'elevenlabs', 'httpx', 'utils.report_generator')
+
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+import api
+imported = time.perf_counter()
+response = api.app.test_client().get('/api/lastOperationId')
+assert response.status_code == 200, response.status_code
+answered = time.perf_counter()
+lazy = sorted(name for name in sys.modules if name.split('.')[0] in {lazy} or name in {lazy})
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'request_ms': (answered - imported) * 1000, 'loaded': lazy}}))
+'''.format(lazy=repr(set(LAZY_MODULES)))
+
+
+def cold_start(db_path):
+    env = {**os.environ, 'HOSPITAL_DB_PATH': db_path, 'LOG_LEVEL': 'WARNING'}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', COLD_START], env=env, capture_output=True, text=True, check=True
+    )
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    run['process_ms'] = (time.perf_counter() - start) * 1000
+    run['importtime'] = result.stderr
+    return run
+
+
+def slowest_imports(importtime, count):
+    # Top-level packages by cumulative import time; -X importtime lines are
+    # "import time: self | cumulative | name", nested by indentation
+    packages = {}
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('COLD_START_BUDGET_MS', '400')),
+                        help="Import plus first request, median over the runs")
+    parser.add_argument('--profile', help="Write the -X importtime output of the median run here")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'hospital.db')
+        pool = database.init_pool(db_path)
+        database.migrate_database(progress=lambda message: None)
+        pool.close_all()
+        runs = sorted((cold_start(db_path) for _ in range(args.runs)), key=lambda run: run['import_ms'] + run['request_ms'])
+
+    median = runs[len(runs) // 2]
+    cold = [run['import_ms'] + run['request_ms'] for run in runs]
+    print(f"import api: {statistics.median(run['import_ms'] for run in runs):.0f} ms, "
+          f"first request: {statistics.median(run['request_ms'] for run in runs):.0f} ms, "
+          f"process: {statistics.median(run['process_ms'] for run in runs):.0f} ms (median of {args.runs})")
+    print(f"{'package':<28}{'ms':>8}")
+    for package, microseconds in slowest_imports(median['importtime'], args.top):
+        print(f"{package:<28}{microseconds / 1000:>8.1f}")
+    if args.profile:
+        with open(args.profile, 'w') as profile:
+            profile.write(median['importtime'])
+
+    failed = False
+    if median['loaded']:
+        print(f"Loaded at startup but should load on first use: {', '.join(median['loaded'])}")
+        failed = True
+    if statistics.median(cold) > args.budget_ms:
+        print(f"Cold start {statistics.median(cold):.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
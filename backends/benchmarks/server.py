@@ -0,0 +1,67 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+# Starts the production server (gunicorn.conf.py) as a subprocess for
+# benchmarks that measure the API over real HTTP. Run from the backends folder.
+
+def start_server(env, port, workers, threads, log_path=None):
+    server_env = dict(
+        os.environ,
+        API_BIND=f'127.0.0.1:{port}',
+        API_WORKERS=str(workers),
+        API_THREADS=str(threads),
+        LOG_LEVEL='WARNING',
+        **env
+    )
+    log = open(log_path, 'w') if log_path else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'api:app'],
+        env=server_env, stdout=log, stderr=log
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    # Migrations on a large database run before gunicorn binds
+    for _ in range(1200):
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            httpx.get(base_url + '/api/rooms')
+            return server, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    server.wait(60)
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+
+
+def tree_rss_bytes(pid):
+    # Resident memory of a process and all its descendants (master, workers,
+    # report render processes); Linux only
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as statm:
+                total += int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            continue
+        pending.extend(_children(current))
+    return total
@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from werkzeug.security import generate_password_hash
+
+from benchmarks.server import start_server, stop_server, tree_rss_bytes
+from benchmarks.synthetic import SURGERY_DETAILS, event_type, event_value, generate_database, user_email, write_fixture
+from services.password_hasher import password_hasher
+
+
+# Run from the backends folder:
+#     python -m benchmarks.suite run
+#     python -m benchmarks.suite compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+# "run" generates (or reuses) a hospital.db of the requested size, starts the
+# production server on a copy of it with ElevenLabs served from local
+# fixtures, replays each traffic scenario for a fixed time and writes
+# throughput, latency percentiles and server memory to a JSON result file.
+# "compare" prints the change between two result files and exits with 1 when
+# any of them regressed by more than the threshold.
+
+BENCHMARKS_DIR = Path(__file__).parent
+DATA_DIR = BENCHMARKS_DIR / 'data'
+RESULTS_DIR = BENCHMARKS_DIR / 'results'
+PASSWORD = 'benchmark-password'
+
+
+def login(http, rng, args):
+    return 'POST /auth/login', http.post('/auth/login', json={
+        'email': user_email(rng.randint(1, args.users)), 'password': PASSWORD
+    })
+
+
+def send_note(http, rng, args):
+    i = rng.randrange(10000)
+    return 'POST /api/sendNotes', http.post('/api/sendNotes', json={
+        'operationId': rng.randint(1, args.operations), 'eventType': event_type(i), 'eventValue': event_value(i)
+    })
+
+
+def download_report(http, rng, args):
+    # A few surgeries are downloaded over and over, so this measures cache
+    # hits as well as renders
+    return 'POST /api/downloadReport', http.post('/api/downloadReport', json={
+        'operationId': rng.randint(1, args.report_operations),
+        'conversationId': args.conversation_id,
+        'surgeryDetails': SURGERY_DETAILS
+    })
+
+
+def browse_rooms(http, rng, args):
+    return 'GET /api/rooms', http.get('/api/rooms')
+
+
+def scenarios(args):
+    return {
+        'login_burst': [(login, args.login_clients)],
+        'send_notes': [(send_note, args.note_clients)],
+        'report_downloads': [(download_report, args.report_clients)],
+        'mixed': [
+            (login, args.login_clients), (send_note, args.note_clients),
+            (download_report, args.report_clients), (browse_rooms, args.browse_clients)
+        ],
+    }
+
+
+def client(base_url, request, rng, args, deadline, samples):
+    with httpx.Client(base_url=base_url, timeout=120) as http:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                name, response = request(http, rng, args)
+                status = response.status_code
+            except httpx.TransportError as e:
+                name, status = request.__name__, type(e).__name__
+            samples.append((name, (time.perf_counter() - start) * 1000, status))
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(samples, seconds):
+    by_endpoint = defaultdict(list)
+    for name, latency, status in samples:
+        by_endpoint[name].append((latency, status))
+
+    endpoints = {}
+    for name, results in sorted(by_endpoint.items()):
+        latencies = sorted(latency for latency, _ in results)
+        statuses = Counter(str(status) for _, status in results)
+        endpoints[name] = {
+            'requests': len(results),
+            'rps': round(len(results) / seconds, 2),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p90_ms': round(percentile(latencies, 0.90), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'errors': sum(count for status, count in statuses.items() if status not in ('200', '201', '202', '304')),
+            'statuses': dict(statuses),
+        }
+    return endpoints
+
+
+def run_scenario(name, clients, server, base_url, args):
+    samples = []
+    deadline = time.perf_counter() + args.seconds
+    threads = []
+    for request, count in clients:
+        for i in range(count):
+            # Same seed, same request sequence on every run
+            rng = random.Random(f"{args.seed}-{name}-{request.__name__}-{i}")
+            threads.append(threading.Thread(target=client, args=(base_url, request, rng, args, deadline, samples)))
+
+    rss_start = tree_rss_bytes(server.pid)
+    rss_peak = rss_start
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        rss_peak = max(rss_peak, tree_rss_bytes(server.pid))
+        time.sleep(0.25)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'seconds': round(elapsed, 2),
+        'clients': sum(count for _, count in clients),
+        'rps': round(len(samples) / elapsed, 2),
+        'rss_start_mb': round(rss_start / 2**20, 1),
+        'rss_peak_mb': round(rss_peak / 2**20, 1),
+        'endpoints': summarize(samples, elapsed),
+    }
+
+
+def dataset_path(args):
+    DATA_DIR.mkdir(exist_ok=True)
+    path = DATA_DIR / f"hospital-u{args.users}-r{args.rooms}-o{args.operations}-e{args.events}.db"
+    if path.exists() and not args.regenerate:
+        return path, None
+
+    print(f"Generating {path.name}")
+    path.unlink(missing_ok=True)
+    start = time.perf_counter()
+    password_hash = generate_password_hash(PASSWORD, method=password_hasher.method)
+    generate_database(path, args.users, args.rooms, args.operations, args.events, password_hash)
+    return path, round(time.perf_counter() - start, 1)
+
+
+def prepare_database(source, target):
+    shutil.copyfile(source, target)
+    # A dataset generated before the hashing method changed would otherwise
+    # measure one rehash per user
+    conn = sqlite3.connect(target)
+    stored_hash = conn.execute("SELECT password FROM Users LIMIT 1").fetchone()[0]
+    if password_hasher.needs_rehash(stored_hash):
+        conn.execute("UPDATE Users SET password = ?", (generate_password_hash(PASSWORD, method=password_hasher.method), ))
+        conn.commit()
+    conn.close()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty.strip())
+
+
+def run(args):
+    source, generate_seconds = dataset_path(args)
+    args.report_operations = min(args.report_operations, args.operations)
+    transcript_events = min(args.transcript_events, args.events // args.operations)
+    selected = args.scenarios or list(scenarios(args))
+
+    commit, dirty = git_commit()
+    result = {
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('command', 'output', 'regenerate')},
+        'dataset': {
+            'file': source.name, 'mb': round(source.stat().st_size / 2**20, 1),
+            'generate_seconds': generate_seconds, 'transcript_events': transcript_events
+        },
+        'scenarios': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'hospital.db')
+        prepare_database(source, db_path)
+        fixtures_dir = os.path.join(tmp, 'fixtures')
+        args.conversation_id = write_fixture(fixtures_dir, transcript_events)
+
+        server, base_url = start_server({
+            'HOSPITAL_DB_PATH': db_path,
+            'REPORT_CACHE_DIR': os.path.join(tmp, 'report_cache'),
+            'ELEVENLABS_FIXTURES_DIR': fixtures_dir,
+            # Every client shares 127.0.0.1; the per-address limit would
+            # turn a login burst into a 429 benchmark
+            'PASSWORD_HASH_PER_CLIENT': str(args.login_clients * 2),
+        }, args.port, args.workers, args.threads, log_path=os.path.join(tmp, 'server.log'))
+        try:
+            for name, clients in scenarios(args).items():
+                if name not in selected:
+                    continue
+                print(f"Running {name} for {args.seconds:.0f} s")
+                result['scenarios'][name] = run_scenario(name, clients, server, base_url, args)
+                print_scenario(name, result['scenarios'][name])
+        finally:
+            stop_server(server)
+            if server.returncode:
+                RESULTS_DIR.mkdir(exist_ok=True)
+                shutil.copyfile(os.path.join(tmp, 'server.log'), RESULTS_DIR / 'server-failed.log')
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'unknown')[:8]}.json"
+    with open(output, 'w', encoding='utf-8') as result_file:
+        json.dump(result, result_file, indent=2)
+    print(f"Results written to {output}")
+
+
+def print_scenario(name, scenario):
+    print(f"  {'endpoint':<26}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    for endpoint, stats in scenario['endpoints'].items():
+        print(f"  {endpoint:<26}{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p90_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}{stats['errors']:>8}")
+    print(f"  server memory {scenario['rss_start_mb']:.0f} MB at start, {scenario['rss_peak_mb']:.0f} MB peak")
+
+
+def compare_metrics(before, after):
+    # (scenario, metric, before, after, higher is better)
+    for name, scenario in after['scenarios'].items():
+        previous = before['scenarios'].get(name)
+        if previous is None:
+            continue
+        yield name, 'rss_peak_mb', previous['rss_peak_mb'], scenario['rss_peak_mb'], False
+        for endpoint, stats in scenario['endpoints'].items():
+            old = previous['endpoints'].get(endpoint)
+            if old is None:
+                continue
+            yield f"{name} {endpoint}", 'rps', old['rps'], stats['rps'], True
+            for metric in ('p50_ms', 'p99_ms'):
+                yield f"{name} {endpoint}", metric, old[metric], stats[metric], False
+            yield f"{name} {endpoint}", 'errors', old['errors'], stats['errors'], False
+
+
+def compare(args):
+    with open(args.before, encoding='utf-8') as before_file, open(args.after, encoding='utf-8') as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    print(f"{(before['commit'] or 'unknown')[:8]} -> {(after['commit'] or 'unknown')[:8]}")
+    settings = [
+        {key: value for key, value in result['config'].items() if key not in ('scenarios', 'port')}
+        for result in (before, after)
+    ]
+    if before['host'] != after['host'] or settings[0] != settings[1] or before['dataset']['file'] != after['dataset']['file']:
+        print("Warning: the runs used different hosts, settings or datasets")
+
+    regressions = 0
+    print(f"{'':<48}{'metric':<12}{'before':>10}{'after':>10}{'change':>9}")
+    for label, metric, old, new, higher_is_better in compare_metrics(before, after):
+        change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+        worse = -change if higher_is_better else change
+        regressed = worse > args.threshold if metric != 'errors' else new > old
+        regressions += regressed
+        print(f"{label:<48}{metric:<12}{old:>10.1f}{new:>10.1f}{change:>+9.0%}{'  REGRESSION' if regressed else ''}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--users', type=int, default=500)
+    run_parser.add_argument('--rooms', type=int, default=20)
+    run_parser.add_argument('--operations', type=int, default=1000)
+    run_parser.add_argument('--events', type=int, default=2000000)
+    run_parser.add_argument('--transcript-events', type=int, default=1000)
+    run_parser.add_argument('--report-operations', type=int, default=20)
+    run_parser.add_argument('--scenarios', nargs='+', choices=['login_burst', 'send_notes', 'report_downloads', 'mixed'])
+    run_parser.add_argument('--seconds', type=float, default=20)
+    run_parser.add_argument('--login-clients', type=int, default=8)
+    run_parser.add_argument('--note-clients', type=int, default=16)
+    run_parser.add_argument('--report-clients', type=int, default=4)
+    run_parser.add_argument('--browse-clients', type=int, default=4)
+    run_parser.add_argument('--workers', type=int, default=2)
+    run_parser.add_argument('--threads', type=int, default=16)
+    run_parser.add_argument('--port', type=int, default=5098)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--regenerate', action='store_true')
+    run_parser.add_argument('--output', type=Path)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('before', type=Path)
+    compare_parser.add_argument('after', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
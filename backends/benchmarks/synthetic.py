@@ -0,0 +1,128 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+# Synthetic data shaped like what the ElevenLabs agent and /api/sendNotes produce
+
+SURGERY_DETAILS = {
+    'patient_first_name': 'Jan',
+    'patient_last_name': 'Kowalski',
+    'operation_type': 'Appendectomy',
+    'patient_id': '90010112345'
+}
+
+ROLES = ['Doctor', 'Nurse', 'Surgeon', 'Anesthesiologist']
+
+# Schema the rows below are inserted for
+DATA_SCHEMA_VERSION = 6
+
+DRUGS = ['Fentanyl', 'Propofol', 'Midazolam', 'Rocuronium', 'Ketamine', 'Morphine']
+
+
+def event_value(i):
+    return f"{DRUGS[i % len(DRUGS)]} {10 + i % 90}mg administered (#{i})"
+
+
+def event_type(i):
+    return 'anestesia' if i % 3 == 0 else 'medicine'
+
+
+def make_transcript(events, duration_secs=3 * 3600):
+    transcript = []
+    for i in range(events):
+        params = {'eventType': event_type(i), 'eventValue': event_value(i)}
+        transcript.append({
+            'role': 'agent',
+            'message': None,
+            'tool_calls': [{'tool_name': 'displayEvent', 'params_as_json': json.dumps(params)}]
+        })
+        transcript.append({'role': 'user', 'message': f"Note {i}", 'tool_calls': []})
+
+    return {
+        'conversation_id': f'synthetic-{events}',
+        'analysis': {'transcript_summary': 'Synthetic surgery used for benchmarking.'},
+        'metadata': {'call_duration_secs': duration_secs},
+        'transcript': transcript
+    }
+
+
+def make_event_rows(operation_id, events):
+    return [(operation_id, event_type(i), event_value(i)) for i in range(events)]
+
+
+def write_fixture(directory, events):
+    # Fixture for services.eleven_labs.RecordedConversations; returns its conversation id
+    conversation = make_transcript(events)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / f"{conversation['conversation_id']}.json", 'w', encoding='utf-8') as fixture:
+        json.dump(conversation, fixture)
+    return conversation['conversation_id']
+
+
+def user_email(i):
+    return f"user{i}@example.com"
+
+
+def generate_database(path, users, rooms, operations, events, password_hash, batch_size=50000, schema_version=None):
+    # A hospital.db of the given size at schema_version (default the latest).
+    # Every user shares password_hash; events are spread evenly over the
+    # operations, numbered so a transcript from make_transcript(n) matches the
+    # first n of each. Rows are written at DATA_SCHEMA_VERSION; migrations
+    # after it derive their data (search index, ...) from them like on a real
+    # upgrade.
+    import database
+
+    pool = database.init_pool(str(path))
+    database.migrate_database(min(schema_version or DATA_SCHEMA_VERSION, DATA_SCHEMA_VERSION),
+                              progress=lambda message: None)
+    pool.close_all()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT INTO Users (first_name, last_name, role, email, password) VALUES (?, ?, ?, ?, ?)",
+        ((f"User{i}", f"Bench{i}", ROLES[i % len(ROLES)], user_email(i), password_hash) for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO OperatingRoom (name, is_available) VALUES (?, ?)",
+        ((f"Operating Room {i}", i % 3 != 0) for i in range(1, rooms + 1))
+    )
+    conn.executemany(
+        "INSERT INTO Operation (room_id, user_id, patient_first_name, patient_last_name, patient_id, operation_type) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((1 + i % rooms, 1 + i % users, SURGERY_DETAILS['patient_first_name'], f"Patient{i}",
+          f"{90010100000 + i}", SURGERY_DETAILS['operation_type']) for i in range(operations))
+    )
+    conn.execute("UPDATE Counters SET value = ? WHERE name = 'operation'", (operations, ))
+
+    start = datetime(2024, 1, 1)
+    per_operation = events // operations
+
+    def event_rows():
+        for operation_id in range(1, operations + 1):
+            # One surgery a day, one event every 10 seconds
+            started = start + timedelta(days=operation_id)
+            count = per_operation + (1 if operation_id <= events % operations else 0)
+            for i in range(count):
+                timestamp = (started + timedelta(seconds=10 * i)).isoformat(" ", "seconds")
+                yield operation_id, timestamp, event_type(i), event_value(i)
+
+    rows = event_rows()
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT INTO Events (operation_id, timestamp, event_type, event_value) VALUES (?, ?, ?, ?)", batch
+        )
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+    if schema_version is None or schema_version > DATA_SCHEMA_VERSION:
+        pool = database.init_pool(str(path))
+        database.migrate_database(schema_version, progress=lambda message: None)
+        pool.close_all()
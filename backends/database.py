@@ -1,107 +1,964 @@
+import logging
+import os
+import queue
+import re
 import sqlite3
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote
+
+from flask import g, has_app_context
+
+from observability import observe_query
+from utils.narcotics import NARCOTIC_EVENT_TYPES, parse_administrations
+
+
+DB_PATH = os.getenv("HOSPITAL_DB_PATH", "hospital.db")
+POOL_SIZE = int(os.getenv("HOSPITAL_DB_POOL_SIZE", "8"))
+# Read-only connections to hospital.db for reports, streams and listings
+READ_POOL_SIZE = int(os.getenv("HOSPITAL_DB_READ_POOL_SIZE", str(POOL_SIZE)))
+# Optional copy of hospital.db, refreshed by services.replica, that search and
+# analytics read instead; they may then lag by up to the refresh interval
+DB_REPLICA_PATH = os.getenv("HOSPITAL_DB_REPLICA_PATH")
+# Monthly event archive files; next to the database unless set
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR")
+# SQLite allows 10 attached databases per connection by default
+MAX_ATTACHED_ARCHIVES = 8
+
+# Applied to every new connection. WAL lets readers run alongside the writer,
+# synchronous=NORMAL only fsyncs at checkpoints, and a larger page cache plus
+# mmap keeps the hot part of Events in memory between requests. auto_vacuum
+# only takes effect on a new file, before WAL is switched on, so new
+# databases can be compacted in steps without ever needing a full VACUUM.
+PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# Read-only connections leave the journal mode to the writer; query_only also
+# keeps the event archives they attach from being written through them
+READ_ONLY_PRAGMAS = (
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA query_only=ON",
+)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Times statement execution (up to the first row) into db_query_duration_seconds
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute does not go through cursor(), so both are wrapped
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    def __init__(self, path, size, read_only=False):
+        self.path = path
+        self.size = size
+        self.read_only = read_only
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+
+    def _connect(self):
+        # cached_statements keeps compiled statements per connection, so the
+        # same query text is only prepared once for the lifetime of the pool
+        if self.read_only:
+            target, pragmas = f"file:{quote(os.path.abspath(self.path))}?mode=ro", READ_ONLY_PRAGMAS
+        else:
+            target, pragmas = self.path, PRAGMAS
+        conn = sqlite3.connect(
+            target, uri=self.read_only, check_same_thread=False, cached_statements=256,
+            factory=InstrumentedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.size <= 0:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ReplicaPool(ConnectionPool):
+    # refresh_replica replaces the replica file; connections still open on
+    # the previous copy are closed instead of being handed out again
+    def __init__(self, path, size):
+        super().__init__(path, size, read_only=True)
+
+    def file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _connect(self):
+        file_id = self.file_id()
+        conn = super()._connect()
+        conn.replica_file_id = file_id
+        return conn
+
+    def acquire(self):
+        file_id = self.file_id()
+        conn = super().acquire()
+        if conn.replica_file_id != file_id:
+            conn.close()
+            self.close_all()
+            conn = self._connect()
+        return conn
+
+
+_pool = ConnectionPool(DB_PATH, POOL_SIZE)
+_read_pool = ConnectionPool(DB_PATH, READ_POOL_SIZE, read_only=True)
+_replica_pool = ReplicaPool(DB_REPLICA_PATH, READ_POOL_SIZE) if DB_REPLICA_PATH else None
+
+
+def init_pool(path=None, size=None, replica_path=None):
+    global _pool, _read_pool, _replica_pool, DB_PATH, DB_REPLICA_PATH
+    for pool in (_pool, _read_pool, _replica_pool):
+        if pool is not None:
+            pool.close_all()
+    DB_PATH = path or DB_PATH
+    DB_REPLICA_PATH = replica_path or DB_REPLICA_PATH
+    _pool = ConnectionPool(DB_PATH, POOL_SIZE if size is None else size)
+    _read_pool = ConnectionPool(DB_PATH, READ_POOL_SIZE if size is None else size, read_only=True)
+    _replica_pool = ReplicaPool(DB_REPLICA_PATH, _read_pool.size) if DB_REPLICA_PATH else None
+    return _pool
+
+
+def _request_pools():
+    # flask.g attribute holding the request's connection from each pool
+    return (('db_conn', _pool), ('db_read_conn', _read_pool), ('db_replica_conn', _replica_pool))
 
 
 def get_db_connection():
-    conn = sqlite3.connect("hospital.db")
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Inside a request the connection lives on flask.g and is handed back to
+    # the pool by close_db_connection on app context teardown
+    if has_app_context():
+        if 'db_conn' not in g:
+            g.db_conn = _pool.acquire()
+        return g.db_conn
+    return _pool.acquire()
+
+
+def close_db_connection(exception=None):
+    for name, pool in _request_pools():
+        conn = g.pop(name, None)
+        if conn is not None:
+            pool.release(conn)
+
+
+@contextmanager
+def _pooled_connection(pool, name):
+    if has_app_context():
+        if name not in g:
+            setattr(g, name, pool.acquire())
+        yield g.get(name)
+        return
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def connection():
+    # Read-write; everything that changes the database goes through here
+    with _pooled_connection(_pool, 'db_conn') as conn:
+        yield conn
+
+
+@contextmanager
+def read_connection():
+    # Read-only connection to hospital.db. In WAL mode each statement reads
+    # the last commit without taking the writer's lock, so long report reads
+    # and ingestion never wait for each other.
+    with _pooled_connection(_read_pool, 'db_read_conn') as conn:
+        yield conn
+
+
+@contextmanager
+def snapshot():
+    # A read connection whose statements all see the database as of the
+    # first one, until the block exits; nested blocks share the outer one
+    with read_connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+@contextmanager
+def replica_connection():
+    # For queries that can be as old as the last refresh_replica; reads
+    # hospital.db directly while no replica is configured or written yet
+    if _replica_pool is None or _replica_pool.file_id() is None:
+        with read_connection() as conn:
+            yield conn
+        return
+    with _pooled_connection(_replica_pool, 'db_replica_conn') as conn:
+        yield conn
+
+
+def refresh_replica(path=None):
+    # Copies hospital.db through the SQLite backup API into a new file and
+    # moves it over the replica; returns the pages copied. The copy is a
+    # single WAL read transaction, so inserts carry on while it runs, and
+    # open replica connections keep reading the previous file until released.
+    path = path or DB_REPLICA_PATH
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    target = sqlite3.connect(partial)
+    try:
+        with read_connection() as source:
+            source.backup(target)
+        target.execute("PRAGMA journal_mode=DELETE")
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+    os.replace(partial, path)
+    return pages
 
 
 def get_last_operation_id():
-    # Connect to the sqlite database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Execute the query to get the maximum operation_id from the Events table
-    cursor.execute("SELECT MAX(operation_id) FROM Events")
-    result = cursor.fetchone()
-    conn.close()
+    # Most recently created operation; MAX over the rowid is answered from
+    # the end of the table b-tree
+    with read_connection() as conn:
+        return conn.execute("SELECT MAX(operation_id) FROM Operation").fetchone()[0] or 0
+
+
+def get_counter(name):
+    with read_connection() as conn:
+        row = conn.execute("SELECT value FROM Counters WHERE name = ?", (name, )).fetchone()
+    return row[0] if row is not None else 0
+
+
+def reserve_ids(name, count):
+    # Atomically moves the counter forward by count and returns the first
+    # reserved id; concurrent callers, in any process, get disjoint ranges
+    with connection() as conn:
+        high = conn.execute(
+            "INSERT INTO Counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value",
+            (name, count)
+        ).fetchall()[0][0]
+        conn.commit()
+    return high - count + 1
+
+
+def reserve_operation_ids(count, room_id, user_id=None):
+    # Moves the operation counter forward and records the range for room_id
+    # in the same transaction; returns the first reserved id
+    with connection() as conn:
+        try:
+            high = conn.execute(
+                "INSERT INTO Counters (name, value) VALUES ('operation', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value",
+                (count, )
+            ).fetchall()[0][0]
+            conn.execute(
+                "INSERT INTO OperationIdReservation (first_id, last_id, room_id, user_id) VALUES (?, ?, ?, ?)",
+                (high - count + 1, high, room_id, user_id)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return high - count + 1
+
+
+def get_operation_id_reservation(operation_id):
+    # (room_id, user_id) the id was reserved for, or None
+    with read_connection() as conn:
+        return conn.execute(
+            "SELECT room_id, user_id FROM OperationIdReservation "
+            "WHERE first_id = (SELECT MAX(first_id) FROM OperationIdReservation WHERE first_id <= ?) AND last_id >= ?",
+            (operation_id, operation_id)
+        ).fetchone()
 
-    return result
 
 def get_events_for_operation_id_and_value(operation_id, event_value):
-    # Connect to the sqlite database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Execute the query to get the maximum operation_id from the Events table
-    cursor.execute("SELECT timestamp FROM Events WHERE operation_id = ? AND event_value = ?", (operation_id, event_value, ))
-    result = cursor.fetchone()
-    conn.close()
+    with snapshot() as conn:
+        return conn.execute(
+            f"SELECT timestamp FROM {_events_source(conn, operation_id)} WHERE operation_id = ? AND event_value = ?",
+            (operation_id, event_value, )
+        ).fetchone()
 
-    return result
 
+def get_event_timestamps_for_operation_id(operation_id):
+    # One indexed range scan for the whole operation; maps each event value
+    # to the timestamp of its first occurrence
+    with snapshot() as conn:
+        rows = conn.execute(
+            f"SELECT event_value, timestamp FROM {_events_source(conn, operation_id)} WHERE operation_id = ? "
+            "ORDER BY timestamp, event_id",
+            (operation_id, )
+        ).fetchall()
 
-def create_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            role TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
+    timestamps = {}
+    for event_value, timestamp in rows:
+        timestamps.setdefault(event_value, timestamp)
+    return timestamps
+
+
+def get_event_fingerprint(operation_id):
+    # Changes whenever events are added to the operation; answered from the index
+    with snapshot() as conn:
+        return tuple(conn.execute(
+            f"SELECT COUNT(*), MAX(event_id) FROM {_events_source(conn, operation_id)} WHERE operation_id = ?",
+            (operation_id, )
+        ).fetchone())
+
+
+def get_rooms(version_counter=None):
+    # With version_counter, returns (counter value, rooms) read from one snapshot
+    with snapshot() as conn:
+        rooms = conn.execute("SELECT room_id, name, is_available FROM OperatingRoom ORDER BY room_id").fetchall()
+        if version_counter is None:
+            return rooms
+        row = conn.execute("SELECT value FROM Counters WHERE name = ?", (version_counter, )).fetchone()
+    return (row[0] if row is not None else 0), rooms
+
+
+def set_room_available(room_id, is_available, version_counter):
+    # Updates the room and moves version_counter forward in one transaction,
+    # so readers never see the change without the new version; returns the
+    # new version, or None when there is no such room
+    with connection() as conn:
+        try:
+            updated = conn.execute(
+                "UPDATE OperatingRoom SET is_available = ? WHERE room_id = ?",
+                (int(is_available), room_id)
+            ).rowcount
+            if updated == 0:
+                conn.rollback()
+                return None
+            version = conn.execute(
+                "INSERT INTO Counters (name, value) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value",
+                (version_counter, )
+            ).fetchall()[0][0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
+
+
+def save_operation_conversation(operation_id, conversation_id):
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO OperationConversation (operation_id, conversation_id, started_at) "
+            "VALUES (?, ?, COALESCE((SELECT MIN(timestamp) FROM Events WHERE operation_id = ?), CURRENT_TIMESTAMP)) "
+            "ON CONFLICT (operation_id) DO UPDATE SET conversation_id = excluded.conversation_id "
+            "WHERE conversation_id != excluded.conversation_id",
+            (operation_id, conversation_id, operation_id)
+        )
+        conn.commit()
+
+
+EXPORT_OPERATION_COLUMNS = (
+    "o.operation_id, c.conversation_id, o.patient_first_name, o.patient_last_name, o.patient_id, o.operation_type"
+)
+
+
+def get_export_operations(after_operation_id, limit, since=None, until=None, operation_ids=None):
+    # Operations for a bulk export in id order: the listed ones, or those
+    # started in [since, until). conversation_id is None when none was recorded.
+    # An operation starts with its first event (one seek per operation on
+    # idx_events_operation_timestamp); archived operations, whose events are
+    # no longer here, fall back to the start recorded with their conversation.
+    if operation_ids is not None:
+        conditions = [f"o.operation_id IN ({', '.join('?' * len(operation_ids))})"]
+        parameters = list(operation_ids)
+    else:
+        started_at = (
+            "COALESCE((SELECT MIN(e.timestamp) FROM Events e WHERE e.operation_id = o.operation_id), c.started_at)"
         )
-    ''')
+        conditions, parameters = [], []
+        for condition, value in ((f"{started_at} >= ?", since), (f"{started_at} < ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+    conditions.append("o.operation_id > ?")
+    with read_connection() as conn:
+        return conn.execute(
+            f"SELECT {EXPORT_OPERATION_COLUMNS} FROM Operation o "
+            "LEFT JOIN OperationConversation c ON c.operation_id = o.operation_id "
+            f"WHERE {' AND '.join(conditions)} ORDER BY o.operation_id LIMIT ?",
+            (*parameters, after_operation_id, limit)
+        ).fetchall()
+
+
+REPORT_JOB_COLUMNS = (
+    "job_id", "operation_id", "cache_key", "status", "error", "filename",
+    "submitted_at", "started_at", "finished_at"
+)
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS OperatingRoom (
-            room_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            is_available BOOLEAN NOT NULL DEFAULT 1
+
+def save_report_job(job_row):
+    # job_row holds REPORT_JOB_COLUMNS in order
+    with connection() as conn:
+        conn.execute(
+            f"INSERT OR REPLACE INTO ReportJobs ({', '.join(REPORT_JOB_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(REPORT_JOB_COLUMNS))})",
+            job_row
         )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Operation (
-            operation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            patient_first_name TEXT NOT NULL,
-            patient_last_name TEXT NOT NULL,
-            patient_id TEXT NOT NULL,
-            operation_type TEXT NOT NULL,
-            FOREIGN KEY (room_id) REFERENCES OperatingRoom(room_id),
-            FOREIGN KEY (user_id) REFERENCES Users(id)
+        conn.commit()
+
+
+def get_report_job(job_id):
+    with read_connection() as conn:
+        return conn.execute(
+            f"SELECT {', '.join(REPORT_JOB_COLUMNS)} FROM ReportJobs WHERE job_id = ?",
+            (job_id, )
+        ).fetchone()
+
+
+def delete_report_jobs_finished_before(timestamp):
+    with connection() as conn:
+        conn.execute("DELETE FROM ReportJobs WHERE finished_at < ?", (timestamp, ))
+        conn.commit()
+
+
+EVENT_STREAM_COLUMNS = "event_id, operation_id, event_type, event_value, timestamp"
+
+
+def get_max_event_id():
+    # MAX over the rowid is answered from the end of the table b-tree
+    with read_connection() as conn:
+        return conn.execute("SELECT MAX(event_id) FROM Events").fetchone()[0] or 0
+
+
+def get_events_since(after_event_id):
+    # Rows committed after after_event_id, across all operations
+    with read_connection() as conn:
+        return conn.execute(
+            f"SELECT {EVENT_STREAM_COLUMNS} FROM Events WHERE event_id > ? ORDER BY event_id",
+            (after_event_id, )
+        ).fetchall()
+
+
+def get_operation_events_since(operation_id, after_event_id, limit):
+    with snapshot() as conn:
+        return conn.execute(
+            f"SELECT {EVENT_STREAM_COLUMNS} FROM {_events_source(conn, operation_id)} "
+            "WHERE operation_id = ? AND event_id > ? "
+            "ORDER BY event_id LIMIT ?",
+            (operation_id, after_event_id, limit)
+        ).fetchall()
+
+
+# Events of closed operations are moved to one SQLite file per month
+# (services.event_archive). Reads for an archived operation go through a
+# UNION ALL of its archive and Events, since notes can still arrive for it.
+
+EVENT_ARCHIVE_COLUMNS = "event_id, operation_id, timestamp, event_type, event_value"
+
+
+def event_archive_dir():
+    return EVENT_ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "event_archive")
+
+
+def event_archive_path(archive):
+    return os.path.join(event_archive_dir(), f"events-{archive}.db")
+
+
+def list_event_archives():
+    directory = event_archive_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = (re.fullmatch(r"events-(\d{4}-\d{2})\.db", name) for name in os.listdir(directory))
+    return sorted(name.group(1) for name in names if name)
+
+
+def attach_event_archive(conn, archive, create=False):
+    # Returns the schema name the archive is attached under, or None when it
+    # does not exist. Attachments stay on the pooled connection for reuse.
+    if not re.fullmatch(r"\d{4}-\d{2}", archive):
+        raise ValueError(f"Invalid event archive name {archive!r}")
+    schema = "archive_" + archive.replace("-", "_")
+
+    attached = conn.__dict__.setdefault("attached_archives", {})
+    if schema in attached:
+        attached[schema] = attached.pop(schema)
+        return schema
+
+    path = event_archive_path(archive)
+    if not create and not os.path.exists(path):
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if len(attached) >= MAX_ATTACHED_ARCHIVES:
+        oldest = next(iter(attached))
+        conn.execute(f"DETACH DATABASE {oldest}")
+        del attached[oldest]
+    conn.execute("ATTACH DATABASE ? AS " + schema, (path, ))
+    attached[schema] = path
+
+    if create:
+        conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.Events (
+                event_id INTEGER PRIMARY KEY,
+                operation_id INTEGER NOT NULL,
+                timestamp DATETIME,
+                event_type TEXT NOT NULL,
+                event_value TEXT NOT NULL
+            )
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_archive_events_operation ON Events (operation_id)")
+        conn.commit()
+    return schema
+
+
+def _events_source(conn, operation_id):
+    # "Events" for live operations, so their queries are unchanged. Callers
+    # read through snapshot() so this lookup and their query agree on which
+    # side of archive_operation_events the rows are.
+    row = conn.execute("SELECT archive FROM ArchivedOperations WHERE operation_id = ?", (operation_id, )).fetchone()
+    if row is None:
+        return "Events"
+    schema = attach_event_archive(conn, row[0])
+    if schema is None:
+        logging.getLogger(__name__).warning(
+            "Event archive missing", extra={'archive': row[0], 'operation_id': operation_id}
         )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Events (
-            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            operation_id INTEGER NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            event_type TEXT NOT NULL,
-            event_value TEXT NOT NULL,
-            FOREIGN KEY (operation_id) REFERENCES Operation(operation_id)
+        return "Events"
+    return (
+        f"(SELECT {EVENT_ARCHIVE_COLUMNS} FROM {schema}.Events "
+        f"UNION ALL SELECT {EVENT_ARCHIVE_COLUMNS} FROM Events)"
+    )
+
+
+def get_archivable_operations(before):
+    # Operations whose newest event is older than before, with the month of
+    # their first event and the archive they already use, if any
+    with read_connection() as conn:
+        return conn.execute(
+            "SELECT e.operation_id, substr(MIN(e.timestamp), 1, 7), a.archive FROM Events e "
+            "LEFT JOIN ArchivedOperations a ON a.operation_id = e.operation_id "
+            "GROUP BY e.operation_id HAVING MAX(e.timestamp) < ? ORDER BY e.operation_id",
+            (before, )
+        ).fetchall()
+
+
+def archive_operation_events(operation_id, archive):
+    # Copies the events into the archive and commits it, then records the
+    # operation as archived and deletes the copies from Events in a single
+    # transaction. Readers see the events in one place or the other, never
+    # both; after a crash in between the next run repeats the copy harmlessly.
+    with connection() as conn:
+        schema = attach_event_archive(conn, archive, create=True)
+        last_event_id = conn.execute(
+            "SELECT MAX(event_id) FROM Events WHERE operation_id = ?", (operation_id, )
+        ).fetchone()[0]
+        if last_event_id is None:
+            return 0
+
+        conn.execute(
+            f"INSERT OR IGNORE INTO {schema}.Events ({EVENT_ARCHIVE_COLUMNS}) "
+            f"SELECT {EVENT_ARCHIVE_COLUMNS} FROM Events WHERE operation_id = ? AND event_id <= ?",
+            (operation_id, last_event_id)
         )
-    ''') 
+        conn.commit()
+
+        try:
+            moved = conn.execute(
+                "DELETE FROM Events WHERE operation_id = ? AND event_id <= ?", (operation_id, last_event_id)
+            ).rowcount
+            conn.execute(
+                "INSERT INTO ArchivedOperations (operation_id, archive, events) VALUES (?, ?, ?) "
+                "ON CONFLICT (operation_id) DO UPDATE SET events = events + excluded.events, "
+                "archived_at = CURRENT_TIMESTAMP",
+                (operation_id, archive, moved)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return moved
+
+
+def get_archive_summary():
+    with read_connection() as conn:
+        return conn.execute(
+            "SELECT archive, COUNT(*), SUM(events) FROM ArchivedOperations GROUP BY archive ORDER BY archive"
+        ).fetchall()
+
+
+def acquire_lease(name, seconds):
+    # True for at most one caller, in any process, per period of seconds;
+    # the lease is a Counters row holding its expiry time
+    now = int(time.time())
+    with connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO Counters (name, value) VALUES (?, 0)", (name, ))
+        acquired = conn.execute(
+            "UPDATE Counters SET value = ? WHERE name = ? AND value <= ?", (now + seconds, name, now)
+        ).rowcount
+        conn.commit()
+    return acquired > 0
+
+
+def get_free_page_ratio(path=None):
+    with _maintenance_connection(path) as conn:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return free_pages / page_count if page_count else 0.0
+
+
+def compact(path=None, step_pages=2000, vacuum=False):
+    # Returns pages freed. In incremental auto-vacuum mode free pages are
+    # released a step at a time, so writers wait at most one step. Files not
+    # in that mode are left alone unless vacuum is set: the full VACUUM that
+    # switches them over rewrites the whole file holding the write lock, a
+    # maintenance-window step (python -m services.event_archive --vacuum).
+    freed = 0
+    with _maintenance_connection(path) as conn:
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while free_pages > 0:
+                conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+                conn.commit()
+                remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                freed += free_pages - remaining
+                if remaining >= free_pages:
+                    break
+                free_pages = remaining
+        elif vacuum:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            freed = free_pages
+        # A passive checkpoint neither waits for readers nor blocks writers
+        conn.execute(f"PRAGMA wal_checkpoint({'TRUNCATE' if vacuum else 'PASSIVE'})").fetchall()
+    return freed
+
+
+@contextmanager
+def _maintenance_connection(path):
+    # The main database comes from the pool; archive files get a short-lived
+    # connection of their own
+    if path is None:
+        with connection() as conn:
+            yield conn
+        return
+    conn = sqlite3.connect(path, factory=InstrumentedConnection)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        yield conn
+    finally:
+        conn.close()
+
+
+# Full-text search (migration 0007). EventSearch drives the query so matches
+# come out newest first straight from the index and the scan stops at limit.
+
+SEARCH_EVENT_COLUMNS = "e.event_id, e.operation_id, e.event_type, e.event_value, e.timestamp, o.room_id, r.name"
+SEARCH_OPERATION_COLUMNS = (
+    "p.operation_id, COALESCE(h.matching_events, 0), h.first_match, h.last_match, o.room_id, r.name, "
+    "o.operation_type, o.patient_first_name, o.patient_last_name, o.patient_id"
+)
+
+
+def _event_filters(since, until, event_type):
+    conditions, parameters = [], []
+    if since is not None:
+        conditions.append("e.timestamp >= ?")
+        parameters.append(since)
+    if until is not None:
+        conditions.append("e.timestamp < ?")
+        parameters.append(until)
+    if event_type is not None:
+        conditions.append("e.event_type = ?")
+        parameters.append(event_type)
+    return conditions, parameters
 
-    conn.commit()
-    conn.close()
+
+def search_events(match, before_event_id, limit, since=None, until=None, room_id=None, event_type=None):
+    # Events whose value matches the FTS5 expression, newest first, with
+    # event_id below the keyset cursor before_event_id
+    conditions, parameters = _event_filters(since, until, event_type)
+    if room_id is not None:
+        conditions.append("o.room_id = ?")
+        parameters.append(room_id)
+    where = " ".join(f"AND {condition}" for condition in conditions)
+    with replica_connection() as conn:
+        return conn.execute(
+            f"SELECT {SEARCH_EVENT_COLUMNS} FROM EventSearch "
+            "CROSS JOIN Events e ON e.event_id = EventSearch.rowid "
+            "LEFT JOIN Operation o ON o.operation_id = e.operation_id "
+            "LEFT JOIN OperatingRoom r ON r.room_id = o.room_id "
+            f"WHERE EventSearch MATCH ? AND EventSearch.rowid < ? {where} "
+            "ORDER BY EventSearch.rowid DESC LIMIT ?",
+            (match, before_event_id, *parameters, limit)
+        ).fetchall()
+
+
+def search_operations(match, before_operation_id, limit, since=None, until=None, room_id=None, event_type=None):
+    # Operations with matching events, or (without a time or type filter)
+    # matching patient and procedure fields, highest operation id first. The
+    # index is searched once; the page of operation ids is picked from the
+    # matches first, and only the matches on that page are counted.
+    conditions, parameters = _event_filters(since, until, event_type)
+    where = " ".join(f"AND {condition}" for condition in conditions)
+    query_parameters = [match, before_operation_id, *parameters]
+    operation_matches = ""
+    if not conditions:
+        operation_matches = "UNION SELECT rowid FROM OperationSearch WHERE OperationSearch MATCH ? AND rowid < ?"
+        query_parameters += [match, before_operation_id]
+
+    room_filter = ""
+    if room_id is not None:
+        room_filter = "WHERE operation_id IN (SELECT operation_id FROM Operation WHERE room_id = ?)"
+        query_parameters.append(room_id)
+    with replica_connection() as conn:
+        return conn.execute(
+            "WITH matches AS MATERIALIZED ("
+            "SELECT e.operation_id, e.timestamp FROM EventSearch "
+            "CROSS JOIN Events e ON e.event_id = EventSearch.rowid "
+            f"WHERE EventSearch MATCH ? AND e.operation_id < ? {where}), "
+            f"page AS (SELECT DISTINCT operation_id FROM (SELECT operation_id FROM matches {operation_matches}) "
+            f"{room_filter} ORDER BY operation_id DESC LIMIT ?), "
+            "hits AS (SELECT operation_id, COUNT(*) AS matching_events, MIN(timestamp) AS first_match, "
+            "MAX(timestamp) AS last_match FROM matches WHERE operation_id IN page GROUP BY operation_id) "
+            f"SELECT {SEARCH_OPERATION_COLUMNS} FROM page p "
+            "LEFT JOIN hits h ON h.operation_id = p.operation_id "
+            "LEFT JOIN Operation o ON o.operation_id = p.operation_id "
+            "LEFT JOIN OperatingRoom r ON r.room_id = o.room_id "
+            "ORDER BY p.operation_id DESC",
+            (*query_parameters, limit)
+        ).fetchall()
+
+
+# group_by: (table, columns identifying a group after the drug, extra
+# aggregates, joins). Room and user totals are per day, operations per
+# operation and day, so a range is summed from whole days.
+NARCOTIC_GROUPS = {
+    'drug': ('NarcoticDailyUsage', (), (), ""),
+    'day': ('NarcoticDailyUsage', ('u.day', ), (), ""),
+    'room': ('NarcoticDailyUsage', ('u.room_id', 'r.name'), (),
+             "LEFT JOIN OperatingRoom r ON r.room_id = u.room_id"),
+    'user': ('NarcoticDailyUsage', ('u.user_id', 'p.first_name', 'p.last_name'), (),
+             "LEFT JOIN Users p ON p.id = u.user_id"),
+    'operation': ('NarcoticOperationUsage', ('u.operation_id', 'u.room_id', 'u.user_id'),
+                  ('MIN(u.first_at)', 'MAX(u.last_at)'), ""),
+}
+
+
+def get_narcotic_usage(group_by, since=None, until=None, drug=None, room_id=None, user_id=None):
+    # Summed usage per group and drug for days since <= day < until
+    table, keys, extra, joins = NARCOTIC_GROUPS[group_by]
+    conditions, parameters = [], []
+    for condition, value in (("u.day >= ?", since), ("u.day < ?", until), ("u.drug = ?", drug),
+                             ("u.room_id = ?", room_id), ("u.user_id = ?", user_id)):
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    group = ", ".join((*keys[:1], "u.drug"))
+    columns = ", ".join((*keys, "u.drug", "SUM(u.administrations)", "SUM(u.undosed)", "SUM(u.dose_mg)", *extra))
+    with replica_connection() as conn:
+        return conn.execute(
+            f"SELECT {columns} FROM {table} u {joins} {where} GROUP BY {group} ORDER BY {group}", parameters
+        ).fetchall()
+
+
+def create_database():
+    migrate_database()
+
+
+def migrate_database(target=None, progress=print):
+    # Schema changes live in the versioned migrations package
+    import migrations
+    return migrations.apply_migrations(target, progress)
+
+
+@lru_cache(maxsize=64)
+def _insert_query(table_name, columns):
+    placeholders = ", ".join(["?"] * len(columns))  # Create placeholders dynamically
+    return f"INSERT INTO {table_name} {columns} VALUES ({placeholders})"
 
 
 def insert_into(table_name, columns, row):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    placeholders = ", ".join(["?"] * len(row))  # Create placeholders dynamically
-    query = f"INSERT INTO {table_name} {columns} VALUES ({placeholders})"
-    
-    cursor.execute(query, row)  # Execute query with safe parameterized values
-    row_id = cursor.lastrowid  # Get the last inserted row's ID
-
-    conn.commit()
-    conn.close()
-    
+    # Identical query text for a given table lets sqlite3 reuse the prepared statement
+    query = _insert_query(table_name, tuple(columns))
+
+    with connection() as conn:
+        cursor = conn.execute(query, row)  # Execute query with safe parameterized values
+        row_id = cursor.lastrowid  # Get the last inserted row's ID
+        conn.commit()
+
     return row_id  # Return the newly created row id
 
 
+def insert_many(table_name, columns, rows):
+    query = _insert_query(table_name, tuple(columns))
+
+    # All rows go in one transaction, so the batch costs a single commit
+    with connection() as conn:
+        try:
+            conn.executemany(query, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return len(rows)
+
+
+def insert_events(columns, rows):
+    query = _insert_query("Events", tuple(columns))
+
+    # The batch and its search index entries commit together
+    with connection() as conn:
+        try:
+            conn.executemany(query, rows)
+            _update_event_derived_tables(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return len(rows)
+
+
+def _index_events(conn, after_event_id, last_event_id):
+    conn.execute(
+        "INSERT INTO EventSearch (rowid, event_value) "
+        "SELECT event_id, event_value FROM Events WHERE event_id > ? AND event_id <= ?",
+        (after_event_id, last_event_id)
+    )
+
+
+def add_narcotic_usage(conn, after_event_id, last_event_id):
+    # Adds the controlled substances given in events after_event_id up to
+    # last_event_id to NarcoticOperationUsage and NarcoticDailyUsage
+    by_operation = {}
+    by_day = {}
+    rooms_and_users = {}
+    events = conn.execute(
+        "SELECT e.operation_id, e.timestamp, e.event_value, COALESCE(o.room_id, 0), COALESCE(o.user_id, 0) "
+        "FROM Events e LEFT JOIN Operation o ON o.operation_id = e.operation_id "
+        f"WHERE e.event_id > ? AND e.event_id <= ? AND e.event_type IN ({', '.join('?' * len(NARCOTIC_EVENT_TYPES))}) "
+        "AND e.timestamp IS NOT NULL",
+        (after_event_id, last_event_id, *NARCOTIC_EVENT_TYPES)
+    )
+    for operation_id, timestamp, event_value, room_id, user_id in events:
+        for drug, dose_mg in parse_administrations(event_value):
+            day = timestamp[:10]
+            # [administrations, undosed, dose_mg] (+ [first_at, last_at] per operation)
+            usage = by_operation.setdefault((operation_id, drug, day), [0, 0, 0.0, timestamp, timestamp])
+            totals = by_day.setdefault((day, drug, room_id, user_id), [0, 0, 0.0])
+            for counts in (usage, totals):
+                counts[0] += 1
+                counts[1] += dose_mg is None
+                counts[2] += dose_mg or 0.0
+            usage[3] = min(usage[3], timestamp)
+            usage[4] = max(usage[4], timestamp)
+            rooms_and_users[operation_id] = (room_id, user_id)
+
+    conn.executemany(
+        "INSERT INTO NarcoticOperationUsage (operation_id, drug, day, room_id, user_id, administrations, "
+        "undosed, dose_mg, first_at, last_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (operation_id, drug, day) DO UPDATE SET "
+        "administrations = administrations + excluded.administrations, undosed = undosed + excluded.undosed, "
+        "dose_mg = dose_mg + excluded.dose_mg, first_at = MIN(first_at, excluded.first_at), "
+        "last_at = MAX(last_at, excluded.last_at)",
+        [(operation_id, drug, day, *rooms_and_users[operation_id], *usage)
+         for (operation_id, drug, day), usage in by_operation.items()]
+    )
+    conn.executemany(
+        "INSERT INTO NarcoticDailyUsage (day, drug, room_id, user_id, administrations, undosed, dose_mg) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, drug, room_id, user_id) DO UPDATE SET "
+        "administrations = administrations + excluded.administrations, undosed = undosed + excluded.undosed, "
+        "dose_mg = dose_mg + excluded.dose_mg",
+        [(*key, *totals) for key, totals in by_day.items()]
+    )
+
+
+# Tables derived from Events: the counter holding the last event id each
+# covers, and the function adding a range of newer events to it
+EVENT_DERIVED_TABLES = (
+    ('event_search', _index_events),
+    ('narcotic_usage', add_narcotic_usage),
+)
+
+
+def _update_event_derived_tables(conn):
+    # One statement per table and batch is several times cheaper than a
+    # trigger per row. Everything above a table's counter is added, including
+    # events written without going through insert_events.
+    last_event_id = conn.execute("SELECT MAX(event_id) FROM Events").fetchone()[0] or 0
+    for name, add_events in EVENT_DERIVED_TABLES:
+        done = conn.execute("SELECT value FROM Counters WHERE name = ?", (name, )).fetchone()
+        # No counter: the database predates the migration creating the table
+        if done is not None and last_event_id > done[0]:
+            add_events(conn, done[0], last_event_id)
+            conn.execute("UPDATE Counters SET value = ? WHERE name = ?", (last_event_id, name))
+
+
 def insert_sample_data():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with connection() as conn:
+        _insert_sample_rooms(conn.cursor())
+        conn.commit()
+
 
+def _insert_sample_rooms(cursor):
     cursor.executemany('''
         INSERT INTO OperatingRoom (name, is_available)
         VALUES (?, ?)
@@ -113,14 +970,14 @@ def insert_sample_data():
         ("Cesarean Section Room 5", 1)  # Available
     ])
 
-    conn.commit()
-    conn.close()
-
 
 def legacy_insert_sample_data():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with connection() as conn:
+        _insert_legacy_sample_data(conn.cursor())
+        conn.commit()
+
 
+def _insert_legacy_sample_data(cursor):
     # Dodanie użytkowników
     cursor.executemany('''
         INSERT OR IGNORE INTO Users (first_name, last_name, role, email, password)
@@ -170,7 +1027,4 @@ def legacy_insert_sample_data():
         (operation_2_id, "medicine", "Patient admitted"),
         (operation_2_id, "medicine", "Initial diagnostics performed"),
         (operation_2_id, "medicine", "Surgery in progress")
-    ])
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    ])
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+
+# Production server, from the backends folder: gunicorn -c gunicorn.conf.py api:app
+# The app is loaded, and the schema, sample data and report template prepared,
+# once in the master before workers are forked; every worker then opens its
+# own connection pool.
+# kill -HUP <master pid> replaces the workers gracefully: in-flight requests
+# finish (up to graceful_timeout) and queued events are flushed first. To
+# deploy new code, kill -USR2 <master pid> starts a new master next to the old
+# one; kill -QUIT the old master once the new workers are up.
+
+bind = os.getenv('API_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('API_WORKERS', str(min(os.cpu_count() or 1, 4))))
+# Threads per worker; every open event stream holds one
+threads = int(os.getenv('API_THREADS', '16'))
+worker_class = 'gthread'
+preload_app = True
+graceful_timeout = int(os.getenv('API_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('API_TIMEOUT', '120'))
+keepalive = 5
+# Set PROMETHEUS_MULTIPROC_DIR to an empty directory for /metrics to cover
+# every worker. It is cleared here, while the config is read: with
+# preload_app the app, and prometheus_client with it, is imported before any
+# server hook runs.
+metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if metrics_dir:
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+
+def on_starting(server):
+    import api
+    import database
+
+    api.main()
+    # Loaded before forking, so every worker shares reportlab and the
+    # prepared report styles and logo instead of loading them on first use
+    from utils.report_generator import get_report_template
+    get_report_template()
+    # A fresh, empty pool: no SQLite connection may be inherited by the workers
+    database.init_pool()
+
+
+def post_fork(server, worker):
+    import database
+    from services.event_archive import event_archiver
+    from services.replica import replica_refresher
+
+    database.init_pool()
+    event_archiver.start()
+    replica_refresher.start()
+
+
+def worker_exit(server, worker):
+    from services.event_archive import event_archiver
+    from services.event_writer import event_writer
+    from services.replica import replica_refresher
+
+    event_archiver.stop()
+    replica_refresher.stop()
+    event_writer.close()
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,49 @@
+# Tables as originally created by database.create_database(); IF NOT EXISTS
+# keeps this a no-op for databases that predate the migrations package
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            role TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS OperatingRoom (
+            room_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            is_available BOOLEAN NOT NULL DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Operation (
+            operation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            patient_first_name TEXT NOT NULL,
+            patient_last_name TEXT NOT NULL,
+            patient_id TEXT NOT NULL,
+            operation_type TEXT NOT NULL,
+            FOREIGN KEY (room_id) REFERENCES OperatingRoom(room_id),
+            FOREIGN KEY (user_id) REFERENCES Users(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation_id INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            event_type TEXT NOT NULL,
+            event_value TEXT NOT NULL,
+            FOREIGN KEY (operation_id) REFERENCES Operation(operation_id)
+        )
+    ''')
+    conn.commit()
@@ -0,0 +1,6 @@
+from migrations import create_index
+
+
+def upgrade(conn, progress):
+    create_index(conn, 'idx_events_operation_value', 'Events', ['operation_id', 'event_value'], progress)
+    create_index(conn, 'idx_events_operation_timestamp', 'Events', ['operation_id', 'timestamp'], progress)
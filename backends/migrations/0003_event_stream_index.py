@@ -0,0 +1,7 @@
+from migrations import create_index
+
+
+def upgrade(conn, progress):
+    # SQLite appends the rowid to every index entry, so this one serves
+    # "operation_id = ? AND event_id > ? ORDER BY event_id" as a range scan
+    create_index(conn, 'idx_events_operation_event', 'Events', ['operation_id'], progress)
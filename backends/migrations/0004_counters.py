@@ -0,0 +1,20 @@
+# Named id counters; the operation counter starts past every operation id
+# already in use, including ids that only appear on events
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO Counters (name, value)
+        SELECT 'operation', MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'Operation'), 0),
+            COALESCE((SELECT MAX(operation_id) FROM Operation), 0),
+            COALESCE((SELECT MAX(operation_id) FROM Events), 0)
+        )
+    ''')
+    conn.commit()
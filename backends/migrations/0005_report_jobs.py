@@ -0,0 +1,19 @@
+# Report job status shared by all API worker processes; the PDFs themselves
+# stay in the report cache
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ReportJobs (
+            job_id TEXT PRIMARY KEY,
+            operation_id INTEGER NOT NULL,
+            cache_key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            filename TEXT,
+            submitted_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.commit()
@@ -0,0 +1,14 @@
+# Operations whose events were moved out of Events into a monthly archive
+# file (see services.event_archive); archive is the month, e.g. "2024-01"
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ArchivedOperations (
+            operation_id INTEGER PRIMARY KEY,
+            archive TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
@@ -0,0 +1,74 @@
+from migrations import backfill_events
+
+# Full-text indexes for /api/search. Both are external-content FTS5 tables:
+# they hold only the index and read the text back from Events and Operation.
+# New events are indexed by database.insert_events, a batch at a time, up to
+# the event_search counter (one statement per batch is several times cheaper
+# than a trigger per row); triggers handle the rare update and delete of
+# indexed events and every change to Operation. Events moved to an archive
+# file (services.event_archive) leave the index with them.
+
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def upgrade(conn, progress):
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS EventSearch USING fts5(
+            event_value, content='Events', content_rowid='event_id', tokenize='{TOKENIZER}'
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO Counters (name, value) VALUES ('event_search', 0)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_search_delete AFTER DELETE ON Events
+        WHEN old.event_id <= (SELECT value FROM Counters WHERE name = 'event_search') BEGIN
+            INSERT INTO EventSearch (EventSearch, rowid, event_value) VALUES ('delete', old.event_id, old.event_value);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_search_update AFTER UPDATE OF event_value ON Events
+        WHEN old.event_id <= (SELECT value FROM Counters WHERE name = 'event_search') BEGIN
+            INSERT INTO EventSearch (EventSearch, rowid, event_value) VALUES ('delete', old.event_id, old.event_value);
+            INSERT INTO EventSearch (rowid, event_value) VALUES (new.event_id, new.event_value);
+        END
+    ''')
+
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS OperationSearch USING fts5(
+            patient_first_name, patient_last_name, patient_id, operation_type,
+            content='Operation', content_rowid='operation_id', tokenize='{TOKENIZER}'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operation_search_insert AFTER INSERT ON Operation BEGIN
+            INSERT INTO OperationSearch (rowid, patient_first_name, patient_last_name, patient_id, operation_type)
+            VALUES (new.operation_id, new.patient_first_name, new.patient_last_name, new.patient_id, new.operation_type);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operation_search_delete AFTER DELETE ON Operation BEGIN
+            INSERT INTO OperationSearch (OperationSearch, rowid, patient_first_name, patient_last_name, patient_id, operation_type)
+            VALUES ('delete', old.operation_id, old.patient_first_name, old.patient_last_name, old.patient_id, old.operation_type);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS operation_search_update AFTER UPDATE ON Operation BEGIN
+            INSERT INTO OperationSearch (OperationSearch, rowid, patient_first_name, patient_last_name, patient_id, operation_type)
+            VALUES ('delete', old.operation_id, old.patient_first_name, old.patient_last_name, old.patient_id, old.operation_type);
+            INSERT INTO OperationSearch (rowid, patient_first_name, patient_last_name, patient_id, operation_type)
+            VALUES (new.operation_id, new.patient_first_name, new.patient_last_name, new.patient_id, new.operation_type);
+        END
+    ''')
+    conn.execute("INSERT INTO OperationSearch (OperationSearch) VALUES ('rebuild')")
+    conn.commit()
+
+    backfill_events(conn, 'event_search', index_events, progress, "Indexed events for search")
+    conn.execute("INSERT INTO EventSearch (EventSearch) VALUES ('optimize')")
+    conn.commit()
+
+
+def index_events(conn, after_event_id, last_event_id):
+    conn.execute(
+        "INSERT INTO EventSearch (rowid, event_value) "
+        "SELECT event_id, event_value FROM Events WHERE event_id > ? AND event_id <= ?",
+        (after_event_id, last_event_id)
+    )
@@ -0,0 +1,114 @@
+from migrations import backfill_events
+from utils.narcotics import NARCOTIC_EVENT_TYPES, parse_administrations
+
+# Controlled-substance usage (utils.narcotics) summed from Events, per
+# operation and day and per day, room and user, for /api/narcotics/summary.
+# database.insert_events keeps both up to date, a batch at a time, up to the
+# narcotic_usage counter. Days are UTC like Events.timestamp; room and user
+# are taken from Operation (0 until it has a row). Archiving events does not
+# change the totals. The backfill below is this migration's own copy of
+# database.add_narcotic_usage as it stood then; both parse notes with
+# utils.narcotics, so old and new events are counted alike.
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS NarcoticOperationUsage (
+            operation_id INTEGER NOT NULL,
+            drug TEXT NOT NULL,
+            day TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            administrations INTEGER NOT NULL,
+            undosed INTEGER NOT NULL,
+            dose_mg REAL NOT NULL,
+            first_at DATETIME NOT NULL,
+            last_at DATETIME NOT NULL,
+            PRIMARY KEY (operation_id, drug, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_narcotic_operation_usage_day ON NarcoticOperationUsage (day)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS NarcoticDailyUsage (
+            day TEXT NOT NULL,
+            drug TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            administrations INTEGER NOT NULL,
+            undosed INTEGER NOT NULL,
+            dose_mg REAL NOT NULL,
+            PRIMARY KEY (day, drug, room_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Events may arrive for a reserved operation id before createOperation
+    # adds its row; their usage moves from room and user 0 when it does
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS narcotic_usage_operation_insert AFTER INSERT ON Operation BEGIN
+            UPDATE NarcoticDailyUsage SET
+                administrations = NarcoticDailyUsage.administrations - u.administrations,
+                undosed = NarcoticDailyUsage.undosed - u.undosed,
+                dose_mg = NarcoticDailyUsage.dose_mg - u.dose_mg
+            FROM NarcoticOperationUsage AS u
+            WHERE u.operation_id = new.operation_id AND u.room_id = 0 AND u.user_id = 0
+                AND NarcoticDailyUsage.day = u.day AND NarcoticDailyUsage.drug = u.drug
+                AND NarcoticDailyUsage.room_id = 0 AND NarcoticDailyUsage.user_id = 0;
+            DELETE FROM NarcoticDailyUsage WHERE room_id = 0 AND user_id = 0 AND administrations <= 0;
+            INSERT INTO NarcoticDailyUsage (day, drug, room_id, user_id, administrations, undosed, dose_mg)
+            SELECT day, drug, new.room_id, new.user_id, administrations, undosed, dose_mg
+            FROM NarcoticOperationUsage WHERE operation_id = new.operation_id AND room_id = 0 AND user_id = 0
+            ON CONFLICT (day, drug, room_id, user_id) DO UPDATE SET
+                administrations = administrations + excluded.administrations,
+                undosed = undosed + excluded.undosed,
+                dose_mg = dose_mg + excluded.dose_mg;
+            UPDATE NarcoticOperationUsage SET room_id = new.room_id, user_id = new.user_id
+            WHERE operation_id = new.operation_id AND room_id = 0 AND user_id = 0;
+        END
+    ''')
+    conn.execute("INSERT OR IGNORE INTO Counters (name, value) VALUES ('narcotic_usage', 0)")
+    conn.commit()
+
+    backfill_events(conn, 'narcotic_usage', add_usage, progress, "Counted controlled substances")
+
+
+def add_usage(conn, after_event_id, last_event_id):
+    by_operation = {}
+    by_day = {}
+    rooms_and_users = {}
+    events = conn.execute(
+        "SELECT e.operation_id, e.timestamp, e.event_value, COALESCE(o.room_id, 0), COALESCE(o.user_id, 0) "
+        "FROM Events e LEFT JOIN Operation o ON o.operation_id = e.operation_id "
+        f"WHERE e.event_id > ? AND e.event_id <= ? AND e.event_type IN ({', '.join('?' * len(NARCOTIC_EVENT_TYPES))}) "
+        "AND e.timestamp IS NOT NULL",
+        (after_event_id, last_event_id, *NARCOTIC_EVENT_TYPES)
+    )
+    for operation_id, timestamp, event_value, room_id, user_id in events:
+        for drug, dose_mg in parse_administrations(event_value):
+            day = timestamp[:10]
+            # [administrations, undosed, dose_mg] (+ [first_at, last_at] per operation)
+            usage = by_operation.setdefault((operation_id, drug, day), [0, 0, 0.0, timestamp, timestamp])
+            totals = by_day.setdefault((day, drug, room_id, user_id), [0, 0, 0.0])
+            for counts in (usage, totals):
+                counts[0] += 1
+                counts[1] += dose_mg is None
+                counts[2] += dose_mg or 0.0
+            usage[3] = min(usage[3], timestamp)
+            usage[4] = max(usage[4], timestamp)
+            rooms_and_users[operation_id] = (room_id, user_id)
+
+    conn.executemany(
+        "INSERT INTO NarcoticOperationUsage (operation_id, drug, day, room_id, user_id, administrations, "
+        "undosed, dose_mg, first_at, last_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (operation_id, drug, day) DO UPDATE SET "
+        "administrations = administrations + excluded.administrations, undosed = undosed + excluded.undosed, "
+        "dose_mg = dose_mg + excluded.dose_mg, first_at = MIN(first_at, excluded.first_at), "
+        "last_at = MAX(last_at, excluded.last_at)",
+        [(operation_id, drug, day, *rooms_and_users[operation_id], *usage)
+         for (operation_id, drug, day), usage in by_operation.items()]
+    )
+    conn.executemany(
+        "INSERT INTO NarcoticDailyUsage (day, drug, room_id, user_id, administrations, undosed, dose_mg) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, drug, room_id, user_id) DO UPDATE SET "
+        "administrations = administrations + excluded.administrations, undosed = undosed + excluded.undosed, "
+        "dose_mg = dose_mg + excluded.dose_mg",
+        [(*key, *totals) for key, totals in by_day.items()]
+    )
@@ -0,0 +1,15 @@
+# ElevenLabs conversation of each operation, recorded when its report is
+# downloaded, so bulk exports (services.bulk_export) can fetch it again.
+# started_at is the operation's first event and selects date ranges.
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS OperationConversation (
+            operation_id INTEGER PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            started_at DATETIME NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_operation_conversation_started ON OperationConversation (started_at)")
+    conn.commit()
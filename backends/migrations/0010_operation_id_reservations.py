@@ -0,0 +1,17 @@
+# Operation id ranges reserved through /api/operationIds, with the room they
+# were reserved for; createOperation only accepts a reserved id for that
+# room. Ranges never overlap, so the one holding an id is the one with the
+# highest first_id not above it.
+
+
+def upgrade(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS OperationIdReservation (
+            first_id INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL,
+            user_id INTEGER,
+            reserved_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
@@ -0,0 +1,209 @@
+import importlib
+import pkgutil
+import re
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import database
+
+
+# Migration files are named NNNN_description.py and define
+#     upgrade(conn, progress)
+# They are applied in version order and recorded in schema_version.
+
+BATCH_SIZE = 10000
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+
+def discover_migrations():
+    found = []
+    for module_info in pkgutil.iter_modules([str(Path(__file__).parent)]):
+        version, _, name = module_info.name.partition('_')
+        if not version.isdigit():
+            continue
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        found.append(Migration(int(version), name, module))
+
+    found.sort(key=lambda migration: migration.version)
+    return found
+
+
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            duration_ms INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def current_version(conn):
+    ensure_version_table(conn)
+    version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    return version or 0
+
+
+def pending_migrations(conn, target=None):
+    version = current_version(conn)
+    return [
+        migration for migration in discover_migrations()
+        if migration.version > version and (target is None or migration.version <= target)
+    ]
+
+
+def apply_migrations(target=None, progress=print):
+    applied = []
+    with database.connection() as conn:
+        for migration in pending_migrations(conn, target):
+            progress(f"Applying migration {migration.version:04d} {migration.name}")
+            start = time.perf_counter()
+
+            migration.module.upgrade(conn, progress)
+
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)",
+                (migration.version, migration.name, duration_ms)
+            )
+            conn.commit()
+            progress(f"Applied migration {migration.version:04d} in {duration_ms} ms")
+            applied.append(migration.version)
+
+    return applied
+
+
+# Helpers for migrations that touch large tables without holding the write
+# lock for the whole run. With WAL readers are never blocked; these keep
+# writers (event ingestion) waiting at most one batch.
+
+# Smaller tables get new indexes with a plain CREATE INDEX
+ONLINE_INDEX_MIN_ROWS = BATCH_SIZE * 10
+
+
+def create_index(conn, name, table, columns, progress, min_rows=ONLINE_INDEX_MIN_ROWS):
+    # SQLite builds an index in a single statement that holds the write lock.
+    # Large tables are instead rewritten in batches into a copy that already
+    # has the index, which SQLite then maintains a batch at a time.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name, )).fetchone():
+        return
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    table_info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    keys = [column[1] for column in table_info if column[5]]
+    if rows < min_rows or len(keys) != 1:
+        progress(f"Building index {name} on {table} ({rows} rows)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+        conn.commit()
+        return
+
+    progress(f"Building index {name} on {table} ({rows} rows) by rewriting it in batches")
+    table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table, )).fetchone()[0]
+    create_sql = re.sub(
+        rf'^CREATE TABLE\s+(IF NOT EXISTS\s+)?["`]?{table}["`]?', f"CREATE TABLE IF NOT EXISTS {table}_new",
+        table_sql.strip(), flags=re.IGNORECASE
+    )
+    index_sql = [_carried_index_sql(sql, table) for sql, in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table, )
+    )]
+    index_sql.append(f"CREATE INDEX IF NOT EXISTS {name} ON {table}_new ({', '.join(columns)})")
+    rewrite_table(conn, table, create_sql, [column[1] for column in table_info], keys[0], progress,
+                  index_sql=index_sql)
+
+
+def _carried_index_sql(sql, table):
+    # Index names cannot be reused while the old table still has them, and
+    # SQLite cannot rename indexes, so copies alternate between two names
+    match = re.match(
+        r'^CREATE\s+(UNIQUE\s+)?INDEX\s+(IF NOT EXISTS\s+)?["`]?(\w+)["`]?\s+ON\s+["`]?\w+["`]?', sql, re.IGNORECASE
+    )
+    unique, _, name = match.groups()
+    name = name[:-len("_rebuilt")] if name.endswith("_rebuilt") else f"{name}_rebuilt"
+    return f"CREATE {unique or ''}INDEX IF NOT EXISTS {name} ON {table}_new" + sql[match.end():]
+
+
+def copy_table_in_batches(conn, source, target, columns, key, progress, batch_size=BATCH_SIZE):
+    # Copies rows in key order, committing between batches so inserts from the
+    # API interleave with the copy. Meant for append-only tables like Events:
+    # rows updated after they were copied are not picked up again.
+    column_list = ", ".join(columns)
+    total = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+    last_key = conn.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {target}").fetchone()[0]
+    copied = 0
+
+    while True:
+        cursor = conn.execute(
+            f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source} "
+            f"WHERE {key} > ? ORDER BY {key} LIMIT ?",
+            (last_key, batch_size)
+        )
+        conn.commit()
+        if cursor.rowcount <= 0:
+            break
+
+        copied += cursor.rowcount
+        last_key = conn.execute(f"SELECT MAX({key}) FROM {target}").fetchone()[0]
+        progress(f"{source} -> {target}: {copied}/{total} rows")
+
+    return last_key
+
+
+def swap_tables(conn, source, target, columns, key, last_key):
+    # Copies whatever arrived since the last batch and replaces the source
+    # table in one short write transaction. Its triggers are recreated on the
+    # new table and its AUTOINCREMENT sequence carried over.
+    column_list = ", ".join(columns)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source} WHERE {key} > ?",
+            (last_key, )
+        )
+        triggers = [sql for sql, in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (source, )
+        )]
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+            conn.execute(
+                "UPDATE sqlite_sequence SET seq = (SELECT MAX(seq) FROM sqlite_sequence WHERE name IN (?, ?)) "
+                "WHERE name = ?",
+                (source, target, target)
+            )
+        conn.execute(f"DROP TABLE {source}")
+        conn.execute(f"ALTER TABLE {target} RENAME TO {source}")
+        for sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def rewrite_table(conn, table, create_sql, columns, key, progress, batch_size=BATCH_SIZE, index_sql=()):
+    # create_sql must create the new layout under the name <table>_new, and
+    # index_sql its indexes; both should use IF NOT EXISTS so an interrupted
+    # run picks up where it stopped
+    conn.execute(create_sql)
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.commit()
+    last_key = copy_table_in_batches(conn, table, f"{table}_new", columns, key, progress, batch_size)
+    swap_tables(conn, table, f"{table}_new", columns, key, last_key)
+    progress(f"Rewrote {table}")
+
+
+def backfill_events(conn, counter, add_events, progress, description, batch_size=BATCH_SIZE * 10):
+    # Runs add_events(conn, after_event_id, last_event_id) over the events
+    # not yet covered by the counter, committing after each batch so event
+    # ingestion is not held up for the whole backfill
+    last_event_id = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM Events").fetchone()[0]
+    done = conn.execute("SELECT value FROM Counters WHERE name = ?", (counter, )).fetchone()[0]
+    while done < last_event_id:
+        batch_end = min(done + batch_size, last_event_id)
+        add_events(conn, done, batch_end)
+        conn.execute("UPDATE Counters SET value = ? WHERE name = ?", (batch_end, counter))
+        conn.commit()
+        done = batch_end
+        progress(f"{description} up to event {done} of {last_event_id}")
@@ -0,0 +1,32 @@
+import argparse
+
+import database
+from migrations import apply_migrations, current_version, discover_migrations
+
+
+# Run from the backends folder: python -m migrations [--status] [--target N]
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the hospital database")
+    parser.add_argument('--db', default=database.DB_PATH, help="SQLite database file")
+    parser.add_argument('--target', type=int, help="Stop after this migration version")
+    parser.add_argument('--status', action='store_true', help="Show versions without applying anything")
+    args = parser.parse_args()
+
+    database.init_pool(args.db)
+
+    if args.status:
+        with database.connection() as conn:
+            version = current_version(conn)
+        for migration in discover_migrations():
+            state = "applied" if migration.version <= version else "pending"
+            print(f"{migration.version:04d} {migration.name:<30} {state}")
+        return
+
+    applied = apply_migrations(args.target)
+    if not applied:
+        print("Database is up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from flask import g, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# "text" for people, "json" for log shippers
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Queries slower than this are logged at WARNING
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '250'))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds', 'SQLite statement execution time, by statement kind and table',
+    ['statement'], buckets=LATENCY_BUCKETS
+)
+REPORT_PHASE_SECONDS = Histogram(
+    'report_phase_duration_seconds', 'Report rendering time, by phase (fetch, prepare, build)',
+    ['phase'], buckets=LATENCY_BUCKETS
+)
+ELEVENLABS_REQUEST_SECONDS = Histogram(
+    'elevenlabs_request_duration_seconds', 'ElevenLabs API call time, by outcome',
+    ['outcome'], buckets=LATENCY_BUCKETS
+)
+EVENTS_DROPPED = Counter(
+    'events_dropped_total', 'Submitted events given up on after failing to insert, by acknowledgement mode',
+    ['ack']
+)
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+def _extra_fields(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_extra_fields(record)
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # PIL logs every PNG chunk it reads at DEBUG
+    logging.getLogger('PIL').setLevel(max(root.level, logging.INFO))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    # "SELECT Events", "INSERT Counters", "PRAGMA"... keeps the label set small
+    # however many distinct query texts there are
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+    table = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', sql, re.IGNORECASE)
+    return f'{verb} {table.group(1)}' if table else verb
+
+
+@lru_cache(maxsize=1024)
+def _query_histogram(sql):
+    # Query texts are constants, so the label lookup is done once per text
+    return DB_QUERY_SECONDS.labels(statement=statement_label(sql))
+
+
+def observe_query(sql, elapsed):
+    _query_histogram(sql).observe(elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logging.getLogger('database').warning(
+            "Slow query", extra={'statement': statement_label(sql), 'duration_ms': round(elapsed * 1000, 1)}
+        )
+
+
+def metrics_response():
+    # Under gunicorn with PROMETHEUS_MULTIPROC_DIR set, every worker writes its
+    # samples there and a scrape of any worker returns the sum of all of them
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def init_app(app):
+    logger = logging.getLogger('api.requests')
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        # The URL rule, not the path, so /api/reportJobs/<job_id> is one series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(request.method, route, str(response.status_code)).observe(elapsed)
+        logger.debug("Request", extra={
+            'method': request.method, 'route': route, 'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2)
+        })
+        return response
@@ -0,0 +1,344 @@
+import argparse
+import atexit
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+import database
+from observability import REPORT_PHASE_SECONDS, timed
+
+
+# Operations exported per request (or per page of a CLI export)
+EXPORT_MAX_OPERATIONS = int(os.getenv('EXPORT_MAX_OPERATIONS', '1000'))
+CHECKPOINT_EVERY = 25
+
+ExportItem = namedtuple('ExportItem', ['operation_id', 'conversation_id', 'surgery_details'])
+ExportResult = namedtuple('ExportResult', ['item', 'report', 'filename', 'error'])
+
+logger = logging.getLogger(__name__)
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportBusy(Exception):
+    pass
+
+
+def render_export_report(conversation, surgery_details, operation_id, event_rows_by_value):
+    # Runs in a worker process, like report_jobs.render_report_job, with the
+    # conversation already fetched by the exporting process
+    from utils.report_generator import create_report
+
+    report_buffer, output_filename = create_report(conversation, surgery_details, operation_id, event_rows_by_value)
+    with report_buffer:
+        return report_buffer.read(), output_filename
+
+
+def parse_day(value, name):
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ExportError(f"{name} must be an ISO date")
+
+
+class Selection:
+    # Which operations an export covers: listed ids, or a range of start
+    # days (UTC, until excluded). conversations maps operation ids to
+    # conversation ids where none was recorded or a different one is wanted.
+    def __init__(self, since=None, until=None, operation_ids=None, conversations=None):
+        if operation_ids is None and since is None and until is None:
+            raise ExportError("Give operationIds or a from/to date range")
+        if operation_ids is not None and len(operation_ids) > EXPORT_MAX_OPERATIONS:
+            raise ExportError(f"At most {EXPORT_MAX_OPERATIONS} operationIds per export")
+        self.since = parse_day(since, 'from')
+        self.until = parse_day(until, 'to')
+        self.operation_ids = sorted({int(operation_id) for operation_id in operation_ids}) if operation_ids is not None else None
+        self.conversations = {int(operation_id): conversation_id for operation_id, conversation_id in (conversations or {}).items()}
+
+    def page(self, after_operation_id=0, limit=EXPORT_MAX_OPERATIONS):
+        # (items, failures, last operation id covered or None when done)
+        rows = database.get_export_operations(
+            after_operation_id, limit + 1, self.since, self.until, self.operation_ids
+        )
+        more = len(rows) > limit
+        rows = rows[:limit]
+        items, failures = [], []
+        found = set()
+        for operation_id, conversation_id, first_name, last_name, patient_id, operation_type in rows:
+            found.add(operation_id)
+            conversation_id = self.conversations.get(operation_id, conversation_id)
+            if conversation_id is None:
+                failures.append({'operationId': operation_id, 'error': "No conversation recorded for the operation"})
+                continue
+            items.append(ExportItem(operation_id, conversation_id, {
+                'patient_first_name': first_name,
+                'patient_last_name': last_name,
+                'patient_id': patient_id,
+                'operation_type': operation_type
+            }))
+        if self.operation_ids is not None:
+            # At most one page long
+            failures.extend(
+                {'operationId': operation_id, 'error': "No such operation"} for operation_id in self.operation_ids
+                if operation_id > after_operation_id and operation_id not in found
+            )
+            failures.sort(key=lambda failure: failure['operationId'])
+        return items, failures, rows[-1][0] if more else None
+
+
+class BulkExporter:
+    def __init__(self, fetch_workers, render_workers, max_running):
+        self.fetch_workers = fetch_workers
+        self.render_workers = render_workers
+        self._running = threading.BoundedSemaphore(max_running)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn for the same reason as report_jobs; a pool of its own
+                # so a large export does not hold up interactive report jobs
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.render_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def acquire(self):
+        if not self._running.acquire(blocking=False):
+            raise ExportBusy("Another export is running")
+
+    def release(self):
+        self._running.release()
+
+    def reports(self, items):
+        # ExportResult for every item, in order. Conversations are fetched and
+        # event rows read on a bounded thread pool while earlier reports
+        # render on the process pool; at most window items are in flight.
+        from services.eleven_labs import get_conversation_service
+        from utils.report_generator import build_event_rows, get_report_template
+
+        template = get_report_template()
+        executor = self._get_executor()
+
+        def prepare(item):
+            with timed(REPORT_PHASE_SECONDS, phase='fetch'):
+                conversation = get_conversation_service().get_conversation(item.conversation_id)
+            rows = build_event_rows(database.get_event_timestamps_for_operation_id(item.operation_id), template)
+            return executor.submit(render_export_report, conversation, item.surgery_details, item.operation_id, rows)
+
+        window = self.fetch_workers + 2 * self.render_workers
+        items = iter(items)
+        in_flight = deque()
+        fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='export-fetch')
+        try:
+            for item in items:
+                in_flight.append((item, fetch_pool.submit(prepare, item)))
+                if len(in_flight) >= window:
+                    break
+            while in_flight:
+                item, prepared = in_flight.popleft()
+                try:
+                    report, filename = prepared.result().result()
+                    result = ExportResult(item, report, filename, None)
+                except Exception as e:
+                    logger.warning("Export report failed", extra={'operation_id': item.operation_id, 'error': str(e)})
+                    result = ExportResult(item, None, None, str(e))
+                yield result
+                next_item = next(items, None)
+                if next_item is not None:
+                    in_flight.append((next_item, fetch_pool.submit(prepare, next_item)))
+        finally:
+            # Reached early when the client goes away mid-download
+            for item, prepared in in_flight:
+                if not prepared.cancel() and prepared.done() and prepared.exception() is None:
+                    prepared.result().cancel()
+            fetch_pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def entry_name(result):
+    return f"{result.item.operation_id}_{result.filename}"
+
+
+def add_report(archive, result, manifest):
+    # Writes a rendered report into the zip and notes it, or its failure, in manifest
+    if result.error is None:
+        archive.writestr(entry_name(result), result.report)
+        manifest['reports'].append({'operationId': result.item.operation_id, 'file': entry_name(result)})
+    else:
+        manifest['failed'].append({'operationId': result.item.operation_id, 'error': result.error})
+
+
+class ZipStream:
+    # Write-only file for zipfile, which then writes the archive front to
+    # back with sizes after each entry; take() returns what was written so far
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def stream_export(selection, after_operation_id=0):
+    # ZIP of one page of the selection as bytes, produced while reports
+    # complete. Reports come in operation id order, so a client whose download
+    # broke off resumes with afterOperationId set to the last one it got;
+    # manifest.json at the end lists failures and where the next page starts.
+    items, failures, next_after = selection.page(after_operation_id)
+
+    def generate():
+        bulk_exporter.acquire()
+        sink = ZipStream()
+        manifest = {'reports': [], 'failed': failures, 'nextAfterOperationId': next_after}
+        try:
+            yield b''
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+                # PDFs are compressed already
+                for result in bulk_exporter.reports(items):
+                    add_report(archive, result, manifest)
+                    yield sink.take()
+                manifest['failed'].sort(key=lambda failure: failure['operationId'])
+                archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+            yield sink.take()
+        finally:
+            bulk_exporter.release()
+
+    # Started here so ExportBusy is raised to the caller, and so closing the
+    # stream before the first chunk still releases the exporter
+    stream = generate()
+    next(stream)
+    return stream
+
+
+def export_to_file(selection, path, resume=False, progress=print):
+    # Every page of the selection into one ZIP file. The archive is closed
+    # every CHECKPOINT_EVERY reports, and where its entries end and the
+    # central directory written there are saved to <path>.progress. Later
+    # entries overwrite that directory, so --resume writes it back at the
+    # same offset, dropping whatever came after, and carries on from there.
+    progress_path = f"{path}.progress"
+    manifest = {'reports': [], 'failed': []}
+    after_operation_id = 0
+    if resume and os.path.exists(progress_path):
+        with open(progress_path) as progress_file:
+            saved = json.load(progress_file)
+        with open(path, 'r+b') as output:
+            output.seek(saved['entriesEnd'])
+            output.write(base64.b64decode(saved['directory']))
+            output.truncate()
+        manifest = saved['manifest']
+        after_operation_id = saved['afterOperationId']
+        # Failures of the interrupted page are found again
+        manifest['failed'] = [failure for failure in manifest['failed'] if failure['operationId'] <= after_operation_id]
+        progress(f"Resuming after operation {after_operation_id} ({len(manifest['reports'])} reports done)")
+    elif os.path.exists(path):
+        raise ExportError(f"{path} exists; remove it or pass --resume")
+
+    def checkpoint(archive, last_operation_id):
+        entries_end = archive.fp.tell()
+        archive.close()
+        with open(path, 'rb') as output:
+            output.seek(entries_end)
+            directory = output.read()
+        with open(f"{progress_path}.tmp", 'w') as progress_file:
+            json.dump({
+                'entriesEnd': entries_end,
+                'directory': base64.b64encode(directory).decode('ascii'),
+                'afterOperationId': last_operation_id,
+                'manifest': manifest
+            }, progress_file)
+        os.replace(f"{progress_path}.tmp", progress_path)
+        return zipfile.ZipFile(path, 'a', zipfile.ZIP_STORED)
+
+    bulk_exporter.acquire()
+    try:
+        archive = zipfile.ZipFile(path, 'a' if after_operation_id else 'w', zipfile.ZIP_STORED)
+        while after_operation_id is not None:
+            items, failures, next_after = selection.page(after_operation_id)
+            manifest['failed'].extend(failures)
+            since_checkpoint = 0
+            for result in bulk_exporter.reports(items):
+                add_report(archive, result, manifest)
+                since_checkpoint += 1
+                if since_checkpoint == CHECKPOINT_EVERY:
+                    archive = checkpoint(archive, result.item.operation_id)
+                    since_checkpoint = 0
+                    progress(f"{len(manifest['reports'])} reports exported, {len(manifest['failed'])} failed")
+            after_operation_id = next_after
+            if after_operation_id is not None:
+                archive = checkpoint(archive, after_operation_id)
+        manifest['failed'].sort(key=lambda failure: failure['operationId'])
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+        archive.close()
+    finally:
+        bulk_exporter.release()
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return manifest
+
+
+bulk_exporter = BulkExporter(
+    fetch_workers=int(os.getenv('EXPORT_FETCH_WORKERS', '8')),
+    render_workers=int(os.getenv('EXPORT_RENDER_WORKERS', str(os.cpu_count() or 2))),
+    max_running=int(os.getenv('EXPORT_MAX_RUNNING', '1'))
+)
+atexit.register(bulk_exporter.shutdown)
+
+
+# Run from the backends folder:
+#     python -m services.bulk_export --from 2025-03-01 --to 2025-04-01 --output march.zip [--resume]
+#     python -m services.bulk_export --operations 12 15 19 --conversations ids.json --output reports.zip
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the reports of many operations into one ZIP file")
+    parser.add_argument('--db', default=database.DB_PATH, help="SQLite database file")
+    parser.add_argument('--from', dest='since', help="First start day (UTC)")
+    parser.add_argument('--to', dest='until', help="Day after the last start day (UTC)")
+    parser.add_argument('--operations', type=int, nargs='+', help="Operation ids instead of a date range")
+    parser.add_argument('--conversations', help="JSON file mapping operation ids to conversation ids")
+    parser.add_argument('--output', required=True, help="ZIP file to write")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted export into --output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    database.init_pool(args.db)
+    conversations = None
+    if args.conversations:
+        with open(args.conversations) as conversations_file:
+            conversations = json.load(conversations_file)
+
+    try:
+        selection = Selection(args.since, args.until, args.operations, conversations)
+        manifest = export_to_file(selection, args.output, resume=args.resume)
+    except ExportError as e:
+        parser.error(str(e))
+    print(f"{len(manifest['reports'])} reports written to {args.output}, {len(manifest['failed'])} failed")
+    for failure in manifest['failed']:
+        print(f"  operation {failure['operationId']}: {failure['error']}")
+
+
+if __name__ == '__main__':
+    main()
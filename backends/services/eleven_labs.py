@@ -1,10 +1,146 @@
-from elevenlabs import ElevenLabs
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+from observability import ELEVENLABS_REQUEST_SECONDS
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
 
 
 class ElevenLabsService:
-    def __init__(self, key):
-        self.client = ElevenLabs(api_key=key)
+    def __init__(self, key, max_retries=3, retry_base_delay=0.5, record_dir=None):
+        # The SDK takes most of the API's import time, so it is only loaded
+        # once the first conversation is fetched
+        import httpx
+        from elevenlabs import ElevenLabs
+
+        # One keep-alive pool for the lifetime of the service, instead of a new
+        # client and TLS handshake for every report
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+        )
+        self.client = ElevenLabs(api_key=key, httpx_client=self.http_client)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.record_dir = Path(record_dir) if record_dir else None
+
+    def _fetch(self, conversation_id):
+        # Retries are handled in get_conversation, not stacked on the SDK's own
+        request_options = {'max_retries': 0}
+        conversational_ai = self.client.conversational_ai
+        if hasattr(conversational_ai, 'conversations'):
+            response = conversational_ai.conversations.get(conversation_id=conversation_id, request_options=request_options)
+        else:
+            response = conversational_ai.get_conversation(conversation_id=conversation_id, request_options=request_options)
+        return response.dict()
+
+    def get_conversation(self, conversation_id):
+        import httpx
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                conversation = self._fetch(conversation_id)
+                ELEVENLABS_REQUEST_SECONDS.labels(outcome='ok').observe(time.perf_counter() - start)
+                break
+            except Exception as e:
+                transient = isinstance(e, httpx.TransportError) or getattr(e, 'status_code', None) in RETRY_STATUS_CODES
+                retrying = transient and attempt < self.max_retries
+                ELEVENLABS_REQUEST_SECONDS.labels(outcome='retry' if retrying else 'error').observe(time.perf_counter() - start)
+                if not retrying:
+                    raise
+                logger.warning("Retrying ElevenLabs request", extra={
+                    'conversation_id': conversation_id, 'attempt': attempt + 1, 'error': str(e)
+                })
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+                attempt += 1
+
+        if self.record_dir is not None:
+            RecordedConversations(self.record_dir).save(conversation_id, conversation)
+        return conversation
+
+
+class RecordedConversations:
+    # Stand-in backend serving conversations recorded as <conversation_id>.json,
+    # so the report path can run and be benchmarked without the ElevenLabs API
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def get_conversation(self, conversation_id):
+        path = self.directory / f"{Path(conversation_id).name}.json"
+        with open(path, encoding='utf-8') as fixture:
+            return json.load(fixture)
+
+    def save(self, conversation_id, conversation):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{Path(conversation_id).name}.json"
+        with open(path, 'w', encoding='utf-8') as fixture:
+            json.dump(conversation, fixture, default=str)
+
+
+class CachedConversations:
+    def __init__(self, backend, ttl, max_entries):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_conversation(self, conversation_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(conversation_id)
+                return entry[1]
+
+        conversation = self.backend.get_conversation(conversation_id)
+
+        with self._lock:
+            self._entries[conversation_id] = (now + self.ttl, conversation)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return conversation
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+
+_conversation_service = None
+_conversation_service_lock = threading.Lock()
+
 
-    def get_conversation(self, conversation_id):        
-        response = self.client.conversational_ai.get_conversation(conversation_id=conversation_id)
-        return response.json()
+def get_conversation_service():
+    # Built once per process; ELEVENLABS_FIXTURES_DIR switches to recorded fixtures
+    global _conversation_service
+    with _conversation_service_lock:
+        if _conversation_service is None:
+            fixtures_dir = os.getenv('ELEVENLABS_FIXTURES_DIR')
+            if fixtures_dir:
+                backend = RecordedConversations(fixtures_dir)
+            else:
+                backend = ElevenLabsService(
+                    os.getenv('ELEVENLABS_API_KEY'),
+                    max_retries=int(os.getenv('ELEVENLABS_MAX_RETRIES', '3')),
+                    record_dir=os.getenv('ELEVENLABS_RECORD_DIR')
+                )
+            _conversation_service = CachedConversations(
+                backend,
+                ttl=int(os.getenv('ELEVENLABS_CONVERSATION_TTL', '300')),
+                max_entries=int(os.getenv('ELEVENLABS_CONVERSATION_CACHE_SIZE', '128'))
+            )
+        return _conversation_service
@@ -0,0 +1,132 @@
+import argparse
+import atexit
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import database
+from services.periodic import LeasedWorker
+
+
+# Operations with no new events for this many days are moved to the archive
+EVENT_ARCHIVE_AFTER_DAYS = int(os.getenv('EVENT_ARCHIVE_AFTER_DAYS', '180'))
+# How often a worker runs archival and compaction; 0 leaves it to
+# python -m services.event_archive (e.g. from cron)
+EVENT_ARCHIVE_INTERVAL_SECS = int(os.getenv('EVENT_ARCHIVE_INTERVAL_SECS', '0'))
+# Free pages of hospital.db are released this many at a time, once it is in
+# incremental auto-vacuum mode (new databases are; run --vacuum once for
+# older ones)
+EVENT_VACUUM_STEP_PAGES = int(os.getenv('EVENT_VACUUM_STEP_PAGES', '2000'))
+
+logger = logging.getLogger(__name__)
+
+
+class EventArchiver(LeasedWorker):
+    thread_name = 'event-archiver'
+    lease_name = 'event_archive_lease'
+    failure_message = "Event archival failed"
+
+    def __init__(self, after_days, interval, step_pages):
+        super().__init__(interval)
+        self.after_days = after_days
+        self.step_pages = step_pages
+
+    def archive(self, now=None):
+        # Returns the archives written to and the number of events moved
+        now = now or datetime.now(timezone.utc)
+        # Same format as CURRENT_TIMESTAMP, so it compares as text
+        cutoff = (now - timedelta(days=self.after_days)).strftime('%Y-%m-%d %H:%M:%S')
+        touched = set()
+        moved = 0
+        for operation_id, first_month, archive in database.get_archivable_operations(cutoff):
+            # Late events join the archive the operation already has
+            archive = archive or first_month
+            try:
+                moved += database.archive_operation_events(operation_id, archive)
+            except (ValueError, sqlite3.Error):
+                logger.exception("Archiving events failed", extra={'operation_id': operation_id, 'archive': archive})
+                continue
+            touched.add(archive)
+        if moved:
+            logger.info("Archived events", extra={'events': moved, 'archives': ','.join(sorted(touched))})
+        return touched, moved
+
+    def compact(self, archives=(), vacuum=False):
+        # Only vacuum=True may rewrite hospital.db in full, blocking inserts
+        freed = database.compact(step_pages=self.step_pages, vacuum=vacuum)
+        # Archive files are written only here, so they can be vacuumed outright
+        for archive in archives:
+            database.compact(database.event_archive_path(archive), self.step_pages, vacuum=True)
+        if freed:
+            logger.info("Compacted database", extra={'pages_freed': freed})
+        return freed
+
+    def run_once(self):
+        touched, moved = self.archive()
+        self.compact(touched)
+        return moved
+
+
+def export_archive(archive, output):
+    # Cold-storage copy of one month as gzipped JSON lines, in event_id order
+    path = database.event_archive_path(archive)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    exported = 0
+    try:
+        with gzip.open(output, 'wt', encoding='utf-8') as export:
+            for row in conn.execute(f"SELECT {database.EVENT_ARCHIVE_COLUMNS} FROM Events ORDER BY event_id"):
+                export.write(json.dumps(dict(row)) + '\n')
+                exported += 1
+    finally:
+        conn.close()
+    return exported
+
+
+event_archiver = EventArchiver(
+    EVENT_ARCHIVE_AFTER_DAYS, EVENT_ARCHIVE_INTERVAL_SECS, EVENT_VACUUM_STEP_PAGES
+)
+atexit.register(event_archiver.stop)
+
+
+# Run from the backends folder: python -m services.event_archive [--status | --export 2024-01 | --vacuum]
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive events of closed operations and compact the database")
+    parser.add_argument('--db', default=database.DB_PATH, help="SQLite database file")
+    parser.add_argument('--status', action='store_true', help="List archives without changing anything")
+    parser.add_argument('--export', metavar='YYYY-MM', help="Write one month's archive as gzipped JSON lines")
+    parser.add_argument('--output', help="Export file, default events-YYYY-MM.jsonl.gz")
+    parser.add_argument('--vacuum', action='store_true',
+                        help="Rewrite hospital.db in full, switching it to incremental auto-vacuum if needed; "
+                             "inserts wait until it finishes, so run it in a maintenance window")
+    args = parser.parse_args()
+
+    database.init_pool(args.db)
+
+    if args.status:
+        summary = {archive: (operations, events) for archive, operations, events in database.get_archive_summary()}
+        for archive in sorted(set(summary) | set(database.list_event_archives())):
+            operations, events = summary.get(archive, (0, 0))
+            present = "" if os.path.exists(database.event_archive_path(archive)) else "  (file missing)"
+            print(f"{archive}  {operations:>6} operations {events:>10} events{present}")
+        print(f"hospital.db {database.get_free_page_ratio():.0%} free")
+        return
+
+    if args.export:
+        output = args.output or f"events-{args.export}.jsonl.gz"
+        print(f"Exported {export_archive(args.export, output)} events to {output}")
+        return
+
+    touched, moved = event_archiver.archive()
+    freed = event_archiver.compact(touched, vacuum=args.vacuum)
+    print(f"Archived {moved} events into {len(touched)} archive(s), freed {freed} pages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import database
+
+
+EVENT_STREAM_BUFFER = int(os.getenv('EVENT_STREAM_BUFFER', '256'))
+EVENT_STREAM_MAX_SUBSCRIBERS = int(os.getenv('EVENT_STREAM_MAX_SUBSCRIBERS', '500'))
+EVENT_STREAM_HEARTBEAT = float(os.getenv('EVENT_STREAM_HEARTBEAT_SECS', '15'))
+# How often events written by other worker processes are picked up; 0 turns it off
+EVENT_STREAM_POLL_MS = int(os.getenv('EVENT_STREAM_POLL_MS', '250'))
+EVENT_STREAM_REPLAY_PAGE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def event_to_dict(row):
+    event_id, operation_id, event_type, event_value, timestamp = row
+    return {
+        'eventId': event_id,
+        'operationId': operation_id,
+        'eventType': event_type,
+        'eventValue': event_value,
+        'timestamp': timestamp
+    }
+
+
+def format_sse(event):
+    return f"id: {event['eventId']}\nevent: event\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscriber:
+    def __init__(self, operation_id, max_buffer):
+        self.operation_id = operation_id
+        self.max_buffer = max_buffer
+        self.overflowed = False
+        self._events = deque()
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        with self._ready:
+            if len(self._events) >= self.max_buffer:
+                # A slow client does not hold memory: drop its buffer and let
+                # it catch up from the Events table instead
+                self._events.clear()
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._ready.notify()
+
+    def take(self, timeout):
+        # Returns (events, overflowed), waiting up to timeout for either
+        with self._ready:
+            if not self._events and not self.overflowed:
+                self._ready.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            overflowed = self.overflowed
+            self.overflowed = False
+            return events, overflowed
+
+
+class EventBus:
+    def __init__(self, max_buffer, max_subscribers, heartbeat, poll_interval):
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self._poller = None
+        self._subscribers = defaultdict(set)
+        self._count = 0
+        self._last_event_id = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, operation_id):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers(f"{self._count} event streams already open")
+            if self._last_event_id is None:
+                self._last_event_id = database.get_max_event_id()
+            subscriber = Subscriber(operation_id, self.max_buffer)
+            self._subscribers[operation_id].add(subscriber)
+            self._count += 1
+            if self.poll_interval > 0 and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='event-bus-poll', daemon=True)
+                self._poller.start()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.operation_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.operation_id]
+            self._count -= 1
+            if self._count == 0:
+                # Nobody is listening, so stop tracking new event ids
+                self._last_event_id = None
+
+    def _poll(self):
+        # Events written by other worker processes never reach this process's
+        # event writer listener, so they are read from the table while anyone
+        # here is subscribed
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if self._count == 0:
+                    self._poller = None
+                    return
+            try:
+                self.publish_committed()
+            except Exception:
+                logger.exception("Event stream poll failed")
+
+    def publish_committed(self, rows=None):
+        # Event writer listener. The committed rows carry no ids, so read back
+        # everything past the last id seen: a rowid range scan over the new rows only.
+        with self._lock:
+            if self._last_event_id is None:
+                return
+            events = [event_to_dict(row) for row in database.get_events_since(self._last_event_id)]
+            if not events:
+                return
+            self._last_event_id = events[-1]['eventId']
+            subscribers = {
+                operation_id: list(self._subscribers.get(operation_id, ()))
+                for operation_id in {event['operationId'] for event in events}
+            }
+
+        for event in events:
+            for subscriber in subscribers[event['operationId']]:
+                subscriber.push(event)
+
+    def replay(self, operation_id, after_event_id):
+        # Stored events of the operation, one page per query so a slow
+        # client never holds a pooled connection
+        while True:
+            rows = database.get_operation_events_since(operation_id, after_event_id, EVENT_STREAM_REPLAY_PAGE)
+            for row in rows:
+                event = event_to_dict(row)
+                after_event_id = event['eventId']
+                yield event
+            if len(rows) < EVENT_STREAM_REPLAY_PAGE:
+                return
+
+    def stream(self, subscriber, last_event_id=0):
+        # SSE body: stored events after last_event_id, then live ones. Also
+        # used to catch up after the subscriber's buffer overflowed.
+        try:
+            yield "retry: 3000\n\n"
+            catch_up = True
+            while True:
+                if catch_up:
+                    for event in self.replay(subscriber.operation_id, last_event_id):
+                        last_event_id = event['eventId']
+                        yield format_sse(event)
+                    catch_up = False
+
+                events, overflowed = subscriber.take(self.heartbeat)
+                if overflowed:
+                    catch_up = True
+                    continue
+                if not events:
+                    # Comment line; lets the server notice closed connections
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in events:
+                    # Live events already sent during the catch-up are skipped
+                    if event['eventId'] > last_event_id:
+                        last_event_id = event['eventId']
+                        yield format_sse(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'operations': len(self._subscribers),
+                'maxSubscribers': self.max_subscribers
+            }
+
+
+event_bus = EventBus(
+    max_buffer=EVENT_STREAM_BUFFER,
+    max_subscribers=EVENT_STREAM_MAX_SUBSCRIBERS,
+    heartbeat=EVENT_STREAM_HEARTBEAT,
+    poll_interval=EVENT_STREAM_POLL_MS / 1000
+)
@@ -0,0 +1,194 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import database
+from observability import EVENTS_DROPPED
+
+
+EVENT_COLUMNS = ('operation_id', 'event_type', 'event_value')
+
+# Acknowledgement modes a caller can ask for when submitting events
+ACK_QUEUED = 'queued'        # return as soon as the events are queued
+ACK_COMMITTED = 'committed'  # wait until the batch holding them is committed
+ACK_MODES = (ACK_QUEUED, ACK_COMMITTED)
+
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite:
+    def __init__(self, rows, urgent=False):
+        self.rows = rows
+        self.urgent = urgent
+        self.attempts = 0
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("Events were not committed in time")
+        if self.error is not None:
+            raise self.error
+
+
+class EventWriter:
+    def __init__(self, batch_size=500, flush_interval=0.05, max_retries=5, retry_delay=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        # (due, pending) for queued-ack submissions whose insert failed; only
+        # touched by the writer thread
+        self._retries = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._listeners = []
+
+    def add_listener(self, listener):
+        # Called from the writer thread with the rows of every committed batch
+        self._listeners.append(listener)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, rows, ack=ACK_COMMITTED, timeout=10):
+        if self._closed:
+            raise RuntimeError("Event writer is shut down")
+        self.start()
+
+        pending = PendingWrite(list(rows), urgent=ack == ACK_COMMITTED)
+        self._queue.put(pending)
+        if ack == ACK_COMMITTED:
+            pending.wait(timeout)
+        return pending
+
+    def close(self, timeout=10):
+        # Stop accepting events, then let the worker flush everything queued
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            retries = self._due_retries()
+            if retries:
+                self._flush(retries)
+                continue
+            try:
+                first = self._queue.get(timeout=self._retry_wait())
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+
+            batch = [first]
+            size = len(first.rows)
+            urgent = first.urgent
+            deadline = time.monotonic() + self.flush_interval
+            while size < self.batch_size:
+                # A caller waiting for the commit only picks up what is already
+                # queued; queued-ack events wait out the flush interval
+                remaining = 0 if urgent else deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        pending = self._queue.get(timeout=remaining)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+                size += len(pending.rows)
+                urgent = urgent or pending.urgent
+
+            self._flush(batch)
+
+        # Shutting down: events still waiting for a retry get one last try
+        self._flush(self._due_retries(everything=True), final=True)
+
+    def _retry_wait(self):
+        if not self._retries:
+            return None
+        return max(0, min(due for due, _ in self._retries) - time.monotonic())
+
+    def _due_retries(self, everything=False):
+        now = time.monotonic()
+        due = [pending for when, pending in self._retries if everything or when <= now]
+        self._retries = [(when, pending) for when, pending in self._retries if not everything and when > now]
+        return due
+
+    def _flush(self, batch, final=False):
+        if not batch:
+            return
+        rows = [row for pending in batch for row in pending.rows]
+        try:
+            database.insert_events(EVENT_COLUMNS, rows)
+        except Exception:
+            # One bad submission must not fail the others coalesced with it
+            rows = []
+            for pending in batch:
+                try:
+                    database.insert_events(EVENT_COLUMNS, pending.rows)
+                    rows.extend(pending.rows)
+                    pending.resolve()
+                except Exception as e:
+                    self._retry_or_drop(pending, e, final)
+        else:
+            for pending in batch:
+                pending.resolve()
+
+        if rows:
+            self._notify(rows)
+
+    def _retry_or_drop(self, pending, error, final):
+        # A caller waiting for the commit gets the error; queued-ack events
+        # were already acknowledged, so they are retried with backoff first
+        if not pending.urgent and not final and pending.attempts < self.max_retries:
+            pending.attempts += 1
+            delay = self.retry_delay * 2 ** (pending.attempts - 1)
+            self._retries.append((time.monotonic() + delay, pending))
+            logger.warning("Inserting events failed, retrying", extra={
+                'events': len(pending.rows), 'attempt': pending.attempts, 'retry_in_s': delay, 'error': str(error)
+            })
+            return
+        ack = ACK_COMMITTED if pending.urgent else ACK_QUEUED
+        logger.exception(f"Dropping {len(pending.rows)} events", extra={
+            'events': len(pending.rows), 'ack': ack, 'attempts': pending.attempts + 1
+        })
+        EVENTS_DROPPED.labels(ack=ack).inc(len(pending.rows))
+        pending.resolve(error)
+
+    def _notify(self, rows):
+        for listener in self._listeners:
+            try:
+                listener(rows)
+            except Exception:
+                logger.exception("Event listener failed")
+
+
+event_writer = EventWriter(
+    batch_size=int(os.getenv('EVENT_BATCH_SIZE', '500')),
+    flush_interval=int(os.getenv('EVENT_FLUSH_INTERVAL_MS', '50')) / 1000,
+    max_retries=int(os.getenv('EVENT_MAX_RETRIES', '5')),
+    retry_delay=int(os.getenv('EVENT_RETRY_DELAY_MS', '500')) / 1000
+)
+atexit.register(event_writer.close)
@@ -0,0 +1,67 @@
+from datetime import date
+
+import database
+from utils.narcotics import CONTROLLED_SUBSTANCES
+
+
+# JSON names of the columns identifying each group_by, in database order
+GROUP_FIELDS = {
+    'drug': (),
+    'day': ('day', ),
+    'room': ('roomId', 'roomName'),
+    'user': ('userId', 'firstName', 'lastName'),
+    'operation': ('operationId', 'roomId', 'userId'),
+}
+EXTRA_FIELDS = {
+    'operation': ('firstUse', 'lastUse'),
+}
+
+
+class NarcoticsError(Exception):
+    pass
+
+
+def parse_day(value, name):
+    # ISO date; aggregates are per UTC day
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise NarcoticsError(f"{name} must be an ISO date")
+
+
+def usage_to_dict(row, group_by):
+    keys = GROUP_FIELDS[group_by]
+    drug, administrations, undosed, dose_mg, *extra = row[len(keys):]
+    return {
+        **dict(zip(keys, row)),
+        'drug': drug,
+        'administrations': administrations,
+        'undosedAdministrations': undosed,
+        'doseMg': round(dose_mg, 4),
+        **dict(zip(EXTRA_FIELDS.get(group_by, ()), extra))
+    }
+
+
+def summary(group_by='drug', since=None, until=None, drug=None, room_id=None, user_id=None):
+    # Controlled-substance usage per drug, optionally broken down further,
+    # from the aggregates kept by database.insert_events. doseMg sums the
+    # doses given in milligrams; undosedAdministrations counts notes naming
+    # the drug without a mass dose.
+    if group_by not in GROUP_FIELDS:
+        raise NarcoticsError(f"groupBy must be one of {', '.join(GROUP_FIELDS)}")
+    if drug is not None:
+        drug = drug.lower()
+        if drug not in CONTROLLED_SUBSTANCES:
+            raise NarcoticsError(f"drug must be one of {', '.join(CONTROLLED_SUBSTANCES)}")
+
+    rows = database.get_narcotic_usage(
+        group_by, parse_day(since, 'from'), parse_day(until, 'to'), drug=drug, room_id=room_id, user_id=user_id
+    )
+    return {
+        'from': since,
+        'to': until,
+        'groupBy': group_by,
+        'results': [usage_to_dict(row, group_by) for row in rows]
+    }
@@ -0,0 +1,105 @@
+import atexit
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Stored hashes made with other parameters are upgraded on the next login.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '16'))
+PASSWORD_HASH_PER_CLIENT = int(os.getenv('PASSWORD_HASH_PER_CLIENT', '2'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '30'))
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class TooManyAttempts(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, method, workers, max_pending, per_client, timeout):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_client = per_client
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._in_flight = Counter()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Threads are enough: hashlib releases the GIL while OpenSSL runs
+        # scrypt/pbkdf2, and the pool size caps how many cores hashing can take
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        return self._executor
+
+    def _acquire(self, clients):
+        with self._lock:
+            for client in clients:
+                if self._in_flight[client] >= self.per_client:
+                    raise TooManyAttempts(f"{self._in_flight[client]} password checks already running for {client}")
+            if self._pending >= self.max_pending:
+                raise HasherBusy(f"{self._pending} password hashes already pending")
+            self._pending += 1
+            for client in clients:
+                self._in_flight[client] += 1
+            return self._get_executor()
+
+    def _release(self, clients):
+        with self._lock:
+            self._pending -= 1
+            for client in clients:
+                self._in_flight[client] -= 1
+                if self._in_flight[client] <= 0:
+                    del self._in_flight[client]
+
+    def _run(self, clients, function, *args):
+        # clients are the keys (IP address, email) whose concurrent hashes are limited
+        clients = tuple(client for client in clients if client)
+        executor = self._acquire(clients)
+        try:
+            return executor.submit(function, *args).result(timeout=self.timeout)
+        finally:
+            self._release(clients)
+
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split('$', 1)[0] != self.method
+
+    def _verify(self, stored_hash, password):
+        if not check_password_hash(stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, generate_password_hash(password, method=self.method)
+        return True, None
+
+    def hash(self, password, clients=()):
+        return self._run(clients, generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password, clients=()):
+        # Returns (matches, new_hash); new_hash is set when the stored hash
+        # used other parameters and should be replaced
+        return self._run(clients, self._verify, stored_hash, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(
+    method=PASSWORD_HASH_METHOD,
+    workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    per_client=PASSWORD_HASH_PER_CLIENT,
+    timeout=PASSWORD_HASH_TIMEOUT
+)
+atexit.register(password_hasher.shutdown)
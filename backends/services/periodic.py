@@ -0,0 +1,47 @@
+import logging
+import threading
+
+import database
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeasedWorker:
+    # Background thread that every worker process starts; each interval the
+    # one holding the lease (a Counters row, see database.acquire_lease) calls
+    # run_once. Subclasses set thread_name, lease_name and failure_message.
+    thread_name = None
+    lease_name = None
+    failure_message = None
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def enabled(self):
+        return self.interval > 0
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def start(self):
+        if not self.enabled() or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if database.acquire_lease(self.lease_name, self.interval):
+                    self.run_once()
+            except Exception:
+                logger.exception(self.failure_message)
@@ -0,0 +1,59 @@
+import argparse
+import atexit
+import logging
+import os
+import time
+
+import database
+from services.periodic import LeasedWorker
+
+
+# How often a worker copies hospital.db to HOSPITAL_DB_REPLICA_PATH; 0 leaves
+# it to python -m services.replica (e.g. from cron)
+REPLICA_REFRESH_SECS = int(os.getenv('HOSPITAL_DB_REPLICA_REFRESH_SECS', '300'))
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRefresher(LeasedWorker):
+    thread_name = 'replica-refresher'
+    lease_name = 'replica_lease'
+    failure_message = "Refreshing the database replica failed"
+
+    def refresh(self):
+        start = time.perf_counter()
+        pages = database.refresh_replica()
+        logger.info("Refreshed database replica", extra={
+            'pages': pages, 'duration_ms': round((time.perf_counter() - start) * 1000)
+        })
+        return pages
+
+    def enabled(self):
+        return bool(database.DB_REPLICA_PATH) and super().enabled()
+
+    def run_once(self):
+        return self.refresh()
+
+
+replica_refresher = ReplicaRefresher(REPLICA_REFRESH_SECS)
+atexit.register(replica_refresher.stop)
+
+
+# Run from the backends folder: python -m services.replica --replica /var/lib/hospital/replica.db
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the database to the read replica used by search and analytics")
+    parser.add_argument('--db', default=database.DB_PATH, help="SQLite database file")
+    parser.add_argument('--replica', default=database.DB_REPLICA_PATH, help="Replica file to write")
+    args = parser.parse_args()
+    if not args.replica:
+        parser.error("set --replica or HOSPITAL_DB_REPLICA_PATH")
+
+    database.init_pool(args.db, replica_path=args.replica)
+    start = time.perf_counter()
+    pages = database.refresh_replica()
+    print(f"Copied {pages} pages to {args.replica} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+
+
+class ReportCache:
+    def __init__(self, directory, memory_max_bytes, disk_max_bytes, entry_max_bytes):
+        self.directory = Path(directory)
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.entry_max_bytes = entry_max_bytes
+        # key -> (operation id, report bytes)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Keys in memory per operation, for invalidate()
+        self._operation_keys = {}
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(conversation_id, operation_id, surgery_details, event_fingerprint):
+        payload = json.dumps(
+            [conversation_id, int(operation_id), surgery_details, list(event_fingerprint)],
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, operation_id, key):
+        # The operation id prefix lets invalidate() find entries after a restart
+        return self.directory / f"{int(operation_id)}_{key}.pdf"
+
+    def get(self, operation_id, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return BytesIO(entry[1])
+
+        path = self._path(operation_id, key)
+        try:
+            report = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Invalidated after it was opened; the open file can still be sent
+            pass
+        with self._lock:
+            self.counters['disk_hits'] += 1
+        return report
+
+    def put(self, operation_id, key, report):
+        # Stores the report on disk and, when small enough, in memory; the
+        # report file object is rewound so the caller can still send it
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(operation_id, key)
+        # Writers of the same key (a download and the job queue, or two
+        # workers) each get their own temporary file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{int(operation_id)}_", suffix='.tmp')
+
+        report.seek(0)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(report, out)
+                size = out.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        if size <= self.entry_max_bytes:
+            report.seek(0)
+            self._remember(operation_id, key, report.read())
+
+        report.seek(0)
+        self._evict_disk()
+
+    def _remember(self, operation_id, key, data):
+        with self._lock:
+            if key in self._memory:
+                self._forget(key)
+            self._memory[key] = (int(operation_id), data)
+            self._memory_bytes += len(data)
+            self._operation_keys.setdefault(int(operation_id), set()).add(key)
+
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                self._forget(next(iter(self._memory)))
+
+    def _forget(self, key):
+        # Called with the lock held
+        operation_id, data = self._memory.pop(key)
+        self._memory_bytes -= len(data)
+        keys = self._operation_keys.get(operation_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._operation_keys[operation_id]
+
+    def _evict_disk(self):
+        # Oldest first. Files can vanish meanwhile (invalidate(), other
+        # workers evicting); entries still in memory stay usable.
+        files = []
+        for path in self.directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            total -= size
+            path.unlink(missing_ok=True)
+
+    def invalidate(self, operation_ids):
+        for operation_id in operation_ids:
+            with self._lock:
+                for key in list(self._operation_keys.get(int(operation_id), ())):
+                    self._forget(key)
+                self.counters['invalidations'] += 1
+
+            for path in self.directory.glob(f"{int(operation_id)}_*.pdf"):
+                path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes
+            }
+
+
+report_cache = ReportCache(
+    directory=os.getenv('REPORT_CACHE_DIR', 'report_cache'),
+    memory_max_bytes=int(os.getenv('REPORT_CACHE_MEMORY_MAX_BYTES', str(64 * 1024 * 1024))),
+    disk_max_bytes=int(os.getenv('REPORT_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024))),
+    entry_max_bytes=int(os.getenv('REPORT_CACHE_ENTRY_MAX_BYTES', str(4 * 1024 * 1024)))
+)
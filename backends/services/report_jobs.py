@@ -0,0 +1,194 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from observability import REPORT_PHASE_SECONDS, timed
+from services.report_state import report_states
+
+
+JOB_QUEUED = 'queued'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def render_report_job(conversation_id, surgery_details, operation_id, event_rows_by_value):
+    # Runs in a worker process: fetches the conversation and renders the PDF.
+    # Event rows come from the API process, so workers never open the database.
+    from services.eleven_labs import get_conversation_service
+    from utils.report_generator import create_report
+
+    started_at = time.time()
+    with timed(REPORT_PHASE_SECONDS, phase='fetch'):
+        response = get_conversation_service().get_conversation(conversation_id)
+    report_buffer, output_filename = create_report(
+        response, surgery_details, operation_id, event_rows_by_value
+    )
+
+    with report_buffer:
+        return report_buffer.read(), output_filename, started_at, time.time()
+
+
+class ReportJob:
+    def __init__(self, cache_key, operation_id):
+        self.id = uuid.uuid4().hex
+        self.cache_key = cache_key
+        self.operation_id = operation_id
+        self.status = JOB_QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.report = None
+        self.filename = None
+
+    def to_row(self):
+        return (
+            self.id, self.operation_id, self.cache_key, self.status, self.error, self.filename,
+            self.submitted_at, self.started_at, self.finished_at
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        # A job submitted to another worker process; its PDF, once done,
+        # is found in the report cache under its cache key
+        job = cls(row['cache_key'], row['operation_id'])
+        job.id = row['job_id']
+        job.status = row['status']
+        job.error = row['error']
+        job.filename = row['filename']
+        job.submitted_at = row['submitted_at']
+        job.started_at = row['started_at']
+        job.finished_at = row['finished_at']
+        return job
+
+    def to_dict(self):
+        timing = {}
+        if self.started_at is not None:
+            timing['queuedMs'] = int((self.started_at - self.submitted_at) * 1000)
+        if self.finished_at is not None and self.started_at is not None:
+            timing['renderMs'] = int((self.finished_at - self.started_at) * 1000)
+        return {
+            'jobId': self.id,
+            'status': self.status,
+            'operationId': self.operation_id,
+            'error': self.error,
+            **timing
+        }
+
+
+class ReportJobQueue:
+    def __init__(self, max_workers, max_pending, result_ttl):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = None
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        # Called with every job that finished successfully
+        self._listeners.append(listener)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn rather than fork: the API process has live SQLite
+            # connections and threads that must not be copied into workers
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def submit(self, conversation_id, surgery_details, operation_id, cache_key):
+        # Rows laid out as the notes arrived, brought up to date on the request thread
+        event_rows_by_value = report_states.rows(operation_id)
+
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} report jobs already pending")
+            job = ReportJob(cache_key, operation_id)
+            self._jobs[job.id] = job
+            self._pending += 1
+            executor = self._get_executor()
+        database.save_report_job(job.to_row())
+
+        future = executor.submit(
+            render_report_job, conversation_id, surgery_details, operation_id, event_rows_by_value
+        )
+        future.add_done_callback(lambda done: self._finish(job, done))
+        return job
+
+    def _finish(self, job, future):
+        try:
+            job.report, job.filename, job.started_at, job.finished_at = future.result()
+            job.status = JOB_DONE
+        except Exception as e:
+            logger.exception("Report job failed", extra={'job_id': job.id})
+            job.finished_at = time.time()
+            job.error = str(e)
+            job.status = JOB_FAILED
+
+        with self._lock:
+            self._pending -= 1
+
+        try:
+            database.save_report_job(job.to_row())
+        except Exception:
+            logger.exception("Saving report job failed", extra={'job_id': job.id})
+
+        if job.status == JOB_DONE:
+            for listener in self._listeners:
+                try:
+                    listener(job)
+                except Exception:
+                    logger.exception("Report job listener failed", extra={'job_id': job.id})
+
+    def _prune(self):
+        # Finished jobs are kept for result_ttl seconds so clients can fetch them
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        database.delete_report_jobs_finished_before(now - self.result_ttl)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            row = database.get_report_job(job_id)
+            if row is not None:
+                job = ReportJob.from_row(row)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'jobs': len(self._jobs), 'maxPending': self.max_pending}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+report_jobs = ReportJobQueue(
+    max_workers=int(os.getenv('REPORT_JOB_WORKERS', str(os.cpu_count() or 2))),
+    max_pending=int(os.getenv('REPORT_JOB_MAX_PENDING', '32')),
+    result_ttl=int(os.getenv('REPORT_JOB_RESULT_TTL', '600'))
+)
+atexit.register(report_jobs.shutdown)
@@ -0,0 +1,111 @@
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+
+# Operations whose report rows are kept laid out in memory; a surgery pushed
+# out is rebuilt from the database on its next download
+REPORT_STATE_MAX_OPERATIONS = int(os.getenv('REPORT_STATE_MAX_OPERATIONS', '64'))
+CATCH_UP_PAGE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+class OperationReportRows:
+    # Events table rows of one operation, keyed by event value, extended with
+    # every event committed after last_event_id. Reads go through the
+    # database, so events written by other worker processes are picked up too.
+    def __init__(self, operation_id):
+        self.operation_id = operation_id
+        self.last_event_id = 0
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def catch_up(self, template):
+        from utils.report_generator import convert_timestamps
+
+        with self.lock:
+            while True:
+                events = database.get_operation_events_since(self.operation_id, self.last_event_id, CATCH_UP_PAGE)
+                if not events:
+                    break
+                local_times = convert_timestamps(
+                    (event['timestamp'] for event in events if event['timestamp']), template.timezone
+                )
+                for event in events:
+                    # The first occurrence of a value decides its timestamp
+                    if event['event_value'] not in self.rows:
+                        self.rows[event['event_value']] = template.event_row(
+                            local_times.get(event['timestamp'], " "), event['event_value']
+                        )
+                self.last_event_id = events[-1]['event_id']
+                if len(events) < CATCH_UP_PAGE:
+                    break
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.rows)
+
+
+class ReportStates:
+    def __init__(self, max_operations):
+        self.max_operations = max_operations
+        self._operations = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _state(self, operation_id):
+        with self._lock:
+            state = self._operations.pop(operation_id, None) or OperationReportRows(operation_id)
+            self._operations[operation_id] = state
+            while len(self._operations) > self.max_operations:
+                self._operations.popitem(last=False)
+            return state
+
+    def rows(self, operation_id):
+        # Event value -> EventRow for create_report, current as of this call
+        from utils.report_generator import get_report_template
+
+        state = self._state(int(operation_id))
+        state.catch_up(get_report_template())
+        return state.snapshot()
+
+    def update(self, rows):
+        # event_writer listener: lays out the new events of each operation
+        # right after they are committed, so a download only has the last few
+        # left to do. Runs on its own thread to keep the writer free.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-state')
+            executor = self._executor
+        executor.submit(self._catch_up, {row[0] for row in rows})
+
+    def _catch_up(self, operation_ids):
+        from utils.report_generator import get_report_template
+
+        template = get_report_template()
+        for operation_id in operation_ids:
+            try:
+                self._state(int(operation_id)).catch_up(template)
+            except Exception:
+                logger.exception("Report rows update failed", extra={'operation_id': operation_id})
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'operations': len(self._operations),
+                'rows': sum(len(state.rows) for state in self._operations.values())
+            }
+
+
+report_states = ReportStates(REPORT_STATE_MAX_OPERATIONS)
+atexit.register(report_states.close)
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import deque
+
+import database
+
+
+ROOM_CHANGE_HISTORY = int(os.getenv('ROOM_CHANGE_HISTORY', '256'))
+ROOM_VERSION_COUNTER = 'rooms'
+
+
+def room_to_dict(room_id, name, is_available):
+    return {
+        "id": room_id,
+        "name": name,
+        "status": "Available" if is_available else "In Use"
+    }
+
+
+class RoomCache:
+    def __init__(self, history_size):
+        self.history_size = history_size
+        self._rooms = None
+        self._changes = deque(maxlen=history_size)
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        # The version lives in the Counters table, so every worker process
+        # agrees on it; a change made by another worker shows up as a newer
+        # version and the rooms are reloaded (its deltas are not known here)
+        version = database.get_counter(ROOM_VERSION_COUNTER)
+        if self._rooms is None or version != self._version:
+            # Rooms and their version from one snapshot, so a change landing
+            # in between is never cached under the older version
+            version, rooms = database.get_rooms(ROOM_VERSION_COUNTER)
+            self._rooms = {
+                room['room_id']: room_to_dict(room['room_id'], room['name'], room['is_available'])
+                for room in rooms
+            }
+            self._changes.clear()
+            self._version = version
+
+    def snapshot(self):
+        # Returns (version, rooms)
+        with self._lock:
+            self._refresh()
+            return self._version, list(self._rooms.values())
+
+    def changes_since(self, version):
+        # Returns (version, changed rooms, full); full is True when the
+        # changes since version are no longer known and every room is returned
+        with self._lock:
+            self._refresh()
+            if version == self._version:
+                return self._version, [], False
+            oldest = self._changes[0][0] - 1 if self._changes else self._version
+            if version is None or version < oldest or version > self._version:
+                return self._version, list(self._rooms.values()), True
+
+            changed = {}
+            for change_version, room in self._changes:
+                if change_version > version:
+                    changed[room['id']] = room
+            return self._version, list(changed.values()), False
+
+    def set_available(self, room_id, is_available):
+        # Write-through: the database first, then the cached room
+        with self._lock:
+            self._refresh()
+            version = database.set_room_available(room_id, is_available, ROOM_VERSION_COUNTER)
+            if version is None:
+                return None
+            if version != self._version + 1 or room_id not in self._rooms:
+                # Someone else changed rooms meanwhile; reload everything
+                self._rooms = None
+                self._refresh()
+                return self._rooms[room_id]
+
+            room = room_to_dict(room_id, self._rooms[room_id]['name'], is_available)
+            self._rooms[room_id] = room
+            self._version = version
+            self._changes.append((version, room))
+            return room
+
+    def invalidate(self):
+        # For writes made outside the cache; reloads on next use
+        with self._lock:
+            self._rooms = None
+
+
+room_cache = RoomCache(history_size=ROOM_CHANGE_HISTORY)
@@ -0,0 +1,95 @@
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+import database
+
+
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '200'))
+SEARCH_MAX_WORDS = 10
+
+
+class SearchError(Exception):
+    pass
+
+
+def match_expression(text):
+    # Free text to an FTS5 expression: every word must occur, as a prefix
+    # ("fent 50" finds "Fentanyl 50mcg"). Words are quoted, so nothing the
+    # user types is read as FTS5 syntax.
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        raise SearchError("q must contain at least one word")
+    if len(words) > SEARCH_MAX_WORDS:
+        raise SearchError(f"q may contain at most {SEARCH_MAX_WORDS} words")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def parse_time(value, name):
+    # ISO date or datetime; naive values are UTC like Events.timestamp
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise SearchError(f"{name} must be an ISO date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def search_event_to_dict(row):
+    event_id, operation_id, event_type, event_value, timestamp, room_id, room_name = row
+    return {
+        'eventId': event_id,
+        'operationId': operation_id,
+        'eventType': event_type,
+        'eventValue': event_value,
+        'timestamp': timestamp,
+        'roomId': room_id,
+        'roomName': room_name
+    }
+
+
+def search_operation_to_dict(row):
+    (operation_id, matching_events, first_match, last_match, room_id, room_name,
+     operation_type, patient_first_name, patient_last_name, patient_id) = row
+    return {
+        'operationId': operation_id,
+        'matchingEvents': matching_events,
+        'firstMatch': first_match,
+        'lastMatch': last_match,
+        'roomId': room_id,
+        'roomName': room_name,
+        'operationType': operation_type,
+        'patientFirstName': patient_first_name,
+        'patientLastName': patient_last_name,
+        'patientId': patient_id
+    }
+
+
+SCOPES = {
+    # scope: (query, row to JSON, key the cursor is taken from)
+    'events': (database.search_events, search_event_to_dict, 'eventId'),
+    'operations': (database.search_operations, search_operation_to_dict, 'operationId'),
+}
+
+
+def search(text, scope='events', cursor=None, limit=50, since=None, until=None, room_id=None, event_type=None):
+    # One page of results and the cursor for the next one (None on the last
+    # page). The cursor is the last id returned; pages are keyed on it rather
+    # than an offset, so deep pages cost the same as the first.
+    if scope not in SCOPES:
+        raise SearchError(f"scope must be one of {', '.join(SCOPES)}")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise SearchError(f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    query, to_dict, key = SCOPES[scope]
+
+    rows = query(
+        match_expression(text), sys.maxsize if cursor is None else cursor, limit + 1,
+        since=parse_time(since, 'from'), until=parse_time(until, 'to'), room_id=room_id, event_type=event_type
+    )
+    results = [to_dict(row) for row in rows[:limit]]
+    next_cursor = results[-1][key] if len(rows) > limit else None
+    return {'results': results, 'nextCursor': next_cursor}
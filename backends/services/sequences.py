@@ -0,0 +1,52 @@
+import os
+import threading
+
+import database
+
+
+OPERATION_ID_BLOCK_SIZE = int(os.getenv('OPERATION_ID_BLOCK_SIZE', '1'))
+
+
+class SequenceAllocator:
+    # Hands out ids from a block reserved on the Counters table. The block's
+    # bounds are this process's cached high-water mark, so ids within a block
+    # cost no database round trip; blocks larger than 1 can leave gaps when
+    # the process exits with ids unused.
+    def __init__(self, name, block_size):
+        self.name = name
+        self.block_size = block_size
+        self._next = 1
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            if self._next > self._limit:
+                self._next = database.reserve_ids(self.name, self.block_size)
+                self._limit = self._next + self.block_size - 1
+            allocated = self._next
+            self._next += 1
+            return allocated
+
+    def reserve(self, count):
+        # A contiguous range straight from the counter
+        first = database.reserve_ids(self.name, count)
+        return list(range(first, first + count))
+
+
+class OperationIdAllocator(SequenceAllocator):
+    # Operation ids can also be reserved ahead by a theatre; the range is
+    # recorded with its room so no other theatre can create operations with it
+    def __init__(self, block_size):
+        super().__init__('operation', block_size)
+
+    def reserve(self, count, room_id, user_id=None):
+        first = database.reserve_operation_ids(count, room_id, user_id)
+        return list(range(first, first + count))
+
+    def reserved_room(self, operation_id):
+        # Room the id was reserved for, or None when it was not reserved
+        reservation = database.get_operation_id_reservation(operation_id)
+        return reservation[0] if reservation is not None else None
+
+operation_ids = OperationIdAllocator(block_size=OPERATION_ID_BLOCK_SIZE)
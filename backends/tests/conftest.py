@@ -0,0 +1,13 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # A migrated, empty hospital.db for the test
+    path = str(tmp_path / 'hospital.db')
+    pool = database.init_pool(path)
+    database.migrate_database(progress=lambda message: None)
+    yield path
+    pool.close_all()
@@ -0,0 +1,45 @@
+import database
+from services.bulk_export import Selection
+
+
+OPERATION_COLUMNS = ('operation_id', 'room_id', 'user_id', 'patient_first_name', 'patient_last_name',
+                     'patient_id', 'operation_type')
+
+
+def add_operation(operation_id, *timestamps):
+    database.insert_many("Operation", OPERATION_COLUMNS,
+                         [(operation_id, 1, 1, 'Jan', 'Nowak', f"9001011{operation_id:04}", 'Appendectomy')])
+    database.insert_many("Events", ('operation_id', 'event_type', 'event_value', 'timestamp'),
+                         [(operation_id, 'note', f"note {i}", timestamp) for i, timestamp in enumerate(timestamps)])
+
+
+def test_date_range_selects_operations_by_first_event(db_path):
+    add_operation(1, '2025-02-27 10:00:00')
+    add_operation(2, '2025-03-05 10:00:00', '2025-03-05 11:00:00')
+    add_operation(3, '2025-03-10 08:00:00')
+    add_operation(4)
+    add_operation(5, '2025-02-28 23:30:00', '2025-03-01 00:30:00')
+    add_operation(6, '2025-04-01 00:00:00')
+    for operation_id in (1, 2, 5, 6):
+        database.save_operation_conversation(operation_id, f"conversation-{operation_id}")
+    # Archived: its events are gone, the start recorded with the conversation remains
+    with database.connection() as conn:
+        conn.execute("INSERT INTO OperationConversation VALUES (4, 'conversation-4', '2025-03-20 09:00:00')")
+        conn.commit()
+
+    items, failures, next_after = Selection('2025-03-01', '2025-04-01').page()
+
+    assert [(item.operation_id, item.conversation_id) for item in items] == [(2, 'conversation-2'), (4, 'conversation-4')]
+    # Never downloaded, so no conversation to fetch; reported rather than left out
+    assert failures == [{'operationId': 3, 'error': "No conversation recorded for the operation"}]
+    assert next_after is None
+
+
+def test_conversations_given_with_the_selection_are_used(db_path):
+    add_operation(1, '2025-03-02 10:00:00')
+    add_operation(2, '2025-03-03 10:00:00')
+
+    items, failures, _ = Selection('2025-03-01', '2025-04-01', conversations={'2': 'given'}).page()
+
+    assert [(item.operation_id, item.conversation_id) for item in items] == [(2, 'given')]
+    assert [failure['operationId'] for failure in failures] == [1]
@@ -0,0 +1,73 @@
+import multiprocessing
+import threading
+
+import database
+from benchmarks.bench_counters import allocate
+from services.sequences import OperationIdAllocator, SequenceAllocator
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_threads_get_unique_gap_free_ids(db_path):
+    allocator = SequenceAllocator('operation', block_size=1)
+    allocated = []
+    run_threads(8, lambda: allocated.extend(allocator.next_id() for _ in range(50)))
+    assert sorted(allocated) == list(range(1, 401))
+
+
+def test_processes_get_unique_gap_free_ids(db_path):
+    with multiprocessing.get_context('spawn').Pool(3) as workers:
+        results = workers.starmap(allocate, [(db_path, 1, 4, 25)] * 3)
+    allocated = [allocated_id for ids in results for allocated_id in ids]
+    assert sorted(allocated) == list(range(1, 301))
+
+
+def test_blocks_never_overlap_across_processes(db_path):
+    with multiprocessing.get_context('spawn').Pool(3) as workers:
+        results = workers.starmap(allocate, [(db_path, 16, 4, 25)] * 3)
+    allocated = [allocated_id for ids in results for allocated_id in ids]
+    assert len(allocated) == len(set(allocated)) == 300
+
+
+def test_reservations_are_disjoint_and_owned_by_their_room(db_path):
+    allocator = OperationIdAllocator(block_size=1)
+    reserved = {1: [], 2: []}
+
+    def reserve(room_id):
+        return lambda: [reserved[room_id].extend(allocator.reserve(5, room_id)) for _ in range(10)]
+
+    threads = [threading.Thread(target=reserve(room_id)) for room_id in (1, 2) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    allocated = [allocator.next_id() for _ in range(20)]
+    for thread in threads:
+        thread.join()
+
+    every_id = reserved[1] + reserved[2] + allocated
+    assert sorted(every_id) == list(range(1, len(every_id) + 1))
+    assert all(allocator.reserved_room(operation_id) == 1 for operation_id in reserved[1])
+    assert all(allocator.reserved_room(operation_id) == 2 for operation_id in reserved[2])
+    assert all(allocator.reserved_room(operation_id) is None for operation_id in allocated)
+    assert database.get_counter('operation') == len(every_id)
+
+
+def test_create_operation_only_takes_ids_reserved_for_its_room(db_path):
+    import api
+
+    client = api.app.test_client()
+    reserved = client.post('/api/operationIds', json={'count': 2, 'roomId': 1}).json['operationIds']
+    operation = {'roomId': 2, 'userId': 1, 'patientFirstName': 'Jan', 'patientLastName': 'Nowak',
+                 'patientId': '90010112345', 'operationType': 'Appendectomy'}
+
+    assert client.post('/api/createOperation', json={**operation, 'operationId': reserved[0]}).status_code == 403
+    assert client.post('/api/createOperation', json={**operation, 'operationId': 99}).status_code == 400
+    created = client.post('/api/createOperation', json={**operation, 'roomId': 1, 'operationId': reserved[0]})
+    assert created.status_code == 200
+    # The last operation created, not the highest id reserved
+    assert client.get('/api/lastOperationId').json['max_operation_id'] == reserved[0]
@@ -0,0 +1,8 @@
+from benchmarks.bench_startup import LAZY_MODULES, cold_start
+
+
+def test_importing_the_api_leaves_reports_and_elevenlabs_unloaded(db_path):
+    # A fresh interpreter imports api and answers one request
+    run = cold_start(db_path)
+    assert 'reportlab' in LAZY_MODULES and 'elevenlabs' in LAZY_MODULES
+    assert run['loaded'] == []
@@ -0,0 +1,63 @@
+import re
+from collections import namedtuple
+
+
+# Controlled substances counted by /api/narcotics, each with the word stems
+# (English and Polish spellings, common brand names) that name it in a note
+CONTROLLED_SUBSTANCES = {
+    'fentanyl': ('fentanyl', 'fentanil'),
+    'sufentanil': ('sufentanyl', 'sufentanil'),
+    'remifentanil': ('remifentanyl', 'remifentanil', 'ultiva'),
+    'alfentanil': ('alfentanyl', 'alfentanil'),
+    'morphine': ('morphin', 'morfin'),
+    'oxycodone': ('oxycodon', 'oksykodon'),
+    'hydromorphone': ('hydromorphon', 'hydromorfon'),
+    'methadone': ('methadon', 'metadon'),
+    'pethidine': ('pethidin', 'petydyn', 'meperidin', 'dolargan'),
+    'ketamine': ('ketamin',),
+    'midazolam': ('midazolam',),
+    'diazepam': ('diazepam', 'relanium'),
+}
+
+# Event types the agent records administered drugs under
+NARCOTIC_EVENT_TYPES = ('medicine', 'anestesia')
+
+# Dose units by the letters they start with, as a factor to milligrams
+UNIT_TO_MG = (
+    ('mcg', 0.001), ('µg', 0.001), ('μg', 0.001), ('ug', 0.001), ('γ', 0.001),
+    ('micro', 0.001), ('mikro', 0.001), ('mg', 1), ('milli', 1), ('mili', 1), ('g', 1000),
+)
+
+STEMS = {stem: drug for drug, stems in CONTROLLED_SUBSTANCES.items() for stem in stems}
+DRUG_PATTERN = re.compile(r'\b(' + '|'.join(sorted(STEMS, key=len, reverse=True)) + r')\w*', re.IGNORECASE)
+DOSE_PATTERN = re.compile(
+    r'(\d+(?:[.,]\d+)?)\s*(mcg|µg|μg|ug|γ|(?:micro|mikro|milli|mili)?gram\w*|mg|g)(?!\w)', re.IGNORECASE
+)
+
+Administration = namedtuple('Administration', ['drug', 'dose_mg'])
+
+
+def _dose_mg(match):
+    amount = float(match.group(1).replace(',', '.'))
+    unit = match.group(2).lower()
+    for prefix, factor in UNIT_TO_MG:
+        if unit.startswith(prefix):
+            return amount * factor
+    return None
+
+
+def parse_administrations(event_value):
+    # Controlled substances named in a note, each with the dose written after
+    # it ("Fentanyl 100mcg, midazolam 2 mg") or, failing that, before it
+    # ("podano 0,1 mg fentanylu"); dose_mg is None when no mass is given
+    mentions = list(DRUG_PATTERN.finditer(event_value))
+    administrations = []
+    taken = 0
+    for i, mention in enumerate(mentions):
+        next_start = mentions[i + 1].start() if i + 1 < len(mentions) else len(event_value)
+        dose = (DOSE_PATTERN.search(event_value, mention.end(), next_start)
+                or DOSE_PATTERN.search(event_value, taken, mention.start()))
+        # A dose belongs to one drug only
+        taken = dose.end() if dose and dose.end() > mention.end() else mention.end()
+        administrations.append(Administration(STEMS[mention.group(1).lower()], _dose_mg(dose) if dose else None))
+    return administrations
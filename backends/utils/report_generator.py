@@ -1,34 +1,239 @@
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import Table, TableStyle, SimpleDocTemplate, Paragraph, Spacer, Image
+from reportlab.platypus import Table, TableStyle, SimpleDocTemplate, Paragraph, Spacer, Image, Flowable
 from reportlab.lib import colors
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.pdfbase.pdfdoc import PDFStream, PDFZCompress
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from collections import namedtuple
 import json
+import logging
 import os
-from io import BytesIO
+import tempfile
+import threading
 import database
+from observability import REPORT_PHASE_SECONDS, timed
 from datetime import datetime
+from io import BytesIO
+from PIL import Image as PILImage
 import pytz
 
-def create_report(elevenlabs_response, surgery_details, operation_id):
-    firstName = surgery_details['patient_first_name']
-    lastName = surgery_details['patient_last_name']
-    procedure = surgery_details['operation_type']
-    patientId = surgery_details['patient_id']
 
-    summary = elevenlabs_response['analysis']['transcript_summary']
-    duration_sec = elevenlabs_response['metadata']['call_duration_secs']
-    transcript = elevenlabs_response['transcript']
-    
-    # Załaduj logo
-    logo_path = "utils/public/logo.png"
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=1.5*inch, height=1.5*inch)  # Ustawienie rozmiaru logo
-    else:
-        logo = None  # Jeśli logo nie istnieje, pomijamy je
+# Reports are spooled in memory up to this size and then moved to a temp file on disk
+REPORT_SPOOL_MAX_BYTES = int(os.getenv('REPORT_SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+# Events are laid out as a series of tables of at most this many rows, which
+# keeps reportlab's table layout and page splitting cost per chunk bounded
+REPORT_TABLE_CHUNK_ROWS = int(os.getenv('REPORT_TABLE_CHUNK_ROWS', '200'))
+REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'Europe/Warsaw')
+LOGO_PATH = "utils/public/logo.png"
+LOGO_SIZE = 1.5*inch
+# The logo is drawn at 1.5 inch, so 300 dpi is plenty and far cheaper to embed
+LOGO_DPI = 300
+EVENT_COLUMN_WIDTHS = [2.5*inch, 4*inch]
+EVENT_CELL_PADDING = 6
 
-    # Kolekcjonowanie eventów
-    events = []
+# One events table row, laid out ahead of time: cell texts already wrapped to
+# the column widths (lines joined with newlines) and the row height they need
+EventRow = namedtuple('EventRow', ['cells', 'height'])
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCanvas(Canvas):
+    # Page streams stay zlib-compressed but are not also ASCII85-encoded: that
+    # encoding only made them 25% larger and took ~0.5 s of a 10000-event
+    # report. Done per page rather than through rl_config.useA85, which would
+    # change every PDF made in the process.
+    def showPage(self):
+        super().showPage()
+        page = self._doc.Pages.pages[-1]
+        if page.compression and page.stream:
+            page.Contents = PDFStream(content=page.stream, filters=[PDFZCompress])
+            page.Contents.__Comment__ = "page stream"
+
+
+class ReportTemplate:
+    # Everything that does not depend on the surgery being reported: style
+    # sheet, paragraph and table styles, the logo and the report timezone.
+    # Built once per process by get_report_template().
+    def __init__(self, logo_path=LOGO_PATH, timezone_name=REPORT_TIMEZONE):
+        # Style
+        styles = getSampleStyleSheet()
+        self.title_style = styles['Heading1']
+        self.heading_style = styles['Heading2']
+        self.normal_style = styles['Normal']
+
+        self.wrapped_style = ParagraphStyle(
+            'WrappedStyle',
+            parent=styles['Normal'],
+            spaceBefore=10,
+            spaceAfter=10,
+            leading=12
+        )
+
+        self.cell_style = ParagraphStyle(
+            'CellStyle',
+            parent=styles['Normal'],
+            fontSize=10,
+            leading=12,
+            spaceBefore=3,
+            spaceAfter=3
+        )
+
+        # Event rows have always used the default paragraph style
+        self.event_cell_style = ParagraphStyle('CellStyle')
+
+        # Define the custom style for "MediceusAI" branding
+        self.mediceus_style = ParagraphStyle(
+            'MediceusStyle',
+            fontName='Helvetica-Bold',
+            fontSize=14,
+            textColor=colors.HexColor("#1E3A8A"),  # Equivalent to text-blue-900
+            alignment=1,  # Center align inside its cell
+            spaceBefore=6
+        )
+
+        # Align content inside the rightmost column
+        self.logo_and_text_style = TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  # Center align inside the column
+            ('VALIGN', (0, 0), (-1, -1), 'TOP')  # Align to the top
+        ])
+
+        # Apply alignment to ensure logo & text are in the top-right corner
+        self.header_table_style = TableStyle([
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),  # Right align the entire cell
+            ('VALIGN', (1, 0), (1, 0), 'TOP'),  # Align to the top of the page
+        ])
+
+        # Style tabeli
+        self.header_color = colors.Color(0.3, 0.3, 0.3)
+        self.row1_color = colors.Color(0.95, 0.95, 0.95)
+        self.row2_color = colors.Color(1, 1, 1)
+
+        self.events_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), self.header_color),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('BOX', (0, 0), (-1, -1), 2, colors.black),
+            ('LEFTPADDING', (0, 0), (-1, -1), EVENT_CELL_PADDING),
+            ('RIGHTPADDING', (0, 0), (-1, -1), EVENT_CELL_PADDING),
+            ('TOPPADDING', (0, 0), (-1, -1), EVENT_CELL_PADDING),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), EVENT_CELL_PADDING),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            # Striping for all body rows in one command instead of one BACKGROUND per row
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [self.row2_color, self.row1_color]),
+        ])
+
+        self.timezone = pytz.timezone(timezone_name)
+        self.logo_png = self._load_logo(logo_path)
+
+    @staticmethod
+    def _load_logo(logo_path):
+        # Załaduj logo, przeskalowane raz do rozmiaru w raporcie
+        if not os.path.exists(logo_path):
+            return None  # Jeśli logo nie istnieje, pomijamy je
+
+        pixels = int(LOGO_SIZE / inch * LOGO_DPI)
+        with PILImage.open(logo_path) as image:
+            image.thumbnail((pixels, pixels))
+            png = BytesIO()
+            image.save(png, format='PNG')
+        return png.getvalue()
+
+    def logo(self):
+        if self.logo_png is None:
+            return None
+        return Image(BytesIO(self.logo_png), width=LOGO_SIZE, height=LOGO_SIZE)  # Ustawienie rozmiaru logo
+
+    def make_events_table(self, rows):
+        # Header paragraphs are created per table: reportlab keeps layout
+        # state on them, so they cannot be shared between concurrent reports
+        header = [Paragraph("Timestamp", self.cell_style), Paragraph("Event Value", self.cell_style)]
+        table_data = [header] + [row.cells for row in rows]
+        # Known row heights spare reportlab measuring every cell
+        row_heights = [None] + [row.height for row in rows]
+        table = Table(table_data, colWidths=EVENT_COLUMN_WIDTHS, rowHeights=row_heights, repeatRows=1)
+
+        table.setStyle(self.events_table_style)
+        return table
+
+    def event_row(self, local_time, event_value):
+        # Plain text cells in the font of the paragraphs rows used to be,
+        # wrapped here once so laying out the table is only drawing strings
+        cells = [
+            self._wrap(str(text), width - 2 * EVENT_CELL_PADDING)
+            for text, width in zip((local_time, event_value), EVENT_COLUMN_WIDTHS)
+        ]
+        lines = max(len(cell) for cell in cells)
+        return EventRow(
+            ['\n'.join(cell) for cell in cells],
+            lines * self.event_cell_style.leading + 2 * EVENT_CELL_PADDING
+        )
+
+    def _wrap(self, text, width):
+        font, size = self.event_cell_style.fontName, self.event_cell_style.fontSize
+        lines = []
+        for line in simpleSplit(text, font, size, width) or ['']:
+            # Words wider than the column are broken like paragraphs break them
+            while stringWidth(line, font, size) > width and len(line) > 1:
+                cut = len(line) - 1
+                while cut > 1 and stringWidth(line[:cut], font, size) > width:
+                    cut -= 1
+                lines.append(line[:cut])
+                line = line[cut:]
+            lines.append(line)
+        return lines
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def get_report_template():
+    global _template
+    with _template_lock:
+        if _template is None:
+            _template = ReportTemplate()
+        return _template
+
+
+class EventTableChunks(Flowable):
+    # Stands in for the events table in the flowable list. It never fits a
+    # frame whole, so reportlab asks it to split; each split materialises the
+    # next chunk of rows as a real Table, so only the chunk being laid out
+    # holds table layout state however long the surgery was.
+    def __init__(self, rows, template, chunk_rows, start=0):
+        Flowable.__init__(self)
+        self.rows = rows
+        self.template = template
+        self.chunk_rows = chunk_rows
+        self.start = start
+
+    def wrap(self, availWidth, availHeight):
+        return availWidth, availHeight + 1
+
+    def split(self, availWidth, availHeight):
+        end = self.start + self.chunk_rows
+        table = self.template.make_events_table(self.rows[self.start:end])
+        parts = table.splitOn(self.canv, availWidth, availHeight)
+        if not parts:
+            return []
+        if end < len(self.rows):
+            parts.append(EventTableChunks(self.rows, self.template, self.chunk_rows, end))
+        return parts
+
+    def draw(self):
+        pass
+
+
+def displayed_event_values(transcript):
+    # Event values the agent showed through displayEvent tool calls, in transcript order
+    values = []
     for element in transcript:
         try:
             if not element['tool_calls']:
@@ -37,41 +242,94 @@ def create_report(elevenlabs_response, surgery_details, operation_id):
                 tool_name = tool_call.get('tool_name')
                 if tool_name != 'displayEvent':
                     continue
-                    
+
                 params = tool_call.get('params_as_json', '{}')
                 if isinstance(params, dict):
                     params_dict = params
                 else:
                     params_dict = json.loads(params)
-                
+
                 if 'eventType' in params_dict and 'eventValue' in params_dict:
-                    event_with_timestamp = database.get_events_for_operation_id_and_value(operation_id, params_dict['eventValue'])
-                    if event_with_timestamp:
-                        print(f"Event {params_dict['eventValue']} with timestamp: {event_with_timestamp[0]}")
-                        # Convert string to datetime object in UTC
-                        utc_timezone = pytz.utc
-                        utc_time = datetime.strptime(event_with_timestamp[0], "%Y-%m-%d %H:%M:%S")
-                        utc_time = utc_timezone.localize(utc_time)
-                        print("UTC time: ", utc_time)
-
-                        # Convert to Warsaw time
-                        warsaw_timezone = pytz.timezone("Europe/Warsaw")
-                        warsaw_time = utc_time.astimezone(warsaw_timezone)
-                        print("Warsaw time: ", warsaw_time)
-                        warsaw_time = warsaw_time.strftime("%Y-%m-%d %H:%M:%S")
-                        print("Warsaw time string: ", warsaw_time)
-                        event_timestamps = Paragraph(warsaw_time, ParagraphStyle('CellStyle'))
-                    else:
-                        event_timestamps = Paragraph(" ", ParagraphStyle('CellStyle'))
-                    event_value = Paragraph(params_dict['eventValue'], ParagraphStyle('CellStyle'))
-                    events.append([event_timestamps, event_value])
+                    values.append(params_dict['eventValue'])
         except Exception as e:
-            print(f"Error processing event: {str(e)}")
+            logger.warning("Error processing event: %s", e)
+            continue
+    return values
+
+
+def convert_timestamps(timestamps, timezone):
+    # Converts SQLite UTC timestamps to local time strings in one pass. The UTC
+    # offset only changes at DST transitions, so it is resolved once per hour
+    # bucket and shared by every timestamp in it instead of localising each one.
+    offsets = {}
+    converted = {}
+    for timestamp in timestamps:
+        if timestamp in converted:
             continue
+        try:
+            utc_time = datetime.fromisoformat(timestamp)
+        except ValueError as e:
+            logger.warning("Error processing event: %s", e)
+            continue
+        hour = timestamp[:13]
+        offset = offsets.get(hour)
+        if offset is None:
+            hour_start = pytz.utc.localize(utc_time.replace(minute=0, second=0, microsecond=0))
+            offset = offsets[hour] = hour_start.astimezone(timezone).utcoffset()
+        converted[timestamp] = (utc_time + offset).isoformat(" ", "seconds")
+    return converted
+
+
+def build_event_rows(event_timestamps_by_value, template):
+    # Event value -> EventRow showing the local time of its first occurrence
+    local_times = convert_timestamps(
+        (timestamp for timestamp in event_timestamps_by_value.values() if timestamp), template.timezone
+    )
+    return {
+        value: template.event_row(local_times.get(timestamp, " "), value)
+        for value, timestamp in event_timestamps_by_value.items()
+    }
+
+
+def prepare_events(transcript, event_rows_by_value, template):
+    # Rows in transcript order; values never sent as notes get no timestamp
+    rows = []
+    for value in displayed_event_values(transcript):
+        row = event_rows_by_value.get(value)
+        rows.append(row if row is not None else template.event_row(" ", value))
+    return rows
+
+
+def report_filename(surgery_details):
+    return f"surgery_report_{surgery_details['patient_id']}.pdf"
+
+
+def create_report(elevenlabs_response, surgery_details, operation_id, event_rows_by_value=None, template=None):
+    template = template or get_report_template()
+
+    firstName = surgery_details['patient_first_name']
+    lastName = surgery_details['patient_last_name']
+    procedure = surgery_details['operation_type']
+    patientId = surgery_details['patient_id']
+
+    summary = elevenlabs_response['analysis']['transcript_summary']
+    duration_sec = elevenlabs_response['metadata']['call_duration_secs']
+    transcript = elevenlabs_response['transcript']
     
+    # Kolekcjonowanie eventów
+    # The API keeps rows for every operation up to date as notes arrive
+    # (services.report_state) and passes them in; without them all timestamps
+    # for the operation are fetched in one query and laid out here
+    with timed(REPORT_PHASE_SECONDS, phase='prepare'):
+        if event_rows_by_value is None:
+            event_rows_by_value = build_event_rows(
+                database.get_event_timestamps_for_operation_id(operation_id), template
+            )
+        events = prepare_events(transcript, event_rows_by_value, template)
+
     # Tworzenie pliku PDF
-    output_filename = f"surgery_report_{patientId}.pdf"
-    buffer = BytesIO()
+    output_filename = report_filename(surgery_details)
+    buffer = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_MAX_BYTES)
     doc = SimpleDocTemplate(
         buffer,
         pagesize=letter,
@@ -81,134 +339,63 @@ def create_report(elevenlabs_response, surgery_details, operation_id):
         bottomMargin=72
     )
     
-    # Style
-    styles = getSampleStyleSheet()
-    title_style = styles['Heading1']
-    heading_style = styles['Heading2']
-    normal_style = styles['Normal']
-    
-    wrapped_style = ParagraphStyle(
-        'WrappedStyle',
-        parent=styles['Normal'],
-        spaceBefore=10,
-        spaceAfter=10,
-        leading=12
-    )
-    
-    cell_style = ParagraphStyle(
-        'CellStyle',
-        parent=styles['Normal'],
-        fontSize=10,
-        leading=12,
-        spaceBefore=3,
-        spaceAfter=3
-    )
-
     # **Budowanie treści raportu**
     content = []
 
     # **Dodanie przestrzeni przed tytułem, aby logo było niżej**
     content.append(Spacer(1, 30))  # Odstęp przed tytułem i logo
-    # Define the custom style for "MediceusAI" branding
-    mediceus_style = ParagraphStyle(
-        'MediceusStyle',
-        fontName='Helvetica-Bold',
-        fontSize=14,
-        textColor=colors.HexColor("#1E3A8A"),  # Equivalent to text-blue-900
-        alignment=1,  # Center align inside its cell
-        spaceBefore=6
-    )
-
     # Create the "MediceusAI" text
-    mediceus_text = Paragraph("MediceusAI", mediceus_style)
+    mediceus_text = Paragraph("MediceusAI", template.mediceus_style)
 
     # Stack logo and text in a vertical table (single-column)
-    logo_and_text = Table([[logo], [mediceus_text]], colWidths=[1.5*inch])
-
-    # Align content inside the rightmost column
-    logo_and_text.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  # Center align inside the column
-        ('VALIGN', (0, 0), (-1, -1), 'TOP')  # Align to the top
-    ]))
+    logo_and_text = Table([[template.logo()], [mediceus_text]], colWidths=[1.5*inch])
+    logo_and_text.setStyle(template.logo_and_text_style)
 
     # Create a header table with two columns (left empty, right contains logo+text)
     header_table = Table([["", logo_and_text]], colWidths=[None, 1.5*inch])
-
-    # Apply alignment to ensure logo & text are in the top-right corner
-    header_table.setStyle(TableStyle([
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),  # Right align the entire cell
-        ('VALIGN', (1, 0), (1, 0), 'TOP'),  # Align to the top of the page
-    ]))
+    header_table.setStyle(template.header_table_style)
 
     # Add the header table to the document content
     content.append(header_table)
     content.append(Spacer(1, 12))  # Add spacing
 
     # Add the "Surgery Report" title below
-    content.append(Paragraph("Surgery Report", title_style))
+    content.append(Paragraph("Surgery Report", template.title_style))
     content.append(Spacer(1, 12))  # Additional spacing before patient details
 
 
 
     # **Informacje o pacjencie**
-    content.append(Paragraph(f"Patient First Name: {firstName}", normal_style))
-    content.append(Paragraph(f"Patient Last Name: {lastName}", normal_style))
-    content.append(Paragraph(f"Procedure: {procedure}", normal_style))
-    content.append(Paragraph(f"Patient ID: {patientId}", normal_style))
+    content.append(Paragraph(f"Patient First Name: {firstName}", template.normal_style))
+    content.append(Paragraph(f"Patient Last Name: {lastName}", template.normal_style))
+    content.append(Paragraph(f"Procedure: {procedure}", template.normal_style))
+    content.append(Paragraph(f"Patient ID: {patientId}", template.normal_style))
     content.append(Spacer(1, 12))
     
     # **Czas trwania rozmowy**
-    content.append(Paragraph(f"Duration: {duration_sec} seconds", normal_style))
+    content.append(Paragraph(f"Duration: {duration_sec} seconds", template.normal_style))
     content.append(Spacer(1, 12))
     
     # **Podsumowanie**
-    content.append(Paragraph("Summary:", heading_style))
-    content.append(Paragraph(summary, wrapped_style))
+    content.append(Paragraph("Summary:", template.heading_style))
+    content.append(Paragraph(summary, template.wrapped_style))
     content.append(Spacer(1, 12))
     
     # **Sekcja z eventami**
-    content.append(Paragraph("Events:", heading_style))
+    content.append(Paragraph("Events:", template.heading_style))
     content.append(Spacer(1, 12))
     
     # **Tworzenie tabeli eventów**
-    header = [Paragraph("Timestamp", cell_style), Paragraph("Event Value", cell_style)]
-    table_data = [header] + events
-    
-    table = Table(table_data, colWidths=[2.5*inch, 4*inch], repeatRows=1)
-    
-    # Style tabeli
-    header_color = colors.Color(0.3, 0.3, 0.3)
-    row1_color = colors.Color(0.95, 0.95, 0.95)
-    row2_color = colors.Color(1, 1, 1)
-    
-    style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), header_color),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BOX', (0, 0), (-1, -1), 2, colors.black),
-        ('LEFTPADDING', (0, 0), (-1, -1), 6),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ])
-    
-    for i in range(1, len(table_data)):  
-        if i % 2 == 0:
-            style.add('BACKGROUND', (0, i), (-1, i), row1_color)
-        else:
-            style.add('BACKGROUND', (0, i), (-1, i), row2_color)
-    
-    table.setStyle(style)
-    content.append(table)
-    
+    if events:
+        content.append(EventTableChunks(events, template, REPORT_TABLE_CHUNK_ROWS))
+    else:
+        content.append(template.make_events_table([]))
+
     # **Generowanie raportu**
-    doc.build(content)
+    with timed(REPORT_PHASE_SECONDS, phase='build'):
+        doc.build(content, canvasmaker=ReportCanvas)
     
     buffer.seek(0)  # Ensure the buffer is positioned at the beginning
-    print(f"PDF report saved as {output_filename}")
+    logger.debug("Report built", extra={'operation_id': operation_id, 'events': len(events)})
     
     return buffer, output_filename
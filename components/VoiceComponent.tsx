@@ -6,6 +6,7 @@ import { Button } from "@/components/ui/button";
 import { Mic, MicOff } from "lucide-react";
 import { useTable } from "@/components/TableContext";
 import { useConversation } from "@/components/ConversationContext";
+import { authHeaders } from "@/lib/utils";
 
 interface VoiceChatProps {
   operationId: string | null;
@@ -55,7 +56,8 @@ const VoiceChat = ({ operationId }: VoiceChatProps) => {
             await fetch('http://localhost:5000/api/sendNotes', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    ...authHeaders()
                 },
                 body: JSON.stringify({ operationId, eventValue, eventType })
             });
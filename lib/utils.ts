@@ -4,3 +4,10 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs))
 }
+
+// Bearer token saved at login ("remember me" keeps it in localStorage)
+export function authHeaders(): Record<string, string> {
+  if (typeof window === "undefined") return {}
+  const token = sessionStorage.getItem("authToken") || localStorage.getItem("authToken")
+  return token ? { Authorization: `Bearer ${token}` } : {}
+}